@@ -0,0 +1,102 @@
+"""
+A minimal in-process ASGI driver: requests go straight into the app's
+__call__, with no sockets, HTTP parsing or client library in the way, so
+what gets measured is the app itself.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Tuple
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+class ASGIClient:
+
+    def __init__(self, app, host: str = "bench"):
+        self.app = app
+        self.host = host
+
+    async def request(self, method: str, path: str, body: bytes = b"") -> Tuple[int, Headers, bytes]:
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode("latin-1"),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [
+                (b"host", self.host.encode("latin-1")),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": (self.host, 80),
+        }
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if sent:
+                # Nothing more to read; park until the app gives up on us.
+                await asyncio.Event().wait()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        status = None
+        headers = []
+        chunks = []
+
+        async def send(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, headers, b"".join(chunks)
+
+    async def post(self, path: str, body: bytes):
+        return await self.request("POST", path, body)
+
+    async def get(self, path: str):
+        return await self.request("GET", path)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Runs the app's startup handlers (e.g. the challenge pool refill tasks)
+    on entry and its shutdown handlers on exit.
+    """
+    messages = asyncio.Queue()
+    started = asyncio.get_running_loop().create_future()
+    stopped = asyncio.get_running_loop().create_future()
+
+    async def receive():
+        return await messages.get()
+
+    async def send(message):
+        kind = message["type"]
+        if kind == "lifespan.startup.complete":
+            started.set_result(None)
+        elif kind == "lifespan.startup.failed":
+            started.set_exception(RuntimeError(message.get("message", "startup failed")))
+        elif kind == "lifespan.shutdown.complete":
+            stopped.set_result(None)
+        elif kind == "lifespan.shutdown.failed":
+            stopped.set_exception(RuntimeError(message.get("message", "shutdown failed")))
+
+    task = asyncio.create_task(app({"type": "lifespan", "asgi": {"version": "3.0"}}, receive, send))
+    await messages.put({"type": "lifespan.startup"})
+    await started
+    try:
+        yield app
+    finally:
+        await messages.put({"type": "lifespan.shutdown"})
+        await stopped
+        await task
@@ -0,0 +1,46 @@
+"""
+Compares the original request decode path (json + a full WebhookRequest)
+with vocaptcha.decoding on the recorded payloads in tests/cases.
+
+    python -m benchmarks.decode [--number 20000] [--fields sessionInfo]
+"""
+import argparse
+import glob
+import json
+import os
+import timeit
+
+from cxwebhooks import WebhookRequest
+
+from service.vocaptcha import decoding
+
+
+def original(raw):
+    return WebhookRequest(**json.loads(raw))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", default="tests/cases/*.json")
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--fields", nargs="*", default=["sessionInfo"])
+    args = parser.parse_args()
+    fields = tuple(args.fields)
+
+    print(f"parser: {decoding.loads.__module__}.{decoding.loads.__name__}  fields: {fields}")
+    print(f"{'case':40} {'original':>12} {'fast':>12} {'speedup':>8}")
+    for path in sorted(glob.glob(args.cases)):
+        with open(path, "rb") as src:
+            raw = src.read()
+        before = min(timeit.repeat(lambda: original(raw), number=args.number, repeat=3))
+        after = min(timeit.repeat(lambda: decoding.decode(raw, fields), number=args.number, repeat=3))
+        print(
+            f"{os.path.basename(path):40} "
+            f"{before / args.number * 1e6:10.2f}us "
+            f"{after / args.number * 1e6:10.2f}us "
+            f"{before / after:7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
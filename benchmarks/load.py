@@ -0,0 +1,273 @@
+"""
+Replays recorded webhook traffic against the app in-process (through
+benchmarks.asgi - no sockets) with the memory cache backend, and reports
+throughput and p50/p95/p99 latency per route.
+
+    python -m benchmarks.load [--requests 5000] [--concurrency 32]
+        [--cases "tests/cases/*.json"] [--traffic traffic.jsonl ...]
+        [--mix sentences/verify=3 nato-alphabet/generate=1]
+        [--output after.json] [--compare before.json]
+
+Traffic files are JSON lines, one request per line:
+
+    {"path": "/sentences/verify", "body": {...a WebhookRequest...}}
+
+By default every recorded request is equally likely; --mix weights routes
+(plugin/action) relative to each other.  --output saves the results as JSON
+and --compare prints the change against a saved run.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from service.vocaptcha.logs import logger
+from service.vocaptcha.server import VoCaptchaServer, VoCaptchaManager
+
+from benchmarks.asgi import ASGIClient, lifespan
+
+Traffic = List[Tuple[str, bytes]]
+
+# tests/cases/<action>_<plugin>[_<variant>].json -> mount, as in tests/curl.sh.
+MOUNTS = {
+    "add_two_numbers": "/add-two-numbers",
+    "nato_passphrase": "/nato-alphabet",
+    "sentences": "/sentences",
+}
+# AddTwoNumbersPlugin.verify isn't implemented (it's left to DFCX).
+SKIP = {"verify_add_two_numbers.json"}
+
+
+def case_route(path: str) -> Optional[str]:
+    name = os.path.basename(path)
+    if name in SKIP:
+        return None
+    action, _, rest = name[:-len(".json")].partition("_")
+    for plugin, mount in MOUNTS.items():
+        if rest == plugin or rest.startswith(plugin + "_"):
+            return f"{mount}/{action}"
+    return None
+
+
+def load_cases(pattern: str) -> Traffic:
+    traffic = []
+    for path in sorted(glob.glob(pattern)):
+        route = case_route(path)
+        if route is None:
+            continue
+        with open(path, "rb") as src:
+            traffic.append((route, json.dumps(json.load(src)).encode("utf-8")))
+    return traffic
+
+
+def load_traffic(path: str) -> Traffic:
+    traffic = []
+    with open(path) as src:
+        for number, line in enumerate(src, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "path" not in record or "body" not in record:
+                print(f"{path}:{number}: skipped, needs 'path' and 'body'")
+                continue
+            traffic.append((record["path"], json.dumps(record["body"]).encode("utf-8")))
+    return traffic
+
+
+def parse_mix(items: List[str]) -> Dict[str, float]:
+    mix = {}
+    for item in items:
+        route, _, weight = item.partition("=")
+        mix["/" + route.strip("/")] = float(weight or 1)
+    return mix
+
+
+def schedule(traffic: Traffic, mix: Dict[str, float], count: int, seed: int) -> Traffic:
+    """
+    Draws count requests from the recorded traffic.  A route's weight is
+    spread evenly over its recordings; routes missing from mix get 1, or 0
+    if a mix was given.
+    """
+    per_route = Counter(route for route, _ in traffic)
+    default = 0.0 if mix else 1.0
+    weights = [mix.get(route, default) / per_route[route] for route, _ in traffic]
+    if not any(weights):
+        raise SystemExit("--mix doesn't match any recorded route")
+    return random.Random(seed).choices(traffic, weights=weights, k=count)
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not ordered:
+        return 0.0
+    rank = max(1, int(round(q / 100 * len(ordered) + 0.5 - 1e-9)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(latencies: List[float], statuses: Counter, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    count = len(ordered)
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        "requests": count,
+        "errors": sum(n for status, n in statuses.items() if status >= 400),
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        "throughput": round(count / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": ms(sum(ordered) / count) if count else 0.0,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1]) if count else 0.0,
+    }
+
+
+async def replay(client: ASGIClient, requests: Traffic, concurrency: int):
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    position = 0
+
+    async def worker():
+        nonlocal position
+        while position < len(requests):
+            route, body = requests[position]
+            position += 1
+            start = time.perf_counter()
+            status, _, _ = await client.post(route, body)
+            latencies[route].append(time.perf_counter() - start)
+            statuses[route][status] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def build_app(config_path: str = "service/vocaptcha.yaml"):
+    config = VoCaptchaManager(path=config_path, backend="memory").config
+    return VoCaptchaServer.from_config(config)()
+
+
+def revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def benchmark(app, traffic: Traffic, requests: int, concurrency: int,
+                    mix: Dict[str, float] = None, warmup: int = 200, seed: int = 0) -> dict:
+    mix = mix or {}
+    client = ASGIClient(app)
+    async with lifespan(app):
+        if warmup:
+            await replay(client, schedule(traffic, mix, warmup, seed + 1), concurrency)
+        latencies, statuses, elapsed = await replay(
+            client, schedule(traffic, mix, requests, seed), concurrency
+        )
+    combined = Counter()
+    for counts in statuses.values():
+        combined.update(counts)
+    return {
+        "meta": {
+            "revision": revision(),
+            "python": platform.python_version(),
+            "timestamp": time.time(),
+            "requests": requests,
+            "concurrency": concurrency,
+            "warmup": warmup,
+            "seed": seed,
+            "mix": mix,
+            "elapsed_s": round(elapsed, 3),
+        },
+        "total": summarize(
+            [latency for values in latencies.values() for latency in values],
+            combined, elapsed
+        ),
+        "routes": {
+            route: summarize(latencies[route], statuses[route], elapsed)
+            for route in sorted(latencies)
+        },
+    }
+
+
+def report(results: dict):
+    columns = ("requests", "errors", "throughput", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+    print(f"{'route':28} " + " ".join(f"{column:>10}" for column in columns))
+    rows = list(results["routes"].items()) + [("total", results["total"])]
+    for route, summary in rows:
+        print(f"{route:28} " + " ".join(f"{summary[column]:>10}" for column in columns))
+
+
+def compare(before: dict, after: dict):
+    """
+    Prints the relative change per route; negative latency deltas and
+    positive throughput deltas are improvements.
+    """
+    columns = ("throughput", "p50_ms", "p95_ms", "p99_ms")
+    print(f"{'route':28} " + " ".join(f"{column:>12}" for column in columns))
+    routes = sorted(set(before["routes"]) & set(after["routes"])) + ["total"]
+    for route in routes:
+        old = before["total"] if route == "total" else before["routes"][route]
+        new = after["total"] if route == "total" else after["routes"][route]
+        cells = []
+        for column in columns:
+            if old[column]:
+                cells.append(f"{(new[column] - old[column]) / old[column] * 100:+11.1f}%")
+            else:
+                cells.append(f"{'n/a':>12}")
+        print(f"{route:28} " + " ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="service/vocaptcha.yaml")
+    parser.add_argument("--cases", default="tests/cases/*.json")
+    parser.add_argument("--traffic", nargs="*", default=[])
+    parser.add_argument("--mix", nargs="*", default=[])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    parser.add_argument("--log", action="store_true", help="keep the structured log on stdout")
+    args = parser.parse_args()
+
+    traffic = load_cases(args.cases) if args.cases else []
+    for path in args.traffic:
+        traffic.extend(load_traffic(path))
+    if not traffic:
+        raise SystemExit("No traffic to replay")
+    if not args.log:
+        logger.stream = open(os.devnull, "w")
+
+    app = build_app(args.config)
+    results = asyncio.run(benchmark(
+        app, traffic, args.requests, args.concurrency,
+        mix=parse_mix(args.mix), warmup=args.warmup, seed=args.seed
+    ))
+    report(results)
+    if args.output:
+        with open(args.output, "w") as dst:
+            json.dump(results, dst, indent=2)
+    if args.compare:
+        with open(args.compare) as src:
+            before = json.load(src)
+        print(f"\nvs {args.compare} ({before['meta'].get('revision')}):")
+        compare(before, results)
+
+
+if __name__ == "__main__":
+    main()
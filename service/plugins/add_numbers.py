@@ -2,6 +2,7 @@ from random import randint
 from cxwebhooks import WebhookRequest, WebhookResponse
 
 from service.vocaptcha.plugins import VoCaptchaPlugin
+from service.vocaptcha.pools import Challenge
 
 
 class AddTwoNumbersPlugin(VoCaptchaPlugin):
@@ -13,6 +14,12 @@ class AddTwoNumbersPlugin(VoCaptchaPlugin):
         "min": 1,
         "max": 10
     }
+    PLACEHOLDERS = {
+        "generate": ("num1", "num2")
+    }
+    POOL_SIZE = 64
+    FIELDS = ()
+    ENCODED = True
 
     def challenge(self):
         MIN = self.PARAMS.get('min')
@@ -21,22 +28,24 @@ class AddTwoNumbersPlugin(VoCaptchaPlugin):
         num2 = randint(MIN, MAX)
         return num1, num2
 
+    def prepare(self, templates):
+        num1, num2 = self.challenge()
+        return Challenge(
+            text=templates['generate']['text'].render(num1=num1, num2=num2),
+            ssml=templates['generate']['ssml'].render(num1=num1, num2=num2),
+            params={
+                "challenge": num1 + num2,
+                "challenge-type": self.TYPE
+            }
+        )
+
     async def generate(
         self, 
         webhook: WebhookRequest, 
         templates=...,
         response=...
     ):
-        num1, num2 = self.challenge()
-        text = templates['generate']['text'].format(num1=num1, num2=num2)
-        ssml = templates['generate']['ssml'].format(num1=num1, num2=num2)
-        response.add_text_response(text)
-        response.add_audio_text_response(ssml)
-        response.add_session_params({
-            "challenge": num1 + num2,
-            "challenge-type": self.TYPE
-        })
-        return response
+        return self.serve(self.next_challenge(), response)
 
     async def verify(
         self, 
@@ -1,70 +1,58 @@
 from secrets import SystemRandom
 
-from fuzzywuzzy import fuzz
-
 from cxwebhooks import WebhookRequest, WebhookResponse
-from service.vocaptcha.plugins import VoCaptchaPlugin
+from service.vocaptcha.plugins import FuzzyMatchPlugin, CHALLENGES
+from service.vocaptcha.pools import Challenge
+from service.vocaptcha.corpus import Corpus
 
 
 
-class SentencesPlugin(VoCaptchaPlugin):
+class SentencesPlugin(FuzzyMatchPlugin):
 
     MOUNT = "/sentences"
     TYPE = "sentence-repetition"
     DOC = "sentences"
     PARAMS = {
+        "matcher": "levenshtein",
         "fuzz_threshold": 70
     }
+    PLACEHOLDERS = {
+        "generate": ("sentence",),
+        "verify": ("challenge", "challenge_response", "match")
+    }
+    POOL_SIZE = 64
+
+    def materialize(self, document):
+        # Sharded documents already arrive as a Corpus; an inline list is
+        # packed into one so both take the same compact path.
+        sentences = document.get(CHALLENGES) or ()
+        if not isinstance(sentences, Corpus):
+            sentences = Corpus.from_strings(sentences)
+        if not sentences:
+            raise NotImplementedError("No challenges found!  Please review.")
+        self.matcher.warm(sentences)
+        return sentences
 
     def challenge(self):
         picker = SystemRandom()
-        sentences = self.get_challenges()
+        sentences = self.materialized
         return picker.choice(sentences)
 
-    async def generate(
-        self, 
-        webhook: WebhookRequest, 
-        templates=...,
-        response=...
-    ):
+    def prepare(self, templates):
         sentence = self.challenge()
-        text = templates['generate']['text'].format(sentence=sentence)
-        ssml = templates['generate']['ssml'].format(sentence=sentence)
-        response.add_text_response(text)
-        response.add_audio_text_response(ssml)
-        response.add_session_params({
-            "challenge": sentence,
-            "challenge-type": self.TYPE
-        })
-        return response
+        return Challenge(
+            text=templates['generate']['text'].render(sentence=sentence),
+            ssml=templates['generate']['ssml'].render(sentence=sentence),
+            params={
+                "challenge": sentence,
+                "challenge-type": self.TYPE
+            }
+        )
 
-    async def verify(
+    async def generate(
         self, 
         webhook: WebhookRequest, 
         templates=...,
         response=...
     ):
-        parameters = webhook.sessionInfo.parameters
-        challenge = parameters.get('challenge')
-        challenge_type = parameters.get('challenge-type')
-        if challenge_type != self.TYPE or challenge is None:
-            response.add_text_response("Something went wrong.  Please reach out!")
-            return response
-        challenge_response = parameters.get('challenge-response')
-        ratio = fuzz.ratio(challenge, challenge_response)
-        print(f"{self.TYPE} - FUZZ RATIO: ", ratio)
-        print(f"challenge: {challenge} - response: {challenge_response}")
-        match = 'match' if ratio > self.PARAMS['fuzz_threshold'] else "don't match"
-        is_match = True if match == 'match' else False
-        text = templates['verify']['text'].format(
-            challenge=challenge,
-            challenge_response=challenge_response,
-            match=match
-        )
-        response.add_text_response(text)
-        response.add_audio_text_response(text)
-        response.add_session_params({
-            "challenge-response": challenge_response,
-            "challenge-passed": is_match
-        })
-        return response
+        return self.issue(webhook, self.next_challenge(), response)
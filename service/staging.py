@@ -1,22 +1,80 @@
-import copy
+import os
 import argparse
 import json
 import importlib
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 
 from google.cloud import firestore
 
 from service.vocaptcha.server import VoCaptchaManager, VoCaptchaConfig
+from service.vocaptcha.backends import (
+    FIRESTORE, MEMORY, document_hash, make_backend, plugin_document_path, plugin_shard_folder, shard_paths
+)
+from service.vocaptcha.cache import SHARDS, TEXT, shard_ids
+from service.vocaptcha.plugins import CHALLENGES
+from service.vocaptcha.corpus import (
+    Corpus, SHARD_BYTES, dedupe, read_entries, shard, shard_id
+)
+from service.vocaptcha.shared import write_snapshot
+from service.vocaptcha.warm import capture
+
+# Firestore caps a batched write at 500 operations and a request at 10 MiB.
+BATCH_LIMIT = 500
+BATCH_BYTES = 9 * 1024 * 1024
+
+UNCHANGED = "unchanged"
+CHANGED = "changed"
+MISSING = "missing"
+
+
+@dataclass
+class DocumentStatus:
+    doc_id: str
+    path: str
+    local: dict
+    remote: Optional[dict]
+    local_hash: str
+    remote_hash: Optional[str]
+    missing_shards: List[str] = field(default_factory=list)
+
+    @property
+    def state(self) -> str:
+        if self.remote_hash is None:
+            return MISSING
+        if self.missing_shards:
+            return CHANGED
+        return UNCHANGED if self.local_hash == self.remote_hash else CHANGED
 
 
 class VoCaptchaDataManager:
 
+    """
+    Syncs the plugin documents (plugins/*.json) to Firestore collections.
+
+    Every sync reads all the remote documents in one batched get_all,
+    compares content hashes with the local files and only writes the
+    documents that differ.  The previous version of each changed document
+    is backed up to <collection>-backup in the same batched write, so the
+    backup and the update land together.  Several collections (e.g. one
+    per environment) are synced concurrently.
+
+    Large corpora live in shard documents (see vocaptcha.cache.SHARDS),
+    built locally by `import_corpus` into plugins/<module>.shards/.  Shard
+    ids are content hashes, so only the shards a collection doesn't have
+    yet are written, and they're written before the plugin document that
+    points at them.
+    """
+
     def __init__(self, config: VoCaptchaConfig):
         self.plugins = config.plugins
         self.collection = config.collection
         self.plugin_folder = config.pluginFolder
 
         self.plugin_classes = self.load_plugins_classes()
-        
+
 
     def load_plugins_classes(self):
         plugin_classes = []
@@ -28,62 +86,274 @@ class VoCaptchaDataManager:
         return plugin_classes
 
     def _make_plugin_documents(self):
+        remote = self.remote_documents(self.collection)
         for plugin in self.plugin_classes:
-            plugin_module = plugin.__module__
-            root, folder, module_name = plugin_module.split('.')
-            path = '/'.join((folder, module_name + '.json'))
-            ref = self.collection.document(plugin.DOC)
-            doc = ref.get()
-            with open(path, 'w') as dest:
-                doc_dict = doc.to_dict()
-                json.dump(doc_dict, dest, indent=2)
+            with open(plugin_document_path(plugin), 'w') as dest:
+                json.dump(remote[plugin.DOC], dest, indent=2)
 
-    def load_plugin_documents(
-        self, 
-        coll: firestore.CollectionReference=None
-    ):
-        if coll:
-            self.collection = coll
-        self.backup_plugin_documents()
+    def local_documents(self) -> Dict[str, dict]:
+        documents = {}
         for plugin in self.plugin_classes:
-            plugin_module = plugin.__module__
-            root, folder, module_name = plugin_module.split('.')
-            path = '/'.join((folder, module_name + '.json'))
-            ref = self.collection.document(plugin.DOC)
-            with open(path, 'r') as src:
-                doc_dict = json.load(src)
-                ref.set(doc_dict)
-
-    def backup_plugin_documents(self):
-        backup_coll = copy.copy(self.collection)        
-        backup_coll_name = backup_coll._path[0] + "-backup"
-        backup_coll._path = (backup_coll_name,)
+            with open(plugin_document_path(plugin), 'r') as src:
+                documents[plugin.DOC] = json.load(src)
+        return documents
+
+    def local_shards(self) -> Dict[str, str]:
+        paths = {}
         for plugin in self.plugin_classes:
-            plugin_module = plugin.__module__
-            root, folder, module_name = plugin_module.split('.')
-            path = '/'.join((folder, module_name + '.json'))
-            source_doc_ref = self.collection.document(plugin.DOC)
-            target_doc_ref = backup_coll.document(plugin.DOC)
-            source_doc = source_doc_ref.get()
-            target_doc_ref.set(source_doc.to_dict())
+            paths.update(shard_paths(plugin_shard_folder(plugin)))
+        return paths
+
+    def existing(self, coll, doc_ids) -> set:
+        """
+        Which of doc_ids exist in coll, without reading their contents.
+        """
+        refs = [coll.document(doc_id) for doc_id in doc_ids]
+        if not refs:
+            return set()
+        return {
+            snapshot.id
+            for snapshot in coll._client.get_all(refs, field_paths=[])
+            if snapshot.exists
+        }
+
+    def remote_documents(self, coll) -> Dict[str, Optional[dict]]:
+        """
+        Reads every plugin document in coll with a single get_all.
+        """
+        refs = [coll.document(plugin.DOC) for plugin in self.plugin_classes]
+        documents = {ref.id: None for ref in refs}
+        for snapshot in coll._client.get_all(refs):
+            documents[snapshot.id] = snapshot.to_dict() if snapshot.exists else None
+        return documents
+
+    def diff(self, coll=None) -> List[DocumentStatus]:
+        coll = coll or self.collection
+        local = self.local_documents()
+        remote = self.remote_documents(coll)
+        wanted = set().union(*(shard_ids(document) for document in local.values()))
+        present = self.existing(coll, sorted(wanted))
+        return [
+            DocumentStatus(
+                doc_id=plugin.DOC,
+                path=plugin_document_path(plugin),
+                local=local[plugin.DOC],
+                remote=remote[plugin.DOC],
+                local_hash=document_hash(local[plugin.DOC]),
+                remote_hash=document_hash(remote[plugin.DOC]),
+                missing_shards=sorted(shard_ids(local[plugin.DOC]) - present)
+            )
+            for plugin in self.plugin_classes
+        ]
+
+    @staticmethod
+    def backup_collection(coll):
+        return coll._client.collection(coll._path[0] + "-backup")
+
+    def commit(self, coll, writes):
+        """
+        Commits (collection, doc_id, document) writes, or (collection,
+        doc_id, None) deletes, in batches of at most BATCH_LIMIT operations
+        and roughly BATCH_BYTES.
+        """
+        batch, count, size = coll._client.batch(), 0, 0
+        for target, doc_id, document in writes:
+            length = len(json.dumps(document)) if document is not None else 0
+            if count and (count == BATCH_LIMIT or size + length > BATCH_BYTES):
+                batch.commit()
+                batch, count, size = coll._client.batch(), 0, 0
+            if document is None:
+                batch.delete(target.document(doc_id))
+            else:
+                batch.set(target.document(doc_id), document)
+            count += 1
+            size += length
+        if count:
+            batch.commit()
+
+    def load_plugin_documents(
+        self,
+        coll: firestore.CollectionReference=None,
+        force: bool=False,
+        prune: bool=False
+    ) -> List[DocumentStatus]:
+        """
+        Writes the local documents that differ from coll (all of them with
+        force), backing up the versions they replace.  Missing shards go
+        out first.  With prune, shards the replaced versions referenced
+        and the new ones don't are deleted afterwards (their backups will
+        no longer resolve).  Returns what was written.
+        """
+        coll = coll or self.collection
+        statuses = [
+            status for status in self.diff(coll)
+            if force or status.state != UNCHANGED
+        ]
+        shards = self.local_shards()
+        missing = sorted({doc_id for status in statuses for doc_id in status.missing_shards})
+        if missing:
+            self.commit(coll, [(coll, doc_id, self.read_shard(shards[doc_id])) for doc_id in missing])
+        backup = self.backup_collection(coll)
+        writes = []
+        for status in statuses:
+            if status.remote is not None:
+                writes.append((backup, status.doc_id, status.remote))
+            writes.append((coll, status.doc_id, status.local))
+        if writes:
+            self.commit(coll, writes)
+        if prune:
+            orphans = set()
+            for status in statuses:
+                orphans |= shard_ids(status.remote) - shard_ids(status.local)
+            if orphans:
+                self.commit(coll, [(coll, doc_id, None) for doc_id in sorted(orphans)])
+        return statuses
+
+    @staticmethod
+    def read_shard(path: str) -> dict:
+        with open(path) as src:
+            return json.load(src)
 
+    def backup_plugin_documents(self, coll=None):
+        coll = coll or self.collection
+        backup = self.backup_collection(coll)
+        writes = [
+            (backup, doc_id, document)
+            for doc_id, document in self.remote_documents(coll).items()
+            if document is not None
+        ]
+        if writes:
+            self.commit(coll, writes)
+
+    def sync(self, collections, force: bool=False, prune: bool=False) -> Dict[str, List[DocumentStatus]]:
+        with ThreadPoolExecutor(max_workers=max(1, len(collections))) as pool:
+            results = pool.map(lambda coll: self.load_plugin_documents(coll, force=force, prune=prune), collections)
+            return {coll.id: written for coll, written in zip(collections, results)}
+
+    def check(self, collections) -> Dict[str, List[DocumentStatus]]:
+        with ThreadPoolExecutor(max_workers=max(1, len(collections))) as pool:
+            results = pool.map(self.diff, collections)
+            return {coll.id: statuses for coll, statuses in zip(collections, results)}
+
+    def plugin_class(self, doc_id: str):
+        for plugin in self.plugin_classes:
+            if plugin.DOC == doc_id:
+                return plugin
+        raise KeyError(f"No plugin uses the {doc_id} document")
+
+    def corpus_entries(self, plugin, name: str = CHALLENGES):
+        """
+        Streams the entries of the local document's name field, inline or
+        sharded.
+        """
+        with open(plugin_document_path(plugin)) as src:
+            document = json.load(src)
+        paths = shard_paths(plugin_shard_folder(plugin))
+        ids = (document.get(SHARDS) or {}).get(name)
+        if ids is None:
+            return iter(document.get(name) or ())
+        return chain.from_iterable(
+            Corpus([self.read_shard(paths[doc_id])[TEXT]]) for doc_id in ids
+        )
+
+    def import_corpus(
+        self,
+        doc_id: str,
+        paths: List[str],
+        column: Optional[str] = None,
+        append: bool = False,
+        name: str = CHALLENGES,
+        shard_bytes: int = SHARD_BYTES
+    ) -> Dict[str, int]:
+        """
+        Streams entries from CSV/JSONL/text files into shard files for the
+        plugin's document and points the document's name field at them.
+        Entries are cleaned and de-duplicated (ignoring case) as they go;
+        with append the existing entries are kept, ahead of the new ones.
+        Only the local files change - `load` deploys them.
+
+        The stats count the lines read from paths, the entries kept from
+        them (added) and from the existing corpus (existing), the entries
+        written in all and the shards.
+        """
+        plugin = self.plugin_class(doc_id)
+        folder = plugin_shard_folder(plugin)
+        os.makedirs(folder, exist_ok=True)
+        stats = {"read": 0, "added": 0, "existing": 0, "entries": 0, "shards": 0}
+        seen = set()
+
+        def read():
+            for path in paths:
+                for entry in read_entries(path, column):
+                    stats["read"] += 1
+                    yield entry
+
+        def entries():
+            if append:
+                for entry in dedupe(self.corpus_entries(plugin, name), seen):
+                    stats["existing"] += 1
+                    yield entry
+            for entry in dedupe(read(), seen):
+                stats["added"] += 1
+                yield entry
+
+        ids = []
+        for text in shard(entries(), shard_bytes):
+            ids.append(shard_id(doc_id, text))
+            stats["entries"] += text.count("\n") + 1
+            target = os.path.join(folder, ids[-1] + ".json")
+            if not os.path.exists(target):
+                with open(target, "w") as dest:
+                    json.dump({TEXT: text}, dest, ensure_ascii=False)
+        stats["shards"] = len(ids)
+
+        path = plugin_document_path(plugin)
+        with open(path) as src:
+            document = json.load(src)
+        document.pop(name, None)
+        document.setdefault(SHARDS, {})[name] = ids
+        with open(path, "w") as dest:
+            json.dump(document, dest, indent=2)
+        for stale, stale_path in shard_paths(folder).items():
+            if stale not in ids:
+                os.remove(stale_path)
+        return stats
 
 
 class VoCaptchaCommander:
 
     LOAD = "load"
+    CHECK = "check"
+    IMPORT = "import"
+    SNAPSHOT = "snapshot"
     DEFAULT = "default"
 
     def __init__(self):
-        self.manager = VoCaptchaManager()
-        self.data = VoCaptchaDataManager(self.manager.config)
-
         self.parser = argparse.ArgumentParser()
         self.subparsers = self.parser.add_subparsers(dest="subparser")
         self.load_parser = self.subparsers.add_parser(self.LOAD)
-        self.load_parser.add_argument("collection_name", nargs="?", default=self.DEFAULT)
+        self.load_parser.add_argument("collection_name", nargs="*", default=[self.DEFAULT])
+        self.load_parser.add_argument("--force", action="store_true")
+        self.load_parser.add_argument("--prune", action="store_true", help="delete shards nothing references any more")
+        self.check_parser = self.subparsers.add_parser(self.CHECK)
+        self.check_parser.add_argument("collection_name", nargs="*", default=[self.DEFAULT])
+        self.import_parser = self.subparsers.add_parser(self.IMPORT)
+        self.import_parser.add_argument("doc", help="the plugin document, e.g. sentences")
+        self.import_parser.add_argument("paths", nargs="+", help=".csv, .jsonl or one-entry-a-line text files")
+        self.import_parser.add_argument("--column", help="CSV column or JSONL key (default: first column / text)")
+        self.import_parser.add_argument("--append", action="store_true", help="keep the existing entries")
+        self.import_parser.add_argument("--shard-bytes", type=int, default=SHARD_BYTES)
+        self.snapshot_parser = self.subparsers.add_parser(self.SNAPSHOT)
+        self.snapshot_parser.add_argument("path", help="where to write the warm snapshot, e.g. service/warm.snapshot")
+        self.snapshot_parser.add_argument("--timeout", type=float, default=60)
         self.args = self.parser.parse_args()
         print(self.args)
+        # Importing only touches local files; don't ask for credentials.
+        # A snapshot is taken from the configured backend (see
+        # VOCAPTCHA_BACKEND), like the server would serve it.
+        backend = {self.IMPORT: MEMORY, self.SNAPSHOT: None}.get(self.args.subparser, FIRESTORE)
+        self.manager = VoCaptchaManager(backend=backend)
+        self.data = VoCaptchaDataManager(self.manager.config)
         self.route_command()
 
     def route_command(self):
@@ -91,20 +361,71 @@ class VoCaptchaCommander:
             self.load()
         elif self.args.subparser == self.CHECK:
             self.check()
+        elif self.args.subparser == self.IMPORT:
+            self.import_corpus()
+        elif self.args.subparser == self.SNAPSHOT:
+            self.snapshot()
         else:
             raise KeyError("Oops, that's not a recognized command")
 
+    @property
+    def collections(self):
+        return [
+            self.data.collection if name == self.DEFAULT
+            else self.manager.client.collection(name)
+            for name in self.args.collection_name
+        ]
+
     def load(self):
-        if self.args.collection_name == self.DEFAULT:
-            self.data.load_plugin_documents()
-        else:
-            fs = firestore.Client()
-            coll = fs.collection(self.args.collection_name)
-            self.data.load_plugin_documents(coll=coll)
+        written = self.data.sync(self.collections, force=self.args.force, prune=self.args.prune)
+        for name, statuses in written.items():
+            if not statuses:
+                print(f"{name}: up to date")
+            for status in statuses:
+                shards = f", {len(status.missing_shards)} new shards" if status.missing_shards else ""
+                print(f"{name}: wrote {status.doc_id} ({status.state}{shards})")
 
     def check(self):
-        print("check not implemented yet..!")
-        NotImplemented
+        """
+        Reports which plugin documents differ from each collection.  Exits
+        non-zero if any do, so it can gate a deploy.
+        """
+        dirty = False
+        for name, statuses in self.data.check(self.collections).items():
+            for status in statuses:
+                dirty = dirty or status.state != UNCHANGED
+                shards = f" ({len(status.missing_shards)} shards missing)" if status.missing_shards else ""
+                print(
+                    f"{name}: {status.doc_id:24} {status.state:9} "
+                    f"local {status.local_hash[:12]} remote {(status.remote_hash or '-')[:12]}{shards}"
+                )
+        if dirty:
+            raise SystemExit(1)
+
+    def import_corpus(self):
+        stats = self.data.import_corpus(
+            self.args.doc,
+            self.args.paths,
+            column=self.args.column,
+            append=self.args.append,
+            shard_bytes=self.args.shard_bytes
+        )
+        print(
+            f"{self.args.doc}: {stats['entries']} entries in {stats['shards']} shards "
+            f"({stats['existing']} existing, {stats['added']} added, "
+            f"{stats['read'] - stats['added']} duplicate or blank lines dropped)"
+        )
+
+    def snapshot(self):
+        """
+        Writes a warm snapshot (see vocaptcha.warm) of every document the
+        server would load, to bake into the image.
+        """
+        config = self.manager.config
+        backend = make_backend(config.backend, plugins=self.data.plugin_classes, collection=config.collection)
+        documents = capture(backend, timeout=self.args.timeout)
+        write_snapshot(self.args.path, 1, documents)
+        print(f"Wrote {len(documents)} documents from the {config.backend} backend to {self.args.path}")
 
 if __name__ == "__main__":
     cli = VoCaptchaCommander()
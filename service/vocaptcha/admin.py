@@ -0,0 +1,410 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Any, Dict, Optional
+
+from google.cloud import dialogflowcx_v3 as cx
+from google.protobuf.duration_pb2 import Duration
+from google.protobuf.json_format import MessageToDict
+
+from service.vocaptcha.admission import WEBHOOK_TIMEOUT
+from service.vocaptcha.provisioning import (
+    Change, Plan, Provisioner, diff, CREATE, UPDATE, NOOP, DELETE
+)
+
+
+WEBHOOK = 'webhook'
+PAGE = 'page'
+FLOW = 'flow'
+
+ROUTER = 'router'
+# Display-name prefixes of the resources provisioning owns (and may prune).
+MANAGED = ('generate-', 'verify-')
+
+
+class EntityTypes:
+    sys_any = "projects/-/locations/-/agents/-/entityTypes/sys.any"
+
+@dataclass
+class Pages:
+    generate: cx.Page
+    verify: cx.Page
+
+    def yield_pair(self):
+        return self.generate, self.verify
+
+@dataclass
+class Webhooks:
+    generate: cx.Webhook
+    verify: cx.Webhook
+
+    def yield_pair(self):
+        return self.generate, self.verify
+
+
+def plugin_pages(plugin) -> Pages:
+    generate_page = cx.Page()
+    generate_page.display_name = "generate-" + plugin.mount[1:]
+
+    verify_page = cx.Page()
+    verify_page.display_name = "verify-" + plugin.mount[1:]
+    return Pages(
+        generate=generate_page,
+        verify=verify_page
+    )
+
+
+def plugin_webhooks(plugin) -> Webhooks:
+    generate_webhook = cx.Webhook()
+    generate_webhook.display_name = "generate-" + plugin.mount[1:]
+    generate_webhook.timeout = Duration(seconds=WEBHOOK_TIMEOUT)
+    generate_webhook.generic_web_service.uri = "https://replace.me"
+
+    verify_webhook = cx.Webhook()
+    verify_webhook.display_name = "verify-" + plugin.mount[1:]
+    verify_webhook.timeout = Duration(seconds=WEBHOOK_TIMEOUT)
+    verify_webhook.generic_web_service.uri = "https://replace.me"
+    return Webhooks(
+        generate=generate_webhook,
+        verify=verify_webhook
+    )
+
+
+def as_dict(message) -> dict:
+    return MessageToDict(type(message).pb(message), preserving_proto_field_name=True)
+
+
+def subset(desired, current) -> bool:
+    """
+    True if every field set in desired has the same value in current;
+    fields only the server fills in (names, ids, defaults) are ignored.
+    """
+    if isinstance(desired, dict):
+        return isinstance(current, dict) and all(
+            key in current and subset(value, current[key])
+            for key, value in desired.items()
+        )
+    if isinstance(desired, list):
+        return (
+            isinstance(current, list)
+            and len(desired) == len(current)
+            and all(subset(a, b) for a, b in zip(desired, current))
+        )
+    return desired == current
+
+
+def matches(desired, current) -> bool:
+    return subset(as_dict(desired), as_dict(current))
+
+
+@dataclass
+class Remote:
+
+    """
+    What the agent looked like at the last listing, kept up to date with
+    the results of the changes applied since.
+    """
+
+    webhooks: Dict[str, Any] = field(default_factory=dict)
+    pages: Dict[str, Any] = field(default_factory=dict)
+    flow: Any = None
+
+    def absorb(self, plan: Plan):
+        for change in plan:
+            if change.error is not None or change.action == NOOP:
+                continue
+            if change.kind == FLOW:
+                self.flow = change.result
+                continue
+            resources = self.webhooks if change.kind == WEBHOOK else self.pages
+            if change.action == DELETE:
+                resources.pop(change.display_name, None)
+            else:
+                resources[change.display_name] = change.result
+
+
+class VoCaptchaAdmin:
+
+    """
+    Provisions the Dialogflow CX agent for a VoCaptchaServer's plugins:
+    webhooks, generate/verify pages, the router page and the start flow.
+
+    This is the only module that imports the Dialogflow CX client library.
+    The serving path never needs it, so VoCaptchaServer only loads it (via
+    VoCaptchaServer.admin) when a provisioning method is called, and the
+    gRPC clients are created on first use.
+
+    Provisioning is plan/apply: the agent's webhooks and the flow's pages
+    are listed once, diffed against what the plugins want (create, update,
+    no-op and - with prune - delete), and the changes are applied
+    concurrently by a rate-limited, retrying Provisioner.  The router page
+    and the start flow point at pages by name, so they're planned and
+    applied in a second pass, once the pages exist.
+
+        admin.provision(dry_run=True)   # print the plan, change nothing
+        admin.provision()               # apply it
+
+    Pass the clients in to run against something other than the real API
+    (e.g. a local fake); provisioner options (rate, burst, workers,
+    attempts, backoff) go to the Provisioner.
+    """
+
+    def __init__(
+        self,
+        server,
+        webhooks_client=None,
+        pages_client=None,
+        flows_client=None,
+        **options
+    ):
+        self.server = server
+        self.agent_name = server.agent_name
+        self.flow_name = server.flow_name
+        if webhooks_client is not None:
+            self.webhooks_client = webhooks_client
+        if pages_client is not None:
+            self.pages_client = pages_client
+        if flows_client is not None:
+            self.flows_client = flows_client
+        self.provisioner = Provisioner(self.operations, **options)
+        self.remote: Optional[Remote] = None
+
+    @cached_property
+    def webhooks_client(self):
+        return cx.WebhooksClient()
+
+    @cached_property
+    def pages_client(self):
+        return cx.PagesClient()
+
+    @cached_property
+    def flows_client(self):
+        return cx.FlowsClient()
+
+    @property
+    def operations(self):
+        return {
+            (WEBHOOK, CREATE): self.create_webhook,
+            (WEBHOOK, UPDATE): self.update_webhook,
+            (WEBHOOK, DELETE): self.delete_webhook,
+            (PAGE, CREATE): self.create_page,
+            (PAGE, UPDATE): self.update_page,
+            (PAGE, DELETE): self.delete_page,
+            (FLOW, UPDATE): self.update_flow,
+        }
+
+    def create_webhook(self, change: Change):
+        return self.webhooks_client.create_webhook(parent=self.agent_name, webhook=change.desired)
+
+    def update_webhook(self, change: Change):
+        change.desired.name = change.current.name
+        return self.webhooks_client.update_webhook(webhook=change.desired)
+
+    def delete_webhook(self, change: Change):
+        return self.webhooks_client.delete_webhook(name=change.current.name)
+
+    def create_page(self, change: Change):
+        return self.pages_client.create_page(parent=self.flow_name, page=change.desired)
+
+    def update_page(self, change: Change):
+        change.desired.name = change.current.name
+        return self.pages_client.update_page(page=change.desired)
+
+    def delete_page(self, change: Change):
+        return self.pages_client.delete_page(name=change.current.name)
+
+    def update_flow(self, change: Change):
+        return self.flows_client.update_flow(flow=change.desired)
+
+    def list_webhooks(self):
+        return {
+            webhook.display_name: webhook
+            for webhook in self.webhooks_client.list_webhooks(parent=self.agent_name)
+        }
+
+    def list_pages(self):
+        return {
+            page.display_name: page
+            for page in self.pages_client.list_pages(parent=self.flow_name)
+        }
+
+    def get_flow(self):
+        return self.flows_client.get_flow(name=self.flow_name)
+
+    def refresh(self) -> Remote:
+        """
+        Lists the webhooks and pages and fetches the start flow - once
+        each, concurrently, through the provisioner's rate limit.
+        """
+        call = self.provisioner.call
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            webhooks = pool.submit(call, self.list_webhooks)
+            pages = pool.submit(call, self.list_pages)
+            flow = pool.submit(call, self.get_flow)
+            self.remote = Remote(webhooks.result(), pages.result(), flow.result())
+        return self.remote
+
+    @property
+    def state(self) -> Remote:
+        return self.remote or self.refresh()
+
+    @property
+    def current_webhooks(self):
+        return self.state.webhooks
+
+    @property
+    def current_pages(self):
+        return self.state.pages
+
+    @property
+    def plugin_webhooks(self):
+        plugin_webhooks = []
+        for instance in self.server.plugin_instances:
+            plugin_webhooks.append(instance.webhooks)
+        return {
+            webhook.display_name: webhook
+            for _webhook in plugin_webhooks
+            for webhook in _webhook.yield_pair() 
+        }
+
+    @property
+    def plugin_pages(self):
+        plugin_pages = []
+        for instance in self.server.plugin_instances:
+            plugin_pages.append(instance.pages)
+        return {
+            page.display_name: page
+            for _page in plugin_pages
+            for page in _page.yield_pair() 
+        }
+
+    @staticmethod
+    def managed(display_name: str) -> bool:
+        return display_name.startswith(MANAGED)
+
+    def plan_webhooks(self, prune: bool = False) -> Plan:
+        return diff(
+            WEBHOOK, self.plugin_webhooks, self.state.webhooks, matches,
+            prune=self.managed if prune else None
+        )
+
+    def plan_pages(self, prune: bool = False) -> Plan:
+        desired = self.plugin_pages
+        desired[ROUTER] = cx.Page(display_name=ROUTER)
+        return diff(
+            PAGE, desired, self.state.pages, matches,
+            prune=self.managed if prune else None
+        )
+
+    def page_name(self, display_name: str) -> str:
+        page = self.state.pages.get(display_name)
+        # Not created yet (dry run): stand in with the display name.
+        return page.name if page is not None and page.name else f"<{display_name}>"
+
+    def plan_router_page(self) -> Plan:
+        """
+        Splits $session.params.which-challenge (a RAND() in [0, 1)) into
+        one equal range per plugin and routes each to the plugin's
+        generate page.
+        """
+        current = self.state.pages.get(ROUTER)
+        desired = copy.deepcopy(current) if current is not None else cx.Page(display_name=ROUTER)
+        plugin_count = len(self.server.plugin_instances)
+        router_ranges = [(
+            round(n /plugin_count, ndigits=2),
+            round((n+1) /plugin_count, ndigits=2)
+        ) for n in range(plugin_count)]        
+        conditions = [(
+            f"$session.params.which-challenge > {lower} "
+            f"AND $session.params.which-challenge <= {upper}"
+        ) for lower, upper in router_ranges]
+        generate_pages = [
+            self.page_name("generate-" + instance.mount[1:])
+            for instance in self.server.plugin_instances
+        ]
+        desired.transition_routes = [
+            {
+                "condition": condition,
+                "target_page": page_name,
+                "trigger_fulfillment": {}  
+            } for condition, page_name in zip(conditions, generate_pages)
+        ]
+        if current is None:
+            return Plan([Change(CREATE, PAGE, ROUTER, desired=desired)])
+        action = NOOP if matches(desired, current) else UPDATE
+        return Plan([Change(action, PAGE, ROUTER, desired=desired, current=current)])
+
+    def plan_start_flow(self) -> Plan:
+        """
+        Has the start flow's first route set which-challenge and send the
+        caller to the router page.
+        """
+        current = self.state.flow
+        desired = copy.deepcopy(current)
+        transition_route = desired.transition_routes[0]
+        spas = transition_route.trigger_fulfillment.set_parameter_actions
+        if "which-challenge" not in [spa.parameter for spa in spas]:
+            spas.append({
+                "parameter": "which-challenge",
+                "value": {
+                    "string_value":"$sys.func.RAND()"
+                }
+            })
+        transition_route.target_page = self.page_name(ROUTER)
+        action = NOOP if matches(desired, current) else UPDATE
+        return Plan([Change(action, FLOW, current.display_name or FLOW, desired=desired, current=current)])
+
+    def plan(self, prune: bool = False) -> Plan:
+        return (
+            self.plan_webhooks(prune) + self.plan_pages(prune)
+            + self.plan_router_page() + self.plan_start_flow()
+        )
+
+    def apply(self, plan: Plan) -> Plan:
+        self.provisioner.apply(plan)
+        self.state.absorb(plan)
+        for change in plan.failed:
+            print(f"Failed to {change.action} {change.kind} {change.display_name}: {change.error!r}")
+        return plan
+
+    def provision(self, dry_run: bool = False, prune: bool = False) -> Plan:
+        """
+        Brings the agent in line with the plugins.  With dry_run the plan
+        is printed and returned without changing anything; with prune,
+        generate-/verify- webhooks and pages no plugin wants are deleted.
+        """
+        self.refresh()
+        if dry_run:
+            plan = self.plan(prune)
+            print(plan.describe())
+            return plan
+        resources = self.plan_webhooks(prune) + self.plan_pages(prune)
+        print(resources.describe())
+        self.apply(resources)
+        if resources.failed:
+            print("Skipping the router page and start flow until the above succeed.")
+            return resources
+        routing = self.plan_router_page() + self.plan_start_flow()
+        print(routing.describe())
+        return resources + self.apply(routing)
+
+    def inject_webhooks(self):
+        plan = self.plan_webhooks()
+        print(plan.describe())
+        return self.apply(plan)
+
+    def inject_pages(self):
+        plan = self.plan_pages()
+        print(plan.describe())
+        return self.apply(plan)
+
+    def patch_router_page(self):
+        plan = self.plan_router_page()
+        print(plan.describe())
+        return self.apply(plan)
+
+    def patch_start_flow(self):
+        plan = self.plan_start_flow()
+        print(plan.describe())
+        return self.apply(plan)
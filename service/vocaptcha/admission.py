@@ -0,0 +1,135 @@
+import time
+import asyncio
+from collections import Counter, deque
+from typing import Dict, Optional, Tuple
+
+from service.vocaptcha.metrics import metrics
+
+# How long Dialogflow CX waits for the webhooks we provision (see
+# vocaptcha.admin.plugin_webhooks) before giving up on them.
+WEBHOOK_TIMEOUT = 7
+
+QUEUE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 7.0)
+
+# Why a request was shed.
+FULL = 'queue_full'
+LATE = 'deadline'
+
+
+class Admission:
+
+    """
+    Admission control for the plugin routes: at most `limit` requests in
+    flight across the server, and `plugin_limit` per plugin.  Requests
+    past either limit queue (FIFO, at most `queue` of them) for a slot.
+
+    A request only waits as long as it can afford to.  Its budget is
+    `deadline` (the webhook timeout, by default) minus how long the plugin
+    usually takes to serve that action (a moving average per plugin and
+    action, so slow batches don't make single requests look slow).  A
+    request that couldn't be served within the budget is shed straight
+    away: acquire returns False and the caller answers with a cheap
+    fallback instead of work Dialogflow will have stopped waiting for.
+    That keeps goodput up under a flood instead of every response arriving
+    too late.
+
+    Everything runs on the event loop, so there are no locks.
+    """
+
+    def __init__(
+        self,
+        limit: int = 256,
+        plugin_limit: int = 64,
+        deadline: float = WEBHOOK_TIMEOUT,
+        queue: int = 1024,
+        clock=time.monotonic
+    ):
+        self.limit = limit
+        self.plugin_limit = plugin_limit
+        self.deadline = deadline
+        self.queue = queue
+        self.clock = clock
+        self.inflight = 0
+        self.plugin_inflight = Counter()
+        self.waiters = deque()
+        self.service: Dict[Tuple[str, Optional[str]], float] = {}
+        self.shed = Counter()
+
+    def available(self, plugin: str) -> bool:
+        return self.inflight < self.limit and self.plugin_inflight[plugin] < self.plugin_limit
+
+    def take(self, plugin: str):
+        self.inflight += 1
+        self.plugin_inflight[plugin] += 1
+
+    def budget(self, plugin: str, arrived: float, action: Optional[str] = None) -> float:
+        return self.deadline - self.service.get((plugin, action), 0.0) - (self.clock() - arrived)
+
+    async def acquire(self, plugin: str, arrived: Optional[float] = None, action: Optional[str] = None) -> bool:
+        """
+        Waits for a slot.  Returns False if the request should be shed.
+        """
+        arrived = self.clock() if arrived is None else arrived
+        # Anyone queued is waiting on a limit this request would hit too,
+        # unless it's for another plugin at its own limit.
+        if self.available(plugin):
+            self.take(plugin)
+            return True
+        budget = self.budget(plugin, arrived, action)
+        if len(self.waiters) >= self.queue:
+            return self.reject(plugin, FULL)
+        if budget <= 0:
+            return self.reject(plugin, LATE)
+        entry = (plugin, asyncio.get_running_loop().create_future())
+        waiter = entry[1]
+        self.waiters.append(entry)
+        try:
+            # asyncio.wait, unlike wait_for, never cancels the future, so a
+            # slot granted as the budget runs out isn't lost.
+            await asyncio.wait((waiter,), timeout=budget)
+        except asyncio.CancelledError:
+            # The client went away; pass on a slot it was just given.
+            if waiter.done():
+                self.free(plugin)
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+                self.waiters.remove(entry)
+        queued = self.clock() - arrived
+        metrics.observe('admission_queue_seconds', (('plugin', plugin),), queued, QUEUE_BUCKETS)
+        if waiter.cancelled():
+            return self.reject(plugin, LATE)
+        return True
+
+    def reject(self, plugin: str, reason: str) -> bool:
+        self.shed[plugin, reason] += 1
+        metrics.inc('shed_total', (('plugin', plugin), ('reason', reason)))
+        return False
+
+    def release(self, plugin: str, started: float, action: Optional[str] = None):
+        """
+        Frees the slot of a request for action that started being served at
+        started, and hands free slots to the longest-waiting requests that
+        fit.
+        """
+        elapsed = self.clock() - started
+        key = (plugin, action)
+        average = self.service.get(key)
+        self.service[key] = elapsed if average is None else 0.9 * average + 0.1 * elapsed
+        self.free(plugin)
+
+    def free(self, plugin: str):
+        self.inflight -= 1
+        self.plugin_inflight[plugin] -= 1
+        waiters = self.waiters
+        while waiters and self.inflight < self.limit:
+            for entry in waiters:
+                if self.plugin_inflight[entry[0]] < self.plugin_limit:
+                    break
+            else:
+                return
+            waiters.remove(entry)
+            plugin, waiter = entry
+            self.take(plugin)
+            waiter.set_result(True)
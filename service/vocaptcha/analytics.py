@@ -0,0 +1,304 @@
+import sys
+import time
+import asyncio
+import sqlite3
+from abc import ABC, abstractmethod
+from array import array
+from collections import deque
+from threading import Lock
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from service.vocaptcha.logs import dumps
+from service.vocaptcha.metrics import Histogram, SCORE_BUCKETS
+
+JSONL = 'jsonl'
+SQLITE = 'sqlite'
+FIRESTORE = 'firestore'
+
+MASK = (1 << 64) - 1
+# Odd 64-bit multipliers, one per CountMinSketch row.
+SEEDS = (
+    0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+    0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53, 0x94D049BB133111EB, 0xBF58476D1CE4E5B9
+)
+
+# Firestore's limit on the writes in one batch.
+FIRESTORE_BATCH = 500
+
+
+class CountMinSketch:
+
+    """
+    Approximate counts for any number of keys in depth * width counters.
+    An estimate is never below the true count, and above it by at most
+    about 2/width of the total with probability 1 - 1/2**depth.  depth is
+    at most len(SEEDS).
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.rows = [array('q', bytes(8 * width)) for _ in range(depth)]
+        self.seeds = SEEDS[:depth]
+
+    def columns(self, key: Hashable):
+        # Multiplicative hashing with a different odd multiplier per row,
+        # so keys that collide in one row rarely collide in the others.
+        # hash((seed, key)) doesn't do: its low bits collide together.
+        digest = hash(key)
+        width = self.width
+        return [(((digest * seed) & MASK) >> 32) % width for seed in self.seeds]
+
+    def add(self, key: Hashable, count: int = 1) -> int:
+        """
+        Adds count to key and returns key's new estimate.
+        """
+        estimate = None
+        for column, row in zip(self.columns(key), self.rows):
+            row[column] += count
+            if estimate is None or row[column] < estimate:
+                estimate = row[column]
+        return estimate
+
+    def estimate(self, key: Hashable) -> int:
+        return min(row[column] for column, row in zip(self.columns(key), self.rows))
+
+
+class HeavyHitters:
+
+    """
+    The (roughly) top k keys of a CountMinSketch: a key is kept if its
+    estimate beats the smallest one kept.
+    """
+
+    def __init__(self, k: int = 100, width: int = 2048, depth: int = 4):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.top: Dict[Hashable, int] = {}
+
+    def add(self, key: Hashable, count: int = 1):
+        estimate = self.sketch.add(key, count)
+        top = self.top
+        if key in top or len(top) < self.k:
+            top[key] = estimate
+            return
+        smallest = min(top, key=top.get)
+        if estimate > top[smallest]:
+            del top[smallest]
+            top[key] = estimate
+
+    def estimate(self, key: Hashable) -> int:
+        return self.sketch.estimate(key)
+
+    def most_common(self) -> List[Tuple[Hashable, int]]:
+        return sorted(self.top.items(), key=lambda item: item[1], reverse=True)
+
+
+class AnalyticsSink(ABC):
+
+    """
+    Where CallerAnalytics writes its records, a batch at a time.  `write`
+    is called from a worker thread, never on the event loop.
+    """
+
+    @abstractmethod
+    def write(self, records: List[dict]):
+        ...
+
+    def close(self):
+        pass
+
+
+class JSONLSink(AnalyticsSink):
+
+    """
+    Appends the records to a file (or stdout, for path "-") as JSON lines.
+    """
+
+    def __init__(self, path: str):
+        self.stream = sys.stdout if path == '-' else open(path, 'a', encoding='utf-8')
+
+    def write(self, records):
+        self.stream.write(''.join(dumps(record) + '\n' for record in records))
+        self.stream.flush()
+
+    def close(self):
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+
+class SQLiteSink(AnalyticsSink):
+
+    """
+    Inserts the records into the caller_analytics table of a SQLite
+    database, one transaction per batch.  The kind, plugin and caller get
+    columns of their own so they can be queried; the whole record is kept
+    as JSON.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS caller_analytics "
+                "(ts REAL, kind TEXT, plugin TEXT, caller TEXT, record TEXT)"
+            )
+
+    def write(self, records):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO caller_analytics VALUES (?, ?, ?, ?, ?)",
+                [
+                    (record['ts'], record['kind'], record.get('plugin'), record.get('caller'), dumps(record))
+                    for record in records
+                ]
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+class FirestoreSink(AnalyticsSink):
+
+    """
+    Adds the records as documents of a Firestore collection, in batched
+    writes.
+    """
+
+    def __init__(self, collection):
+        if isinstance(collection, str):
+            from google.cloud import firestore
+            collection = firestore.Client().collection(collection)
+        self.collection = collection
+
+    def write(self, records):
+        for start in range(0, len(records), FIRESTORE_BATCH):
+            batch = self.collection._client.batch()
+            for record in records[start:start + FIRESTORE_BATCH]:
+                batch.set(self.collection.document(), record)
+            batch.commit()
+
+
+def make_sink(kind: str, path: Optional[str] = None, collection: Any = None) -> AnalyticsSink:
+    if kind == JSONL:
+        return JSONLSink(path or '-')
+    elif kind == SQLITE:
+        return SQLiteSink(path)
+    elif kind == FIRESTORE:
+        return FirestoreSink(collection)
+    raise KeyError(f"Unknown analytics sink: {kind}")
+
+
+class Window:
+
+    """
+    What one flush interval's verify results add up to.
+    """
+
+    def __init__(self, started: float, top: int, width: int, depth: int):
+        self.started = started
+        self.plugins: Dict[str, list] = {}
+        self.calls = CountMinSketch(width, depth)
+        self.failures = HeavyHitters(top, width, depth)
+
+    def add(self, caller: Optional[str], plugin: str, passed: bool, ratio: float):
+        outcomes = self.plugins.get(plugin)
+        if outcomes is None:
+            outcomes = self.plugins[plugin] = [0, 0, Histogram(SCORE_BUCKETS)]
+        outcomes[0 if passed else 1] += 1
+        outcomes[2].observe(ratio)
+        if caller is not None:
+            self.calls.add(caller)
+            if not passed:
+                self.failures.add(caller)
+
+    def records(self) -> List[dict]:
+        now = time.time()
+        window = {'ts': now, 'started': self.started}
+        records = []
+        for plugin, (passed, failed, scores) in self.plugins.items():
+            records.append({
+                **window,
+                'kind': 'plugin',
+                'plugin': plugin,
+                'passed': passed,
+                'failed': failed,
+                'scores': dict(zip([*map(str, scores.buckets), '+Inf'], scores.counts))
+            })
+        for caller, failures in self.failures.most_common():
+            records.append({
+                **window,
+                'kind': 'caller',
+                'caller': caller,
+                'calls': self.calls.estimate(caller),
+                'failures': failures
+            })
+        return records
+
+
+class CallerAnalytics:
+
+    """
+    Per-caller and per-plugin verify outcomes, for spotting the numbers
+    behind malicious calls.
+
+    `record` is all the request path pays: a tuple appended to a deque
+    (dropped, with a counter, once `maxsize` are waiting).  A background
+    task wakes every `interval` seconds and, on a worker thread, drains
+    the deque into a Window and writes the window's records to the sink as
+    one batch: pass/fail counts and a score histogram per plugin, and the
+    `top` callers by failures with their estimated calls.  Callers are
+    counted in count-min sketches of depth * width counters, so memory
+    stays the same however many there are.
+    """
+
+    def __init__(
+        self,
+        sink: AnalyticsSink,
+        interval: float = 10.0,
+        top: int = 100,
+        width: int = 2048,
+        depth: int = 4,
+        maxsize: int = 100_000
+    ):
+        self.sink = sink
+        self.interval = interval
+        self.top = top
+        self.width = width
+        self.depth = depth
+        self.maxsize = maxsize
+        self.buffer = deque()
+        self.dropped = 0
+        self.written = 0
+        self.since = time.time()
+        self.lock = Lock()
+
+    def record(self, caller: Optional[str], plugin: str, passed: bool, ratio: float):
+        if len(self.buffer) >= self.maxsize:
+            self.dropped += 1
+            return
+        self.buffer.append((caller, plugin, passed, ratio))
+
+    def flush(self):
+        """
+        Aggregates everything recorded so far and writes it out.  Blocks,
+        so it's run on a worker thread.
+        """
+        buffer = self.buffer
+        with self.lock:
+            if not buffer:
+                return
+            window = Window(self.since, self.top, self.width, self.depth)
+            self.since = time.time()
+            for _ in range(len(buffer)):
+                window.add(*buffer.popleft())
+            records = window.records()
+            self.sink.write(records)
+            self.written += len(records)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"CallerAnalytics failed to write: {e!r}", file=sys.stderr)
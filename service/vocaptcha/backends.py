@@ -0,0 +1,235 @@
+import os
+import glob
+import json
+import hashlib
+import inspect
+from abc import ABC, abstractmethod
+from threading import Thread, Event
+from typing import Callable, Dict, List, Optional
+
+from service.vocaptcha.logs import logger
+
+
+FIRESTORE = 'firestore'
+FILE = 'file'
+MEMORY = 'memory'
+
+REMOVED = 'REMOVED'
+
+
+class CacheBackend(ABC):
+
+    """
+    The source of truth for the ResponseCache.  A backend delivers plugin
+    documents to the cache by calling the callback it was given in `watch`
+    with a mapping of document id -> document dict.  A value of None means
+    the document was removed.
+    """
+
+    # While a backend serves documents it knows may be out of date (see
+    # vocaptcha.warm), the time they were current; None once they're live.
+    stale_since: Optional[float] = None
+
+    def __init__(self):
+        self.callback = None
+
+    @abstractmethod
+    def watch(self, callback: Callable[[Dict[str, Optional[dict]]], None]):
+        ...
+
+    def close(self):
+        self.callback = None
+
+    def publish(self, documents: Dict[str, Optional[dict]]):
+        if self.callback and documents:
+            self.callback(documents)
+
+
+class FirestoreBackend(CacheBackend):
+
+    """
+    Watches a Firestore collection, query or document reference with
+    `on_snapshot`.  The listener runs on Firestore's background thread.
+    """
+
+    def __init__(self, query):
+        super().__init__()
+        self.query = query
+        self.watcher = None
+
+    def on_snapshot(self, snaps, changes, read_time):
+        """
+        Only the ADDED/MODIFIED/REMOVED changes are forwarded; the full
+        snapshot is never walked, so an edit costs the size of the edit.
+        """
+        if not self.callback:
+            return
+        documents = {}
+        for change in changes:
+            doc = change.document
+            if change.type.name == REMOVED:
+                documents[doc.id] = None
+            else:
+                documents[doc.id] = doc.to_dict()
+        self.callback(documents)
+
+    def watch(self, callback):
+        self.callback = callback
+        self.watcher = self.query.on_snapshot(self.on_snapshot)
+
+    def close(self):
+        if self.watcher:
+            self.watcher.unsubscribe()
+            self.watcher = None
+        super().close()
+
+
+class MemoryBackend(CacheBackend):
+
+    """
+    A pure in-memory backend.  Documents are provided up-front and can be
+    changed at runtime with `set` and `delete`, which makes it a drop-in
+    stand-in for Firestore in tests and benchmarks.
+    """
+
+    def __init__(self, documents: Dict[str, dict] = None):
+        super().__init__()
+        self.documents = dict(documents or {})
+
+    @classmethod
+    def from_plugins(cls, plugins):
+        documents = {}
+        for plugin in plugins:
+            paths = {plugin_document_id(plugin): plugin_document_path(plugin)}
+            paths.update(shard_paths(plugin_shard_folder(plugin)))
+            for doc_id, path in paths.items():
+                with open(path) as src:
+                    documents[doc_id] = json.load(src)
+        return cls(documents)
+
+    def watch(self, callback):
+        self.callback = callback
+        callback(dict(self.documents))
+
+    def set(self, doc_id: str, data: dict):
+        self.documents[doc_id] = data
+        self.publish({doc_id: data})
+
+    def delete(self, doc_id: str):
+        self.documents.pop(doc_id, None)
+        self.publish({doc_id: None})
+
+
+class FileBackend(CacheBackend):
+
+    """
+    Serves plugin documents from local JSON files (service/plugins/*.json,
+    plus any shard documents in service/plugins/*.shards/) and polls their
+    modification times on a daemon thread so that edits are picked up
+    without a restart.
+    """
+
+    def __init__(self, paths: Dict[str, str], interval: float = 1.0, folders: List[str] = ()):
+        super().__init__()
+        self.paths = dict(paths)
+        self.folders = list(folders)
+        self.interval = interval
+        self.mtimes = {}
+        self.stopped = Event()
+        self.thread = None
+
+    @classmethod
+    def from_plugins(cls, plugins, interval: float = 1.0):
+        return cls({
+            plugin_document_id(plugin): plugin_document_path(plugin)
+            for plugin in plugins
+        }, interval=interval, folders=[plugin_shard_folder(plugin) for plugin in plugins])
+
+    def read(self):
+        documents = {}
+        for folder in self.folders:
+            for doc_id, path in shard_paths(folder).items():
+                self.paths.setdefault(doc_id, path)
+        for doc_id, path in self.paths.items():
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                if self.mtimes.pop(doc_id, None) is not None:
+                    documents[doc_id] = None
+                continue
+            if self.mtimes.get(doc_id) == mtime:
+                continue
+            try:
+                with open(path) as src:
+                    documents[doc_id] = json.load(src)
+            except ValueError as e:
+                # A half-written file; try again on the next poll.
+                logger.log("document_skipped", severity="WARNING", document=doc_id, path=path, error=repr(e))
+                continue
+            self.mtimes[doc_id] = mtime
+        return documents
+
+    def poll(self):
+        while not self.stopped.wait(self.interval):
+            self.publish(self.read())
+
+    def watch(self, callback):
+        self.callback = callback
+        callback(self.read())
+        if self.interval:
+            self.thread = Thread(target=self.poll, name="file-backend", daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.stopped.set()
+        super().close()
+
+
+def document_hash(document: Optional[dict]) -> Optional[str]:
+    """
+    A content hash that doesn't depend on key order or whitespace, so a
+    reformatted plugins/*.json still matches the document in Firestore.
+    """
+    if document is None:
+        return None
+    canonical = json.dumps(document, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def plugin_document_id(plugin):
+    return getattr(plugin, 'doc', None) or plugin.DOC
+
+
+def plugin_document_path(plugin):
+    """
+    Plugin documents live next to the plugin module: plugins/nato_alpha.py
+    is backed by plugins/nato_alpha.json.
+    """
+    if not inspect.isclass(plugin):
+        plugin = type(plugin)
+    return os.path.splitext(inspect.getfile(plugin))[0] + '.json'
+
+
+def plugin_shard_folder(plugin):
+    """
+    Shard documents (see vocaptcha.cache.SHARDS) for plugins/sentences.json
+    live in plugins/sentences.shards/<shard id>.json.
+    """
+    return os.path.splitext(plugin_document_path(plugin))[0] + '.shards'
+
+
+def shard_paths(folder: str) -> Dict[str, str]:
+    return {
+        os.path.splitext(os.path.basename(path))[0]: path
+        for path in sorted(glob.glob(os.path.join(folder, '*.json')))
+    }
+
+
+def make_backend(kind: str, plugins=(), collection=None):
+    if kind == FIRESTORE:
+        return FirestoreBackend(collection)
+    elif kind == FILE:
+        return FileBackend.from_plugins(plugins)
+    elif kind == MEMORY:
+        return MemoryBackend.from_plugins(plugins)
+    raise KeyError(f"Unknown cache backend: {kind}")
@@ -1,38 +1,238 @@
+import time
+from dataclasses import dataclass, field
 from threading import Lock, Event
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Mapping, Set
+
+from service.vocaptcha.backends import CacheBackend, FirestoreBackend
+from service.vocaptcha.corpus import Corpus
+from service.vocaptcha.logs import logger
+
+
+EMPTY = MappingProxyType({})
+
+# A document can keep a large list in shard documents instead of inline:
+# {"shards": {"challenges": ["sentences-3f2a...", ...]}, ...}, where each
+# shard document is {"text": "<newline-separated entries>"}.
+SHARDS = 'shards'
+TEXT = 'text'
+
+
+def freeze(value):
+    """
+    Recursively converts dicts into read-only mappings and lists into tuples
+    so a published snapshot can be shared between threads without copies.
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def shard_ids(document) -> Set[str]:
+    shards = document.get(SHARDS) if document else None
+    if not shards:
+        return set()
+    return {shard for ids in shards.values() for shard in ids}
+
+
+def resolve(document, documents):
+    """
+    Returns the document with each sharded field replaced by a Corpus over
+    its shard documents.  Raises KeyError if a shard hasn't arrived.
+    """
+    shards = document.get(SHARDS)
+    if not shards:
+        return document
+    resolved = dict(document)
+    for name, ids in shards.items():
+        missing = [shard for shard in ids if shard not in documents]
+        if missing:
+            raise KeyError(f"Missing shards for {name}: {missing}")
+        resolved[name] = Corpus(documents[shard][TEXT] for shard in ids)
+    return MappingProxyType(resolved)
+
+
+@dataclass(frozen=True)
+class Snapshot:
+
+    """
+    An immutable, versioned view of every cached document along with the
+    data plugins derived from them.  Snapshots are never modified once
+    published; the ResponseCache swaps in a new one instead.
+    """
+
+    version: int = 0
+    documents: Mapping[str, Any] = field(default_factory=lambda: EMPTY)
+    derived: Mapping[Any, Any] = field(default_factory=lambda: EMPTY)
+    versions: Mapping[str, int] = field(default_factory=lambda: EMPTY)
+    created: float = field(default_factory=time.time)
 
 
 class ResponseCache:
 
+    """
+    Readers go through `snapshot`, which is replaced with a single attribute
+    assignment, so the request path never takes a lock.  `lock` only
+    serializes writers (the backend's callback and `register`).
+
+    Hooks see sharded fields (see SHARDS) as a Corpus.  A document is
+    re-materialized when one of its shards changes, and one whose shards
+    haven't all arrived waits in `pending` until they do.
+    """
+
     def __init__(
         self,
         collection = None
     ):
-        self.cache = {}
+        self.snapshot = Snapshot()
+        self.hooks: Dict[str, Dict[Any, Callable]] = {}
         self.lock = Lock()
         self.watcher = None
         self.collection = collection
         self.ready = Event()
+        self.pending: Dict[str, Any] = {}
+
+    @property
+    def cache(self):
+        return self.snapshot.documents
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    def register(self, doc_id: str, hook: Callable, key=None):
+        """
+        Registers hook(document) to run once per snapshot in which doc_id
+        changes.  The result is published with the snapshot and read back
+        with `derived(key)`.
+        """
+        key = hook if key is None else key
+        with self.lock:
+            self.hooks.setdefault(doc_id, {})[key] = hook
+            current = self.snapshot
+            if doc_id in current.documents:
+                derived = dict(current.derived)
+                derived[key] = hook(resolve(current.documents[doc_id], current.documents))
+                self.publish(current.documents, derived, current.versions)
+
+    def materialize(self, doc_id, document, derived):
+        results = {}
+        for key, hook in self.hooks.get(doc_id, {}).items():
+            results[key] = hook(document)
+        derived.update(results)
+
+    def publish(self, documents, derived, versions):
+        self.snapshot = Snapshot(
+            version=self.snapshot.version + 1,
+            documents=MappingProxyType(documents),
+            derived=MappingProxyType(derived),
+            versions=MappingProxyType(versions)
+        )
 
-    def callback(self, snaps, changes, read_time):
-        for doc in snaps:
-            _id, data = doc.id, doc.to_dict()
-            if _id not in self.cache or self.cache.get(_id) != data:
-                with self.lock:
-                    self.cache[doc.id] = data
+    def callback(self, changes):
+        """
+        Applies a batch of changes (document id -> document, or None for a
+        removal) from the backend.  Only the changed documents are touched:
+        each one is frozen, materialized and stamped with the version of the
+        snapshot it's published in.  Documents that weren't part of the
+        batch are carried over by reference, except those whose shards
+        changed, which are materialized again.
+        """
+        with self.lock:
+            current = self.snapshot
+            version = current.version + 1
+            documents = dict(current.documents)
+            derived = dict(current.derived)
+            versions = dict(current.versions)
+            applied = 0
+            staged = {}
+            for _id, data in changes.items():
+                if data is None:
+                    self.pending.pop(_id, None)
+                    if documents.pop(_id, None) is not None:
+                        versions.pop(_id, None)
+                        for key in self.hooks.get(_id, {}):
+                            derived.pop(key, None)
+                        applied += 1
+                    continue
+                staged[_id] = freeze(data)
+            # Plain documents (shards included) first, so the sharded ones
+            # resolve against this batch.
+            touched = set(changes)
+            sharded = {_id: data for _id, data in staged.items() if SHARDS in data}
+            for parents in (self.pending, current.documents):
+                for _id, data in parents.items():
+                    if _id not in sharded and shard_ids(data) & touched:
+                        sharded[_id] = data
+            for _id, data in staged.items():
+                if _id not in sharded and self.apply(_id, data, documents, derived):
+                    versions[_id] = version
+                    applied += 1
+            for _id, data in sharded.items():
+                try:
+                    resolved = resolve(data, documents)
+                except KeyError as e:
+                    logger.log("update_held", severity="WARNING", document=_id, error=repr(e))
+                    self.pending[_id] = data
+                    continue
+                self.pending.pop(_id, None)
+                if self.apply(_id, data, documents, derived, resolved):
+                    versions[_id] = version
+                    applied += 1
+            if applied:
+                self.publish(documents, derived, versions)
         self.ready.set()
 
-    def watch(self, query=None):
+    def apply(self, _id, data, documents, derived, resolved=None) -> bool:
+        try:
+            self.materialize(_id, data if resolved is None else resolved, derived)
+        except Exception as e:
+            # Keep serving the previous version of the document
+            # rather than publishing one the plugins can't use.
+            logger.log("update_rejected", severity="ERROR", document=_id, error=repr(e))
+            return False
+        documents[_id] = data
+        return True
+
+    def watch(self, query=None, timeout=None):
+        """
+        Starts watching a CacheBackend.  Firestore references are accepted
+        as-is and wrapped in a FirestoreBackend.  Blocks until the first
+        delivery, raising TimeoutError if it doesn't arrive within timeout
+        seconds.
+        """
         if not query:
             query = self.collection
-        self.watcher = query.on_snapshot(self.callback)
-    
+        if not isinstance(query, CacheBackend):
+            query = FirestoreBackend(query)
+        self.watcher = query
+        self.watcher.watch(self.callback)
+
         if not self.ready.is_set():
-            self.ready.wait()
+            if not self.ready.wait(timeout):
+                raise TimeoutError(
+                    f"ResponseCache didn't receive any documents within {timeout} seconds."
+                )
+
+    def close(self):
+        if self.watcher:
+            self.watcher.close()
+            self.watcher = None
 
     def get(self, key):
-        with self.lock:
-            value = self.cache.get(key)
+        value = self.snapshot.documents.get(key)
         if not value:
             raise KeyError(f"Key {key} doesn't exist in the cache.")
         else:
             return value
+
+    def document_version(self, key):
+        """
+        The snapshot version in which the document last changed, or None.
+        """
+        return self.snapshot.versions.get(key)
+
+    def derived(self, key, default=None):
+        return self.snapshot.derived.get(key, default)
@@ -0,0 +1,229 @@
+import csv
+import json
+import hashlib
+from array import array
+from bisect import bisect_right
+from collections.abc import Sequence
+from typing import Iterable, Iterator, List, Optional
+
+SEPARATOR = '\n'
+
+# Firestore caps a document at 1 MiB; leave room for the other fields.
+# (Shard offsets are 32-bit, so a shard must stay under 4 GiB anyway.)
+SHARD_BYTES = 900_000
+
+
+class TextShard:
+
+    """
+    A shard held as a single str of newline-separated entries plus the
+    offsets where each entry starts.
+    """
+
+    __slots__ = ('text', 'offsets')
+
+    def __init__(self, text: str):
+        self.text = text
+        self.offsets = index(text)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, entry: int) -> str:
+        offsets = self.offsets
+        return self.text[offsets[entry]:offsets[entry + 1] - 1]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.text.split(SEPARATOR))
+
+
+class BufferShard:
+
+    """
+    A shard held as a UTF-8 buffer (bytes, or a memoryview of a mapped
+    file) plus the byte offsets where each entry starts; entries are
+    decoded on access.  See vocaptcha.shared.
+    """
+
+    __slots__ = ('buffer', 'offsets')
+
+    def __init__(self, buffer, offsets):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    @classmethod
+    def encode(cls, text: str) -> 'BufferShard':
+        data = text.encode('utf-8')
+        offsets = array('I', [0])
+        position = data.find(b'\n')
+        while position != -1:
+            offsets.append(position + 1)
+            position = data.find(b'\n', position + 1)
+        offsets.append(len(data) + 1)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, entry: int) -> str:
+        offsets = self.offsets
+        return str(self.buffer[offsets[entry]:offsets[entry + 1] - 1], 'utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(str(self).split(SEPARATOR))
+
+    def __str__(self):
+        # The shard's text, so a document holding a BufferShard hashes
+        # and serializes like one holding the original str.
+        return str(self.buffer, 'utf-8')
+
+
+class Corpus(Sequence):
+
+    """
+    A read-only sequence of strings stored compactly, shard by shard: each
+    shard is a single str (TextShard) or UTF-8 buffer (BufferShard) plus
+    an array of the offsets where each entry starts.  A 100k-sentence
+    corpus costs a few large buffers and 4 bytes an entry instead of one
+    Python object per sentence, and the shard texts are shared with the
+    cache documents they came from rather than copied.  Entries are sliced
+    out on access.
+    """
+
+    __slots__ = ('shards', 'starts', 'length')
+
+    def __init__(self, texts: Iterable = ()):
+        shards = (
+            TextShard(text) if isinstance(text, str) else text
+            for text in texts if len(text)
+        )
+        self.shards = tuple(shards)
+        self.starts = array('L', [0])
+        for shard in self.shards:
+            self.starts.append(self.starts[-1] + len(shard))
+        self.length = self.starts[-1]
+
+    @classmethod
+    def from_strings(cls, entries: Iterable[str], shard_bytes: int = SHARD_BYTES) -> 'Corpus':
+        return cls(shard(entries, shard_bytes))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[n] for n in range(*position.indices(self.length))]
+        if position < 0:
+            position += self.length
+        if not 0 <= position < self.length:
+            raise IndexError("Corpus index out of range")
+        n = bisect_right(self.starts, position) - 1
+        return self.shards[n][position - self.starts[n]]
+
+    def __iter__(self) -> Iterator[str]:
+        for shard in self.shards:
+            yield from shard
+
+    def __repr__(self):
+        return f"Corpus({self.length} entries in {len(self.shards)} shards)"
+
+
+def index(text: str) -> array:
+    """
+    Start offsets of every entry in text, plus one past the end (as if the
+    text ended with a separator) so entry n is text[o[n]:o[n+1] - 1].
+    """
+    offsets = array('I', [0])
+    find = text.find
+    position = find(SEPARATOR)
+    while position != -1:
+        offsets.append(position + 1)
+        position = find(SEPARATOR, position + 1)
+    offsets.append(len(text) + 1)
+    return offsets
+
+
+def clean(entry) -> str:
+    """
+    Collapses whitespace (newlines included, since they separate entries).
+    """
+    return ' '.join(str(entry).split())
+
+
+def fingerprint(entry: str) -> bytes:
+    return hashlib.blake2b(entry.casefold().encode('utf-8'), digest_size=8).digest()
+
+
+def dedupe(entries: Iterable[str], seen: Optional[set] = None) -> Iterator[str]:
+    """
+    Cleans entries and drops blanks and repeats (ignoring case).  Only an
+    8-byte fingerprint per entry is remembered, so a stream of any length
+    can go through.
+    """
+    seen = set() if seen is None else seen
+    for entry in entries:
+        entry = clean(entry)
+        if not entry:
+            continue
+        key = fingerprint(entry)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield entry
+
+
+def shard(entries: Iterable[str], shard_bytes: int = SHARD_BYTES) -> Iterator[str]:
+    """
+    Packs entries into newline-separated shard texts of at most shard_bytes
+    of UTF-8 (an entry is never split across shards).
+    """
+    lines: List[str] = []
+    size = 0
+    for entry in entries:
+        if SEPARATOR in entry:
+            raise ValueError(f"Corpus entries can't contain newlines: {entry!r}")
+        length = len(entry.encode('utf-8')) + 1
+        if lines and size + length > shard_bytes:
+            yield SEPARATOR.join(lines)
+            lines, size = [], 0
+        lines.append(entry)
+        size += length
+    if lines:
+        yield SEPARATOR.join(lines)
+
+
+def shard_id(doc_id: str, text: str) -> str:
+    """
+    Shard documents are named after their content, so re-importing an
+    unchanged corpus rewrites nothing and a new version never overwrites
+    shards the current one is still being served from.
+    """
+    return f"{doc_id}-{hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}"
+
+
+def read_entries(path: str, column: Optional[str] = None) -> Iterator[str]:
+    """
+    Streams entries from a .csv (the named column, or the first one), a
+    .jsonl (the named key of each object, or the line itself if it's a
+    string) or a plain text file (one entry a line).
+    """
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as src:
+            if column is None:
+                for row in csv.reader(src):
+                    if row:
+                        yield row[0]
+            else:
+                for row in csv.DictReader(src):
+                    yield row[column]
+    elif path.endswith(('.jsonl', '.ndjson')):
+        with open(path, encoding='utf-8') as src:
+            for line in src:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                yield record if isinstance(record, str) else record[column or 'text']
+    else:
+        with open(path, encoding='utf-8') as src:
+            for line in src:
+                yield line
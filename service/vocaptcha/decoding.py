@@ -0,0 +1,83 @@
+from typing import Iterable, Optional, Union
+
+import orjson
+from pydantic import ValidationError
+
+from cxwebhooks import WebhookRequest
+
+loads = orjson.loads
+DecodeError = orjson.JSONDecodeError
+
+
+REQUIRED = tuple(
+    name for name, field in WebhookRequest.__fields__.items()
+    if field.required
+)
+
+
+class LazyWebhook:
+
+    """
+    A WebhookRequest stand-in that only validated the required fields and
+    the fields its plugin declared (VoCaptchaPlugin.FIELDS).  Those are
+    plain attributes.  Touching anything else validates the whole body into
+    a WebhookRequest on first use and reads it from there.
+    """
+
+    def __init__(self, body: dict, fields: dict):
+        self.__dict__.update(fields)
+        self._body = body
+        self._model = None
+
+    @property
+    def model(self) -> WebhookRequest:
+        if self._model is None:
+            self._model = WebhookRequest(**self._body)
+        return self._model
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+
+def validate(body, fields: Optional[Iterable[str]] = None) -> Union[WebhookRequest, LazyWebhook, None]:
+    """
+    Validates an already-decoded body.  With fields=None this is the full
+    WebhookRequest(**body).  Otherwise only the required fields and the
+    named ones are validated, with the same pydantic rules.  Returns None
+    when the body doesn't conform.
+    """
+    if not isinstance(body, dict):
+        return None
+    if fields is None:
+        try:
+            return WebhookRequest(**body)
+        except ValidationError:
+            return None
+    model_fields = WebhookRequest.__fields__
+    values = {}
+    for name in (*REQUIRED, *fields):
+        field = model_fields[name]
+        if name not in body:
+            if field.required:
+                return None
+            values[name] = field.get_default()
+            continue
+        value, errors = field.validate(body[name], values, loc=name, cls=WebhookRequest)
+        if errors:
+            return None
+        values[name] = value
+    return LazyWebhook(body, values)
+
+
+def decode(raw: bytes, fields: Optional[Iterable[str]] = None):
+    """
+    Decodes a raw request body with orjson and validates it; see
+    `validate`.  Malformed JSON also returns None.
+    """
+    try:
+        body = loads(raw)
+    except (DecodeError, ValueError):
+        return None
+    return validate(body, fields)
@@ -0,0 +1,89 @@
+import json
+from typing import Iterable, Optional, Union
+
+from starlette.responses import Response
+
+from cxwebhooks import WebhookResponse
+
+
+SPEAK_OPEN = '<speak>'
+SPEAK_CLOSE = '</speak>'
+
+# The fixed parts of a WebhookResponse, serialized once.
+MESSAGES_OPEN = '{"fulfillmentResponse":{"messages":['
+MESSAGES_CLOSE = ']}'
+TEXT_OPEN = '{"text":{"text":['
+TEXT_CLOSE = ']}}'
+SSML_OPEN = '{"outputAudioText":{"ssml":'
+SSML_CLOSE = '}}'
+PARAMS_OPEN = ',"sessionInfo":{"parameters":'
+PARAMS_CLOSE = '}'
+BODY_CLOSE = '}'
+
+
+def dumps(value) -> str:
+    """
+    json.dumps with the exact settings starlette's JSONResponse renders with.
+    """
+    return json.dumps(
+        value,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":")
+    )
+
+
+def speak(ssml: str) -> str:
+    """
+    Mirrors the OutputAudioText validator in cxwebhooks, quirks included:
+    it only skips the closing tag when the string ends with '/<speak>'.
+    """
+    if not ssml.startswith(SPEAK_OPEN):
+        ssml = SPEAK_OPEN + ssml
+    if not ssml.endswith('/<speak>'):
+        ssml += SPEAK_CLOSE
+    return ssml
+
+
+def encode(
+    text: Optional[str] = None,
+    ssml: Optional[str] = None,
+    params: Optional[dict] = None
+) -> bytes:
+    """
+    Serializes the response plugins build (a text message, an SSML message
+    and session parameters) by splicing the variable parts into the fixed
+    skeleton.  The bytes are identical to
+    JSONResponse(response.dict(exclude_none=True)).body for the equivalent
+    WebhookResponse, minus the pydantic round-trip.
+    """
+    messages = []
+    if text is not None:
+        messages.append(TEXT_OPEN + dumps(text) + TEXT_CLOSE)
+    if ssml is not None:
+        messages.append(SSML_OPEN + dumps(speak(ssml)) + SSML_CLOSE)
+    body = MESSAGES_OPEN + ','.join(messages) + MESSAGES_CLOSE
+    if params is not None:
+        body += PARAMS_OPEN + dumps(params) + PARAMS_CLOSE
+    return (body + BODY_CLOSE).encode('utf-8')
+
+
+def to_bytes(response: Union[bytes, dict, WebhookResponse]) -> bytes:
+    if isinstance(response, bytes):
+        return response
+    if isinstance(response, WebhookResponse):
+        response = response.dict(exclude_none=True)
+    return dumps(response).encode('utf-8')
+
+
+def join(responses: Iterable[Union[bytes, dict, WebhookResponse]]) -> bytes:
+    """
+    Serializes a list of responses (for the batch routes) without decoding
+    the ones that are already bytes.
+    """
+    return b'[' + b','.join(to_bytes(response) for response in responses) + b']'
+
+
+class EncodedResponse(Response):
+    media_type = "application/json"
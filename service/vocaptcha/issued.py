@@ -0,0 +1,130 @@
+import math
+import time
+from array import array
+from typing import Any, Dict, Optional
+
+OFF = 'off'
+REPORT = 'report'
+ENFORCE = 'enforce'
+
+# What verify finds when it looks a session's challenge up.
+ISSUED = 'issued'
+UNKNOWN = 'unknown'
+MISMATCH = 'mismatch'
+REPLAYED = 'replayed'
+
+MASK = (1 << 64) - 1
+CONSUMED = 1 << 64
+TICK_SHIFT = 65
+
+
+class IssuedChallenges:
+
+    """
+    Remembers which challenge was issued to which session, so verify can
+    tell a genuine answer from a replayed or forged challenge/response
+    pair without a database round-trip.
+
+    An entry is a single int keyed by an int: the session's hash maps to
+    the challenge's hash, a consumed flag (set once the challenge has been
+    passed, so passing it again is a replay) and the tick it was recorded
+    in.  Entries expire after `ttl` seconds through a timing wheel of
+    ttl / resolution slots, each an array of the keys recorded in that
+    tick.  Advancing the wheel only ever touches the slots that expired,
+    so expiry is O(1) per entry however many sessions there are.  Past
+    max_entries, the oldest slot is expired early (counted in
+    `evictions`).
+
+    The store lives in one process.  Behind several workers or instances
+    a verify can land where its generate didn't and find UNKNOWN, so
+    ENFORCE needs session affinity; REPORT only flags it.
+
+    Only used from the event loop, so there are no locks.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 600,
+        resolution: float = 1.0,
+        max_entries: int = 500_000,
+        mode: str = REPORT,
+        clock=time.monotonic
+    ):
+        self.resolution = resolution
+        self.slots = [array('q') for _ in range(max(1, math.ceil(ttl / resolution)))]
+        self.entries: Dict[int, int] = {}
+        self.max_entries = max_entries
+        self.mode = mode
+        self.clock = clock
+        self.tick = self.now()
+        self.evictions = 0
+
+    @property
+    def enforce(self) -> bool:
+        return self.mode == ENFORCE
+
+    def __len__(self):
+        return len(self.entries)
+
+    def now(self) -> int:
+        return int(self.clock() / self.resolution)
+
+    def advance(self):
+        now = self.now()
+        wheel = len(self.slots)
+        # Catching up more than a full turn expires everything once.
+        for tick in range(max(self.tick + 1, now - wheel + 1), now + 1):
+            self.expire(tick % wheel, tick - wheel)
+        self.tick = now
+
+    def expire(self, position: int, recorded: int):
+        """
+        Drops the entries in slot position that were recorded at or before
+        tick recorded.  Keys that were recorded again since live on in a
+        later slot.
+        """
+        entries = self.entries
+        slot = self.slots[position]
+        for key in slot:
+            value = entries.get(key)
+            if value is not None and value >> TICK_SHIFT <= recorded:
+                del entries[key]
+        self.slots[position] = array('q')
+
+    def evict(self) -> bool:
+        wheel = len(self.slots)
+        for tick in range(self.tick + 1, self.tick + wheel + 1):
+            position = tick % wheel
+            if self.slots[position]:
+                before = len(self.entries)
+                # The oldest slot, recorded a wheel before tick.  Keys
+                # recorded again since live on in a later slot.
+                self.expire(position, tick - wheel)
+                self.evictions += before - len(self.entries)
+                return True
+        return False
+
+    def record(self, session: str, challenge: Any):
+        self.advance()
+        while len(self.entries) >= self.max_entries and self.evict():
+            pass
+        key = hash(session)
+        self.entries[key] = (self.tick << TICK_SHIFT) | (hash(str(challenge)) & MASK)
+        self.slots[self.tick % len(self.slots)].append(key)
+
+    def check(self, session: Optional[str], challenge: Any) -> str:
+        self.advance()
+        value = self.entries.get(hash(session)) if session else None
+        if value is None:
+            return UNKNOWN
+        if value & MASK != hash(str(challenge)) & MASK:
+            return MISMATCH
+        if value & CONSUMED:
+            return REPLAYED
+        return ISSUED
+
+    def consume(self, session: str):
+        key = hash(session)
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries[key] = value | CONSUMED
@@ -0,0 +1,103 @@
+import sys
+import time
+import atexit
+import random
+from collections import deque
+from threading import Thread, Event, Lock
+from typing import Dict, Optional, TextIO
+
+import orjson
+
+
+def dumps(record) -> str:
+    return orjson.dumps(record, default=str).decode('utf-8')
+
+
+class StructuredLogger:
+
+    """
+    Structured, non-blocking logging for the request path.  `log` builds a
+    record and appends it to a bounded in-memory queue; a daemon thread
+    drains the queue every `interval` seconds and writes the records out as
+    JSON lines, `batch` at a time, with one write per batch.
+
+    Records are sampled per plugin (`sample_rates`, falling back to
+    `default_rate`) and dropped, with a counter, when the queue is full, so
+    a flood never makes logging block or grow without bound.
+    """
+
+    def __init__(
+        self,
+        stream: Optional[TextIO] = None,
+        maxsize: int = 10000,
+        batch: int = 512,
+        interval: float = 0.25,
+        default_rate: float = 1.0,
+        sample_rates: Dict[str, float] = None
+    ):
+        self.stream = stream
+        self.maxsize = maxsize
+        self.batch = batch
+        self.interval = interval
+        self.default_rate = default_rate
+        self.sample_rates = dict(sample_rates or {})
+        self.queue = deque()
+        self.dropped = 0
+        self.sampled = 0
+        self.written = 0
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+
+    def log(self, event: str, plugin: str = None, **fields):
+        rate = self.sample_rates.get(plugin, self.default_rate)
+        if rate < 1 and random.random() >= rate:
+            self.sampled += 1
+            return
+        if len(self.queue) >= self.maxsize:
+            self.dropped += 1
+            return
+        record = {'ts': time.time(), 'event': event}
+        if plugin is not None:
+            record['plugin'] = plugin
+        record.update(fields)
+        self.queue.append(record)
+        if self.thread is None:
+            self.start()
+
+    def flush(self):
+        """
+        Writes out everything queued so far.  Safe to call from any thread.
+        """
+        queue = self.queue
+        with self.lock:
+            stream = self.stream or sys.stdout
+            while queue:
+                lines = []
+                while queue and len(lines) < self.batch:
+                    lines.append(dumps(queue.popleft()))
+                stream.write('\n'.join(lines) + '\n')
+                stream.flush()
+                self.written += len(lines)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"StructuredLogger failed to write: {e!r}", file=sys.stderr)
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = Thread(target=self.run, name="structured-logger", daemon=True)
+            self.thread.start()
+        atexit.register(self.close)
+
+    def close(self):
+        self.stopped.set()
+        self.flush()
+
+
+logger = StructuredLogger()
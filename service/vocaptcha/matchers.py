@@ -0,0 +1,249 @@
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Type
+
+import Levenshtein
+from fuzzywuzzy import fuzz
+# cpdist scores every pair in a single C call (and across cores); it
+# returns a numpy array, which is why numpy is a dependency too.
+from rapidfuzz import process as rf_process, fuzz as rf_fuzz
+
+
+Pair = Tuple[str, Optional[str]]
+
+PUNCTUATION = re.compile(r"[^\w\s']|_")
+APOSTROPHES = re.compile(r"'")
+
+
+def normalize(text) -> str:
+    """
+    Lowercases, drops apostrophes, turns any other punctuation into spaces
+    and collapses whitespace: "It's  time, to PAY" -> "its time to pay".
+    """
+    text = APOSTROPHES.sub('', str(text).lower())
+    return ' '.join(PUNCTUATION.sub(' ', text).split())
+
+
+class Matcher:
+
+    """
+    Scores a caller's response against the challenge they were given on a
+    0-100 scale, so a threshold means the same thing whichever matcher a
+    plugin picks.
+
+    Both sides are passed through `prepare` first.  The challenge side only
+    ever comes from a plugin's corpus, so it's memoized: `warm` precomputes
+    a whole corpus when the cache delivers it and anything else lands in a
+    bounded LRU.
+    """
+
+    NAME = None
+    CACHE_SIZE = 4096
+    WARM_LIMIT = 10000
+
+    def __init__(self):
+        self.warmed: Dict[str, str] = {}
+        self.prepare_challenge = lru_cache(maxsize=self.CACHE_SIZE)(self.prepare)
+
+    def __reduce__(self):
+        # Sent to a process pool (see vocaptcha.workers) by name; each
+        # worker process builds one matcher per name and keeps it.
+        return shared_matcher, (self.NAME,)
+
+    def prepare(self, text) -> str:
+        return normalize(text)
+
+    def warm(self, challenges: Iterable[str]):
+        """
+        Precomputes every challenge in a corpus of up to WARM_LIMIT entries;
+        a larger one relies on the LRU, rather than holding a prepared copy
+        of the whole corpus.
+        """
+        if hasattr(challenges, '__len__') and len(challenges) > self.WARM_LIMIT:
+            self.warmed = {}
+            return
+        self.warmed = {
+            challenge: self.prepare(challenge)
+            for challenge in challenges
+        }
+
+    def challenge(self, challenge: str) -> str:
+        prepared = self.warmed.get(challenge)
+        if prepared is None:
+            prepared = self.prepare_challenge(challenge)
+        return prepared
+
+    def compare(self, challenge: str, challenge_response: str) -> float:
+        raise NotImplementedError
+
+    def score(self, challenge, challenge_response) -> int:
+        if challenge is None or challenge_response is None:
+            return 0
+        prepared = self.challenge(challenge)
+        response = self.prepare(challenge_response)
+        if not prepared or not response:
+            return 100 if prepared == response else 0
+        return int(round(self.compare(prepared, response)))
+
+    def score_batch(self, pairs: Sequence[Pair]) -> List[int]:
+        return [self.score(*pair) for pair in pairs]
+
+
+class RatioMatcher(Matcher):
+
+    """
+    fuzz.ratio on the raw strings, exactly as plugins scored before
+    matchers existed.
+    """
+
+    NAME = 'ratio'
+
+    def prepare(self, text):
+        return text
+
+    def score(self, challenge, challenge_response):
+        return fuzz.ratio(challenge, challenge_response)
+
+    def score_batch(self, pairs):
+        if len(pairs) < 2:
+            return super().score_batch(pairs)
+        # The trivial pairs (missing or empty strings) go through fuzz.ratio
+        # itself so its edge cases are kept exactly.
+        results = [
+            None if challenge and challenge_response else self.score(challenge, challenge_response)
+            for challenge, challenge_response in pairs
+        ]
+        scored = [n for n, result in enumerate(results) if result is None]
+        if scored:
+            scores = rf_process.cpdist(
+                [pairs[n][0] for n in scored],
+                [pairs[n][1] for n in scored],
+                scorer=rf_fuzz.ratio,
+                workers=-1
+            )
+            for n, score in zip(scored, scores.tolist()):
+                results[n] = int(round(score))
+        return results
+
+
+class LevenshteinMatcher(Matcher):
+
+    """
+    The C-backed Levenshtein ratio on normalized text.  On the same input
+    it gives the same number as fuzz.ratio, minus the case and punctuation
+    noise of a transcript.
+    """
+
+    NAME = 'levenshtein'
+
+    def compare(self, challenge, challenge_response):
+        return Levenshtein.ratio(challenge, challenge_response) * 100
+
+    def score_batch(self, pairs):
+        if len(pairs) < 2:
+            return super().score_batch(pairs)
+        results = []
+        scored = []
+        challenges = []
+        responses = []
+        for n, (challenge, challenge_response) in enumerate(pairs):
+            prepared = response = None
+            if challenge is not None and challenge_response is not None:
+                prepared = self.challenge(challenge)
+                response = self.prepare(challenge_response)
+            if prepared and response:
+                results.append(None)
+                scored.append(n)
+                challenges.append(prepared)
+                responses.append(response)
+            else:
+                results.append(self.score(challenge, challenge_response))
+        if scored:
+            scores = rf_process.cpdist(challenges, responses, scorer=rf_fuzz.ratio, workers=-1)
+            for n, score in zip(scored, scores.tolist()):
+                results[n] = int(round(score))
+        return results
+
+
+class TokenSetMatcher(Matcher):
+
+    """
+    token_set_ratio on normalized text: word order and repeated or extra
+    filler words ("um, the rain, the rain in spain...") matter less.
+    """
+
+    NAME = 'token-set'
+
+    def compare(self, challenge, challenge_response):
+        return rf_fuzz.token_set_ratio(challenge, challenge_response)
+
+
+SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'),
+    **dict.fromkeys('cgjkqsxz', '2'),
+    **dict.fromkeys('dt', '3'),
+    'l': '4',
+    **dict.fromkeys('mn', '5'),
+    'r': '6',
+}
+
+
+def soundex(word: str) -> str:
+    """
+    American Soundex: "robert" -> "r163".  Words without any letters are
+    kept as they are (e.g. digits).
+    """
+    letters = [c for c in word if 'a' <= c <= 'z']
+    if not letters:
+        return word
+    code = [letters[0]]
+    last = SOUNDEX_CODES.get(letters[0])
+    for c in letters[1:]:
+        digit = SOUNDEX_CODES.get(c)
+        if digit and digit != last:
+            code.append(digit)
+            if len(code) == 4:
+                break
+        if c not in 'hw':
+            last = digit
+    return ''.join(code).ljust(4, '0')
+
+
+class PhoneticMatcher(Matcher):
+
+    """
+    Compares the Soundex codes of the words rather than their spelling, so
+    homophones and near-homophones a speech-to-text engine mixes up
+    ("their"/"there", "plane"/"plain") still match.
+    """
+
+    NAME = 'phonetic'
+
+    def prepare(self, text):
+        return ' '.join(soundex(word) for word in normalize(text).split())
+
+    def compare(self, challenge, challenge_response):
+        return Levenshtein.ratio(challenge, challenge_response) * 100
+
+
+MATCHERS: Dict[str, Type[Matcher]] = {
+    matcher.NAME: matcher
+    for matcher in (RatioMatcher, LevenshteinMatcher, TokenSetMatcher, PhoneticMatcher)
+}
+
+DEFAULT_MATCHER = LevenshteinMatcher.NAME
+
+
+@lru_cache(maxsize=None)
+def shared_matcher(name: str) -> Matcher:
+    return get_matcher(name)
+
+
+def get_matcher(name: str = DEFAULT_MATCHER) -> Matcher:
+    try:
+        matcher = MATCHERS[name]
+    except KeyError:
+        raise KeyError(
+            f"Unknown matcher {name!r}.  Available: {', '.join(sorted(MATCHERS))}."
+        )
+    return matcher()
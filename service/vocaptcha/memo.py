@@ -0,0 +1,57 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+MISSING = object()
+
+
+class VerificationMemo:
+
+    """
+    A bounded LRU with a TTL for verification scores.  Auto-dialers replay
+    the same transcript over and over; with the memo in front of the
+    matcher, every repeat is a dictionary lookup instead of a rescore.
+
+    The memo is tied to a version of the plugin's cache document: `sync`
+    drops everything as soon as the document changes.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def sync(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def get(self, key: Hashable, default=None):
+        entry = self.entries.get(key, MISSING)
+        if entry is not MISSING:
+            expires, value = entry
+            if expires > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.entries[key]
+        self.misses += 1
+        return default
+
+    def put(self, key: Hashable, value: Any):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,205 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Sequence, Tuple
+
+from starlette.datastructures import MutableHeaders
+
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 7.0
+)
+SCORE_BUCKETS = (0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100)
+
+INF = 'le="+Inf"'
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def format_labels(labels: Labels, extra: str = None) -> str:
+    parts = [f'{key}="{escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value) -> str:
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Metrics:
+
+    """
+    In-process counters and histograms, rendered in the Prometheus text
+    format.  Each worker process has its own registry and the event loop is
+    the only writer, so recording is a dict lookup and an integer add - no
+    locks.  Gauges are callbacks evaluated at scrape time.
+    """
+
+    def __init__(self, prefix: str = "vocaptcha"):
+        self.prefix = prefix
+        self.help: Dict[str, Tuple[str, str]] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.gauges: Dict[str, Callable[[], Iterable[Tuple[Labels, float]]]] = {}
+
+    def describe(self, name: str, kind: str, text: str):
+        self.help[name] = (kind, text)
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1):
+        series = self.counters.get(name)
+        if series is None:
+            series = self.counters[name] = {}
+        series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name: str, labels: Labels, value: float, buckets: Sequence[float] = LATENCY_BUCKETS):
+        series = self.histograms.get(name)
+        if series is None:
+            series = self.histograms[name] = {}
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = Histogram(buckets)
+        histogram.observe(value)
+
+    def gauge(self, name: str, callback: Callable[[], Iterable[Tuple[Labels, float]]], text: str = ""):
+        self.gauges[name] = callback
+        self.describe(name, "gauge", text)
+
+    def observe_verify(self, plugin: str, ratio: float, passed: bool):
+        labels = (('plugin', plugin),)
+        self.inc('verify_total', labels + (('result', 'pass' if passed else 'fail'),))
+        self.observe('verify_score', labels, ratio, SCORE_BUCKETS)
+
+    def header(self, lines, name, default_kind):
+        kind, text = self.help.get(name, (default_kind, ""))
+        full = f"{self.prefix}_{name}"
+        if text:
+            lines.append(f"# HELP {full} {text}")
+        lines.append(f"# TYPE {full} {kind}")
+        return full
+
+    def render(self) -> str:
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            full = self.header(lines, name, "counter")
+            for labels, value in series.items():
+                lines.append(f"{full}{format_labels(labels)} {format_value(value)}")
+        for name, series in sorted(self.histograms.items()):
+            full = self.header(lines, name, "histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = f'le="{format_value(float(bound))}"'
+                    lines.append(f"{full}_bucket{format_labels(labels, le)} {cumulative}")
+                lines.append(f"{full}_bucket{format_labels(labels, INF)} {histogram.count}")
+                lines.append(f"{full}_sum{format_labels(labels)} {format_value(histogram.sum)}")
+                lines.append(f"{full}_count{format_labels(labels)} {histogram.count}")
+        for name, callback in sorted(self.gauges.items()):
+            full = self.header(lines, name, "gauge")
+            for labels, value in callback():
+                lines.append(f"{full}{format_labels(labels)} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+
+    """
+    ASGI middleware that times every request to a plugin route and records
+    request, error and 422 counts and a latency histogram per plugin and
+    action.  It also adds a Server-Timing header with the handler's
+    duration.  Paths that aren't plugin routes are counted under
+    plugin="other" so random probing can't blow up label cardinality.
+    """
+
+    def __init__(
+        self,
+        app,
+        metrics: Metrics,
+        plugins: Iterable[str] = (),
+        actions: Iterable[str] = ('generate', 'verify', 'verify-batch'),
+        server_actions: Iterable[str] = ('verify-batch',)
+    ):
+        self.app = app
+        self.metrics = metrics
+        self.plugins = frozenset(plugins)
+        self.actions = frozenset(actions)
+        self.server_actions = frozenset(server_actions)
+        self.labels = {}
+
+    def route_labels(self, path: str) -> Labels:
+        labels = self.labels.get(path)
+        if labels is None:
+            # The action is the last segment and the plugin everything
+            # before it, so nested mounts (v2/sentences) are matched whole.
+            plugin, _, action = path.strip('/').rpartition('/')
+            if plugin in self.plugins and action in self.actions:
+                labels = (('plugin', plugin), ('action', action))
+            elif not plugin and action in self.server_actions:
+                labels = (('plugin', 'server'), ('action', action))
+            else:
+                labels = (('plugin', 'other'), ('action', 'other'))
+            if len(self.labels) < 1024:
+                self.labels[path] = labels
+        return labels
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] == '/metrics':
+            return await self.app(scope, receive, send)
+        metrics = self.metrics
+        labels = self.route_labels(scope['path'])
+        start = time.perf_counter()
+        status = [500]
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                duration = time.perf_counter() - start
+                headers = MutableHeaders(scope=message)
+                headers.append('Server-Timing', f'app;dur={duration * 1000:.3f}')
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            duration = time.perf_counter() - start
+            code = status[0]
+            metrics.inc('requests_total', labels + (('status', str(code)),))
+            if code == 422:
+                metrics.inc('unprocessable_total', labels)
+            elif code >= 500:
+                metrics.inc('errors_total', labels)
+            metrics.observe('request_duration_seconds', labels, duration)
+
+
+metrics = Metrics()
+metrics.describe('requests_total', 'counter', 'Requests by plugin, action and status.')
+metrics.describe('errors_total', 'counter', 'Requests that ended in a 5xx.')
+metrics.describe('unprocessable_total', 'counter', 'Request bodies rejected with a 422.')
+metrics.describe('request_duration_seconds', 'histogram', 'Request latency by plugin and action.')
+metrics.describe('verify_total', 'counter', 'Verifications by plugin and result.')
+metrics.describe('verify_score', 'histogram', 'Similarity scores (0-100) by plugin.')
@@ -1,40 +1,90 @@
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
-from typing import List, Callable
-from functools import partial
+from dataclasses import replace
+from typing import Dict, List, Callable, Optional, Tuple
+from functools import partial, cached_property
 
+from pydantic import ValidationError
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 from starlette.routing import Mount, Route
-from pydantic import ValidationError
-
-from google.cloud import dialogflowcx_v3 as cx
-from google.protobuf.duration_pb2 import Duration
 
 from cxwebhooks import WebhookRequest, WebhookResponse
 
+from service.vocaptcha.templates import compile_templates
+from service.vocaptcha.pools import Challenge, ChallengePool
+from service.vocaptcha.matchers import get_matcher, DEFAULT_MATCHER
+from service.vocaptcha.memo import VerificationMemo
+from service.vocaptcha import decoding, encoding
+from service.vocaptcha.encoding import EncodedResponse
+from service.vocaptcha.logs import logger
+from service.vocaptcha.metrics import metrics
+from service.vocaptcha.workers import WorkerPool, INLINE_POOL
+from service.vocaptcha.issued import IssuedChallenges, ISSUED
+from service.vocaptcha.analytics import CallerAnalytics
+
 CHALLENGES = 'challenges'
 TEMPLATES = 'templates'
 
-class EntityTypes:
-    sys_any = "projects/-/locations/-/agents/-/entityTypes/sys.any"
+UNPROCESSABLE = {
+    "message": "Request body does not conform to WebhookRequest specification.",
+    "status_code": "422 UNPROCESSABLE ENTITY"
+}
+SOMETHING_WENT_WRONG = "Something went wrong.  Please reach out!"
+SOMETHING_WENT_WRONG_BODY = encoding.encode(SOMETHING_WENT_WRONG)
+GET_POST = frozenset({"GET", "POST"})
+POST = frozenset({"POST"})
+# What a request turned away by admission control (see
+# vocaptcha.admission) gets.  The session parameter lets the agent route
+# on it, e.g. to a "try again" page.
+OVERLOADED = "Sorry, we're busy right now.  Please try again in a moment."
+OVERLOADED_PARAMS = {"vocaptcha-overloaded": True}
+OVERLOADED_BODY = encoding.encode(OVERLOADED, OVERLOADED, OVERLOADED_PARAMS)
+OVERLOADED_BATCH = {
+    "message": "The server is overloaded; retry the batch later.",
+    "status_code": "503 SERVICE UNAVAILABLE"
+}
+# What a caller over its rate limit (see vocaptcha.ratelimit) gets.
+RATE_LIMITED = "Too many attempts.  Please try again later."
+RATE_LIMITED_PARAMS = {"vocaptcha-rate-limited": True}
+RATE_LIMITED_BODY = encoding.encode(RATE_LIMITED, RATE_LIMITED, RATE_LIMITED_PARAMS)
+UNPROCESSABLE_BATCH = {
+    "message": "Request body must be a list of WebhookRequest objects.",
+    "status_code": "422 UNPROCESSABLE ENTITY"
+}
+
 
-@dataclass
-class Pages:
-    generate: cx.Page
-    verify: cx.Page
+def session_of(webhook) -> Optional[str]:
+    session = webhook.sessionInfo if webhook is not None else None
+    return session.session if session else None
 
-    def yield_pair(self):
-        return self.generate, self.verify
 
-@dataclass
-class Webhooks:
-    generate: cx.Webhook
-    verify: cx.Webhook
+def caller_of(webhook) -> Optional[str]:
+    """
+    The telephony caller id or, failing that, the session id (the same
+    keys as ratelimit.caller_key), or None.
+    """
+    telephony = (webhook.payload or {}).get('telephony')
+    caller = telephony.get('caller_id') if isinstance(telephony, dict) else None
+    if caller:
+        return str(caller)
+    session = session_of(webhook)
+    return session.rsplit('/sessions/', 1)[-1] if session else None
 
-    def yield_pair(self):
-        return self.generate, self.verify
 
+async def read_batch(request: Request, fields=None):
+    """
+    Parses a batch body (a JSON list of WebhookRequest objects).  Returns
+    None if the body isn't a list; items that don't validate are returned
+    as None in their position so the rest of the batch still goes through.
+    fields works as in decoding.validate.
+    """
+    try:
+        body = decoding.loads(await request.body())
+    except (decoding.DecodeError, ValueError):
+        return None
+    if not isinstance(body, list):
+        return None
+    return [decoding.validate(item, fields) for item in body]
 
 class VoCaptchaPlugin(ABC):
 
@@ -43,8 +93,19 @@ class VoCaptchaPlugin(ABC):
     DOC = None
     FIELD = None
     PARAMS = None
-
-
+    PLACEHOLDERS = None
+    # How many ready-made challenges to keep (see prepare); 0 for none.
+    POOL_SIZE = 0
+    # The WebhookRequest fields generate/verify read.  None validates the
+    # whole body up-front; a tuple only validates those (plus the required
+    # ones) and defers the rest until a plugin touches it.
+    FIELDS = None
+    # Plugins whose generate/verify return encoded bytes (see
+    # vocaptcha.encoding) instead of filling in a WebhookResponse set this;
+    # they're passed response=None.
+    ENCODED = False
+    # Share of this plugin's log records to keep (None: the logger default).
+    LOG_SAMPLE_RATE = None
 
     def __init__(
         self, 
@@ -53,14 +114,32 @@ class VoCaptchaPlugin(ABC):
         type=None,
         doc=None,
         field=None,
-        params=None
+        params=None,
+        workers: Optional[WorkerPool] = None,
+        issued: Optional[IssuedChallenges] = None,
+        analytics: Optional[CallerAnalytics] = None
     ):
         self.cache = cache
+        # Where to run CPU-bound work, with `await self.workers.run(...)`.
+        self.workers = workers or INLINE_POOL
+        # Where `issue` records the challenges sent to each session.
+        self.issued = issued
+        # Where verify outcomes go, per caller.
+        self.analytics = analytics
         self.mount = mount or self.MOUNT
         self.type = type or self.TYPE
         self.doc = doc or self.DOC
         self.field = field or self.FIELD
         self.params = params or self.PARAMS
+        if self.LOG_SAMPLE_RATE is not None:
+            logger.sample_rates[self.type] = self.LOG_SAMPLE_RATE
+        self.cache.register(self.doc, self.compile_templates, key=(self, TEMPLATES))
+        self.cache.register(self.doc, self.materialize, key=self)
+        self.pool = ChallengePool(
+            factory=self.make_challenge,
+            version=partial(self.cache.document_version, self.doc),
+            size=self.POOL_SIZE
+        )
 
     def __call__(self):
         return self.generate_routes()
@@ -73,6 +152,67 @@ class VoCaptchaPlugin(ABC):
     async def verify(self, webhook: WebhookRequest, templates: dict = ..., response = ...):
         ...
 
+    def materialize(self, document):
+        """
+        Runs once per cache snapshot in which the plugin's document changed,
+        off the request path.  Override it to precompute whatever generate
+        and verify need; the return value is available as self.materialized.
+        Raising rejects the document and the previous version keeps serving.
+        """
+        return None
+
+    @property
+    def materialized(self):
+        return self.cache.derived(self)
+
+    def prepare(self, templates) -> Optional[Challenge]:
+        """
+        Builds one ready-made Challenge from the compiled templates.  Plugins
+        that implement it and set POOL_SIZE can serve generate from
+        self.pool via next_challenge().
+        """
+        return None
+
+    @property
+    def pooled(self):
+        return self.POOL_SIZE > 0
+
+    def make_challenge(self):
+        challenge = self.prepare(self.get_templates())
+        return replace(
+            challenge,
+            body=encoding.encode(challenge.text, challenge.ssml, challenge.params)
+        )
+
+    def next_challenge(self) -> Challenge:
+        return self.pool.pop()
+
+    def serve(self, challenge: Challenge, response=None):
+        """
+        The challenge's pre-encoded body, or, when a WebhookResponse is
+        passed in, that response filled in with it.
+        """
+        if response is None:
+            return challenge.body
+        response.add_text_response(challenge.text)
+        response.add_audio_text_response(challenge.ssml)
+        response.add_session_params(challenge.params)
+        return response
+
+    def issue(self, webhook, challenge: Challenge, response=None):
+        """
+        Serves challenge and, if the server keeps an IssuedChallenges
+        store, records it as issued to the webhook's session so verify can
+        check the challenge it gets back.
+        """
+        session = session_of(webhook)
+        if self.issued is not None and session:
+            self.issued.record(session, challenge.params.get('challenge'))
+        return self.serve(challenge, response)
+
+    def new_response(self):
+        return None if self.ENCODED else WebhookResponse()
+
     def get_challenges(self):
         document = self.cache.get(self.doc)
         challenges = document.get(CHALLENGES)
@@ -80,71 +220,287 @@ class VoCaptchaPlugin(ABC):
             raise NotImplementedError("No challenges found!  Please review.")
         return challenges
 
-    def get_templates(self):
-        document = self.cache.get(self.doc)
+    def compile_templates(self, document):
+        """
+        Compiles the document's templates once per change, checking them
+        against PLACEHOLDERS (action -> names passed to render) so a bad
+        edit is rejected at load time.
+        """
         templates = document.get(TEMPLATES)
+        if not templates:
+            raise NotImplementedError("No templates found!  Please review.")
+        return compile_templates(templates, self.PLACEHOLDERS)
+
+    def get_templates(self):
+        templates = self.cache.derived((self, TEMPLATES))
         if not templates:
             raise NotImplementedError("No templates found!  Please review.")
         return templates
 
+    @cached_property
+    def actions(self) -> Dict[str, Tuple[Callable, frozenset]]:
+        """
+        The plugin's endpoints by action, with the methods each accepts.
+        The server's dispatcher serves /{mount}/{action} from this.
+        """
+        return {
+            "generate": (partial(self.adapt, endpoint=self.generate), GET_POST),
+            "verify": (partial(self.adapt, endpoint=self.verify), GET_POST),
+            "verify-batch": (self.adapt_batch, POST),
+        }
+
     def generate_routes(self):
         """
-            need to test and see if partial is working as desired.
+        The same endpoints as a Starlette Mount, for serving a plugin on
+        its own.
         """
         mount_name = self.MOUNT.replace("/", "")
-        generate = partial(self.adapt, endpoint=self.generate)
-        verify = partial(self.adapt, endpoint=self.verify)
-        mount = Mount(self.mount, name=mount_name, routes=[
-            Route("/generate", generate, methods=["GET", "POST"], name="generate"),
-            Route("/verify", verify, methods=["GET", "POST"], name="verify")
+        return Mount(self.mount, name=mount_name, routes=[
+            Route(f"/{action}", endpoint, methods=sorted(methods), name=action)
+            for action, (endpoint, methods) in self.actions.items()
         ])
-        return mount
+
+    def shed(self, action: str):
+        """
+        The response to a request for action that admission control turned
+        away: no parsing, no templates, no matching.
+        """
+        if action == "verify-batch":
+            return JSONResponse(OVERLOADED_BATCH, status_code=503, headers={"Retry-After": "1"})
+        return EncodedResponse(OVERLOADED_BODY)
+
+    def throttled(self):
+        """
+        The response to a caller over its rate limit, sent before the body
+        is even parsed.
+        """
+        return EncodedResponse(RATE_LIMITED_BODY)
+
+    async def verify_batch(self, webhooks: List[WebhookRequest], templates: dict = ...):
+        """
+        Verifies a list of webhooks and returns their WebhookResponses in
+        order.  The default runs verify once per item; plugins that can
+        score a whole batch at once should override it.
+        """
+        return [
+            await self.verify(webhook, templates=templates, response=self.new_response())
+            for webhook in webhooks
+        ]
+
+    async def adapt_batch(self, request: Request):
+        webhooks = await read_batch(request, self.FIELDS)
+        if webhooks is None:
+            return JSONResponse(UNPROCESSABLE_BATCH, status_code=422)
+        valid = [webhook for webhook in webhooks if webhook is not None]
+        try:
+            responses = iter(await self.verify_batch(valid, templates=self.get_templates()))
+        except ValidationError:
+            # A field outside FIELDS didn't validate when it was read.
+            responses = iter([UNPROCESSABLE] * len(valid))
+        return EncodedResponse(encoding.join(
+            next(responses) if webhook is not None else UNPROCESSABLE
+            for webhook in webhooks
+        ))
 
     async def adapt(self, request: Request, endpoint: Callable):
         if request.method == "POST":
-            try:
-                body = await request.json()
-                webhook = WebhookRequest(**body)
-            except ValidationError as e:
-                return JSONResponse({
-                    "message": "Request body does not conform to WebhookRequest specification.",
-                    "status_code": "422 UNPROCESSABLE ENTITY"
-                }, status_code=422)
+            webhook = decoding.decode(await request.body(), self.FIELDS)
+            if webhook is None:
+                return JSONResponse(UNPROCESSABLE, status_code=422)
         else:
             webhook = None
-        model_response = await endpoint(
-            webhook, 
-            templates=self.get_templates(), 
-            response=WebhookResponse()
-        )
+        try:
+            model_response = await endpoint(
+                webhook, 
+                templates=self.get_templates(), 
+                response=self.new_response()
+            )
+        except ValidationError:
+            # A field outside FIELDS didn't validate when it was read, which
+            # is the same 422 a full up-front validation would have given.
+            return JSONResponse(UNPROCESSABLE, status_code=422)
+        if isinstance(model_response, bytes):
+            return EncodedResponse(model_response)
         response = JSONResponse(model_response.dict(exclude_none=True))
         return response
 
     @property
     def pages(self):
-        generate_page = cx.Page()
-        generate_page.display_name = "generate-" + self.mount[1:]
+        from service.vocaptcha.admin import plugin_pages
+        return plugin_pages(self)
+
+    @property
+    def webhooks(self):
+        from service.vocaptcha.admin import plugin_webhooks
+        return plugin_webhooks(self)
+
+
+class FuzzyMatchPlugin(VoCaptchaPlugin):
+
+    """
+    Base class for plugins whose challenge is verified by fuzzy-matching the
+    caller's response (the challenge-response session parameter) against
+    the challenge that was issued.
+
+    PARAMS['matcher'] names the similarity engine (see
+    vocaptcha.matchers.MATCHERS) and PARAMS['fuzz_threshold'] is the 0-100
+    score a response has to beat.  Batches are scored in a single pass, on
+    the plugin's WorkerPool once they're over its size cutoff.
+
+    Scores are memoized per (TYPE, matcher, challenge, normalized response,
+    threshold) in a VerificationMemo of MEMO_SIZE entries that expire after
+    MEMO_TTL seconds, and the memo is dropped whenever the plugin's
+    document changes.
 
+    With an IssuedChallenges store, the challenge is checked against the
+    one issued to the session first; the result goes back in the
+    challenge-status session parameter.  In enforce mode, a challenge that
+    wasn't issued (or was already passed) fails without being scored.
+    """
 
-        verify_page = cx.Page()
-        verify_page.display_name = "verify-" + self.mount[1:]
-        return Pages(
-            generate=generate_page,
-            verify=verify_page
+    MEMO_SIZE = 10000
+    MEMO_TTL = 300
+    FIELDS = ("sessionInfo", "payload")
+    ENCODED = True
+
+    PARAMS = {
+        "matcher": DEFAULT_MATCHER,
+        "fuzz_threshold": 70
+    }
+    PLACEHOLDERS = {
+        "verify": ("challenge", "challenge_response", "match")
+    }
+
+    def __init__(self, cache, **kwargs):
+        params = kwargs.get('params') or self.PARAMS
+        self.matcher = get_matcher(params.get('matcher', DEFAULT_MATCHER))
+        self.memo = VerificationMemo(maxsize=self.MEMO_SIZE, ttl=self.MEMO_TTL)
+        super().__init__(cache, **kwargs)
+
+    def pair(self, webhook: WebhookRequest) -> Optional[Tuple[str, str]]:
+        """
+        The (challenge, challenge_response) to score, or None when the
+        session doesn't hold a challenge of this plugin's type.
+        """
+        session = webhook.sessionInfo
+        parameters = (session and session.parameters) or {}
+        challenge = parameters.get('challenge')
+        challenge_type = parameters.get('challenge-type')
+        if challenge_type != self.TYPE or challenge is None:
+            return None
+        return challenge, parameters.get('challenge-response')
+
+    async def score(self, pairs):
+        # A session parameter can also be a number, a list or a dict; those
+        # are scored (and memoized) as their text.
+        pairs = [
+            (str(challenge), None if challenge_response is None else str(challenge_response))
+            for challenge, challenge_response in pairs
+        ]
+        memo = self.memo
+        memo.sync(self.cache.document_version(self.doc))
+        matcher = self.matcher
+        threshold = self.params['fuzz_threshold']
+        keys = [
+            (
+                self.TYPE,
+                matcher.NAME,
+                challenge,
+                None if challenge_response is None else matcher.prepare(challenge_response),
+                threshold
+            )
+            for challenge, challenge_response in pairs
+        ]
+        scores = [memo.get(key) for key in keys]
+        missing = [n for n, score in enumerate(scores) if score is None]
+        if missing:
+            pending = [pairs[n] for n in missing]
+            size = sum(len(challenge) + len(str(challenge_response or '')) for challenge, challenge_response in pending)
+            fresh = await self.workers.run(matcher.score_batch, pending, size=size)
+            for n, score in zip(missing, fresh):
+                scores[n] = score
+                memo.put(keys[n], score)
+        return scores
+
+    def provenance(self, webhook, pair) -> Optional[str]:
+        """
+        How pair's challenge compares with the one issued to the webhook's
+        session (see vocaptcha.issued), or None without a store.
+        """
+        if self.issued is None or pair is None:
+            return None
+        status = self.issued.check(session_of(webhook), pair[0])
+        metrics.inc('challenge_checks_total', (('plugin', self.TYPE), ('status', status)))
+        return status
+
+    def rejected(self, status: Optional[str]) -> bool:
+        return status is not None and status != ISSUED and self.issued.enforce
+
+    def respond(self, pair, ratio, templates, response=None, status=None, webhook=None):
+        if pair is None:
+            if response is None:
+                return SOMETHING_WENT_WRONG_BODY
+            response.add_text_response(SOMETHING_WENT_WRONG)
+            return response
+        challenge, challenge_response = pair
+        match = 'match' if ratio > self.params['fuzz_threshold'] else "don't match"
+        is_match = True if match == 'match' else False
+        if is_match and status == ISSUED:
+            # Passing the same challenge again is a replay.
+            self.issued.consume(session_of(webhook))
+        metrics.observe_verify(self.TYPE, ratio, is_match)
+        if self.analytics is not None:
+            self.analytics.record(caller_of(webhook), self.TYPE, is_match, ratio)
+        logger.log(
+            "verify",
+            plugin=self.TYPE,
+            ratio=ratio,
+            challenge=challenge,
+            challenge_response=challenge_response,
+            passed=is_match
+        )
+        text = templates['verify']['text'].render(
+            challenge=challenge,
+            challenge_response=challenge_response,
+            match=match
         )
+        params = {
+            "challenge-response": challenge_response,
+            "challenge-passed": is_match
+        }
+        if status is not None:
+            params["challenge-status"] = status
+        if response is None:
+            return encoding.encode(text, text, params)
+        response.add_text_response(text)
+        response.add_audio_text_response(text)
+        response.add_session_params(params)
+        return response
 
-    @property
-    def webhooks(self):
-        generate_webhook = cx.Webhook()
-        generate_webhook.display_name = "generate-" + self.mount[1:]
-        generate_webhook.timeout = Duration(seconds=7)
-        generate_webhook.generic_web_service.uri = "https://replace.me"
-
-        verify_webhook = cx.Webhook()
-        verify_webhook.display_name = "verify-" + self.mount[1:]
-        verify_webhook.timeout = Duration(seconds=7)
-        verify_webhook.generic_web_service.uri = "https://replace.me"
-        return Webhooks(
-            generate=generate_webhook,
-            verify=verify_webhook
-        )
\ No newline at end of file
+    async def verify(
+        self, 
+        webhook: WebhookRequest, 
+        templates=...,
+        response=...
+    ):
+        pair = self.pair(webhook)
+        status = self.provenance(webhook, pair)
+        if pair is None or self.rejected(status):
+            ratio = 0
+        else:
+            ratio = (await self.score([pair]))[0]
+        return self.respond(pair, ratio, templates, response, status, webhook)
+
+    async def verify_batch(self, webhooks, templates=...):
+        # Batches are scored offline, not answered to a live session, so
+        # their challenges aren't checked against (or consumed from) the
+        # issued store.
+        pairs = [self.pair(webhook) for webhook in webhooks]
+        scored = [n for n, pair in enumerate(pairs) if pair]
+        ratios = [0] * len(pairs)
+        for n, ratio in zip(scored, await self.score([pairs[n] for n in scored])):
+            ratios[n] = ratio
+        return [
+            self.respond(pair, ratios[n], templates, self.new_response(), webhook=webhooks[n])
+            for n, pair in enumerate(pairs)
+        ]
@@ -0,0 +1,118 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from service.vocaptcha.logs import logger
+
+
+@dataclass(frozen=True)
+class Challenge:
+
+    """
+    A ready-made challenge: the rendered prompt and the session parameters
+    that go out with it, plus (once it's been through make_challenge) the
+    response body already serialized.
+    """
+
+    text: str
+    ssml: str
+    params: Dict[str, Any]
+    body: Optional[bytes] = None
+
+
+class ChallengePool:
+
+    """
+    A bounded pool of pre-generated challenges.  `pop` is an O(1) deque pop
+    on the request path; `run` refills the pool in the background whenever
+    it drops below the low-water mark.
+
+    Every entry is tagged with the version of the cache document it was
+    rendered from.  When the document changes the stale entries are flushed
+    and the pool is rebuilt from the new snapshot.  An empty pool never
+    fails a request: the challenge is generated inline instead.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Challenge],
+        version: Callable[[], Any],
+        size: int = 64,
+        low_water: int = None,
+        batch: int = 8,
+        interval: float = 1.0
+    ):
+        self.factory = factory
+        self.version = version
+        self.size = size
+        self.low_water = size // 4 if low_water is None else low_water
+        self.batch = batch
+        self.interval = interval
+        self.items = deque()
+        self.wanted = None
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def make(self):
+        version = self.version()
+        return version, self.factory()
+
+    def flush(self):
+        self.items.clear()
+        self.flushes += 1
+
+    def pop(self) -> Challenge:
+        current = self.version()
+        items = self.items
+        try:
+            version, challenge = items.popleft()
+            if version != current:
+                self.flush()
+                raise IndexError
+            self.hits += 1
+        except IndexError:
+            self.misses += 1
+            challenge = self.factory()
+        if self.wanted is not None and len(items) < self.low_water:
+            self.wanted.set()
+        return challenge
+
+    def fill(self, count: int = None):
+        """
+        Tops the pool up by at most count entries (default: to capacity).
+        """
+        if self.items and self.items[0][0] != self.version():
+            self.flush()
+        room = self.size - len(self.items)
+        if count is not None:
+            room = min(room, count)
+        for _ in range(room):
+            self.items.append(self.make())
+        return room
+
+    async def run(self):
+        """
+        Background refill loop.  Fills in small batches, yielding to the
+        event loop in between so a refill never holds up requests, then
+        sleeps until a pop drains the pool or `interval` elapses (which
+        picks up cache changes on an idle instance).
+        """
+        self.wanted = asyncio.Event()
+        while True:
+            try:
+                while self.fill(self.batch):
+                    await asyncio.sleep(0)
+            except Exception as e:
+                # A missing or rejected document; the request path falls
+                # back to inline generation, so just try again later.
+                logger.log("pool_refill_failed", severity="WARNING", error=repr(e))
+            self.wanted.clear()
+            try:
+                await asyncio.wait_for(self.wanted.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,223 @@
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from google.api_core import exceptions as api_exceptions
+    RETRYABLE = (
+        api_exceptions.TooManyRequests,
+        api_exceptions.ResourceExhausted,
+        api_exceptions.ServiceUnavailable,
+        api_exceptions.DeadlineExceeded,
+        api_exceptions.InternalServerError,
+        api_exceptions.Aborted,
+        ConnectionError,
+        TimeoutError,
+    )
+except ImportError:
+    RETRYABLE = (ConnectionError, TimeoutError)
+
+
+CREATE = 'create'
+UPDATE = 'update'
+NOOP = 'noop'
+DELETE = 'delete'
+
+SYMBOLS = {CREATE: '+', UPDATE: '~', NOOP: '=', DELETE: '-'}
+
+
+@dataclass
+class Change:
+
+    """
+    One step of a Plan: what to do (action) to which resource (kind and
+    display_name).  desired is the resource as it should be, current is
+    what the listing returned (None for a create; desired is None for a
+    delete).  result is filled in by Provisioner.apply.
+    """
+
+    action: str
+    kind: str
+    display_name: str
+    desired: Any = None
+    current: Any = None
+    result: Any = None
+    error: Optional[BaseException] = None
+
+    def describe(self) -> str:
+        return f"  {SYMBOLS[self.action]} {self.action:6} {self.kind} {self.display_name}"
+
+
+class Plan:
+
+    """
+    An ordered list of Changes.  `describe` renders it for a dry run;
+    `pending` is everything that isn't a no-op.
+    """
+
+    def __init__(self, changes: Iterable[Change] = ()):
+        self.changes: List[Change] = list(changes)
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __add__(self, other: 'Plan') -> 'Plan':
+        return Plan(self.changes + other.changes)
+
+    @property
+    def pending(self) -> List[Change]:
+        return [change for change in self.changes if change.action != NOOP]
+
+    @property
+    def failed(self) -> List[Change]:
+        return [change for change in self.changes if change.error is not None]
+
+    def counts(self) -> Dict[str, int]:
+        counts = {CREATE: 0, UPDATE: 0, NOOP: 0, DELETE: 0}
+        for change in self.changes:
+            counts[change.action] += 1
+        return counts
+
+    def describe(self) -> str:
+        counts = self.counts()
+        lines = [change.describe() for change in self.changes]
+        lines.append(
+            f"{counts[CREATE]} to create, {counts[UPDATE]} to update, "
+            f"{counts[DELETE]} to delete, {counts[NOOP]} unchanged."
+        )
+        return '\n'.join(lines)
+
+
+def diff(
+    kind: str,
+    desired: Dict[str, Any],
+    current: Dict[str, Any],
+    equal: Callable[[Any, Any], bool],
+    prune: Optional[Callable[[str], bool]] = None
+) -> Plan:
+    """
+    Compares the desired resources with the listed ones, both keyed by
+    display name.  Resources that only exist remotely are left alone
+    unless prune(display_name) says this deployment owns them.
+    """
+    changes = []
+    for display_name, resource in desired.items():
+        existing = current.get(display_name)
+        if existing is None:
+            changes.append(Change(CREATE, kind, display_name, desired=resource))
+        elif equal(resource, existing):
+            changes.append(Change(NOOP, kind, display_name, desired=resource, current=existing))
+        else:
+            changes.append(Change(UPDATE, kind, display_name, desired=resource, current=existing))
+    if prune is not None:
+        for display_name, existing in current.items():
+            if display_name not in desired and prune(display_name):
+                changes.append(Change(DELETE, kind, display_name, current=existing))
+    return Plan(changes)
+
+
+class TokenBucket:
+
+    """
+    A thread-safe token bucket: `rate` tokens a second, up to `burst` at
+    once.  `acquire` blocks until a token is available.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class Provisioner:
+
+    """
+    Applies Plans.  Every pending change is run on a thread pool (`workers`
+    at a time), each call waits for a token from a shared TokenBucket
+    (`rate` calls a second, `burst` at once), and calls that fail with a
+    retryable error are retried with exponential backoff and jitter, up to
+    `attempts` times.  A change that still fails keeps its exception in
+    Change.error; the rest of the plan carries on.
+
+    operations maps (kind, action) to a callable that takes the Change and
+    returns the resulting resource.
+    """
+
+    def __init__(
+        self,
+        operations: Dict[Tuple[str, str], Callable[[Change], Any]],
+        rate: float = 5.0,
+        burst: int = 5,
+        workers: int = 8,
+        attempts: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        retryable: Tuple[type, ...] = RETRYABLE,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        self.operations = operations
+        self.bucket = TokenBucket(rate, burst, sleep=sleep)
+        self.workers = workers
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retryable = retryable
+        self.sleep = sleep
+        self.calls = 0
+        self.retries = 0
+        self.lock = Lock()
+
+    def call(self, function: Callable, *args, **kwargs):
+        """
+        One rate-limited API call with retries.
+        """
+        for attempt in range(self.attempts):
+            self.bucket.acquire()
+            with self.lock:
+                self.calls += 1
+            try:
+                return function(*args, **kwargs)
+            except self.retryable:
+                if attempt == self.attempts - 1:
+                    raise
+                with self.lock:
+                    self.retries += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                self.sleep(delay * random.uniform(0.5, 1.0))
+
+    def run(self, change: Change) -> Change:
+        operation = self.operations[change.kind, change.action]
+        try:
+            change.result = self.call(operation, change)
+        except Exception as e:
+            change.error = e
+        return change
+
+    def apply(self, plan: Plan) -> Plan:
+        pending = plan.pending
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pending))) as pool:
+                list(pool.map(self.run, pending))
+        return plan
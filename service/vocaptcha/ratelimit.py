@@ -0,0 +1,86 @@
+import re
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+# Found in the raw body, before anything is parsed.  Telephony calls carry
+# the caller's number in payload.telephony.caller_id; everything else is
+# keyed by the session id at the end of sessionInfo.session.
+CALLER_ID = re.compile(rb'"caller_id"\s*:\s*"([^"\\]{1,128})"')
+SESSION = re.compile(rb'"session"\s*:\s*"[^"\\]*/sessions/([^"\\/]{1,256})"')
+
+
+def caller_key(body: bytes) -> Optional[bytes]:
+    """
+    The caller id or, failing that, the session id in a webhook body, or
+    None if it has neither.
+    """
+    match = CALLER_ID.search(body) or SESSION.search(body)
+    return match.group(1) if match else None
+
+
+class RateLimiter:
+
+    """
+    Per-caller token buckets: `rate` requests a second, up to `burst` at
+    once.  `allow` is a hash, a dict lookup and some arithmetic, so an
+    over-limit caller costs next to nothing to turn away.
+
+    Buckets are spread over `shards` LRU-ordered dicts, which keeps the
+    eviction work per call small.  A bucket that hasn't been touched for
+    burst / rate seconds has refilled completely, so it's dropped.
+    Memory stays bounded at max_callers buckets: past that, the least
+    recently seen caller is dropped even if it isn't idle yet (counted in
+    `evictions`).
+
+    Like Admission, it's only used from the event loop, so there are no
+    locks.
+    """
+
+    def __init__(
+        self,
+        rate: float = 0.5,
+        burst: int = 10,
+        shards: int = 16,
+        max_callers: int = 100_000,
+        clock=time.monotonic
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.idle = burst / rate
+        self.shards = [OrderedDict() for _ in range(shards)]
+        self.capacity = max(1, max_callers // shards)
+        self.clock = clock
+        self.evictions = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def allow(self, key: Hashable) -> bool:
+        now = self.clock()
+        shard = self.shards[hash(key) % len(self.shards)]
+        bucket = shard.get(key)
+        if bucket is None:
+            tokens = self.burst
+        else:
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        else:
+            self.rejected += 1
+        shard[key] = (tokens, now)
+        shard.move_to_end(key)
+        self.evict(shard, now)
+        return allowed
+
+    def evict(self, shard: OrderedDict, now: float):
+        while shard:
+            key, (tokens, updated) = next(iter(shard.items()))
+            idle = now - updated >= self.idle
+            if not idle and len(shard) <= self.capacity:
+                return
+            shard.popitem(last=False)
+            if not idle:
+                self.evictions += 1
@@ -0,0 +1,148 @@
+import importlib
+from dataclasses import dataclass
+from threading import RLock
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Installed packages can provide plugins under this entry point group,
+# named after the plugin's mount:
+#   [tool.poetry.plugins."vocaptcha.plugins"]
+#   "acme-colors" = "acme.vocaptcha:ColorsPlugin"
+ENTRY_POINT_GROUP = 'vocaptcha.plugins'
+
+
+@dataclass
+class PluginSpec:
+
+    """
+    Where to find a plugin class, and the name it's served under (its
+    mount without the slash).  name is None when the config doesn't give
+    one; the plugin is then imported up front to read its MOUNT.
+    """
+
+    module: str
+    cls: str
+    name: Optional[str] = None
+
+    def load(self) -> type:
+        return getattr(importlib.import_module(self.module), self.cls)
+
+
+def entry_points(group: str = ENTRY_POINT_GROUP) -> List[PluginSpec]:
+    from importlib import metadata
+    found = metadata.entry_points()
+    # Python 3.9 returns a dict of groups; 3.10+ has select().
+    found = found.select(group=group) if hasattr(found, 'select') else found.get(group, ())
+    specs = []
+    for entry_point in found:
+        module, _, cls = entry_point.value.partition(':')
+        specs.append(PluginSpec(module.strip(), cls.strip(), entry_point.name))
+    return specs
+
+
+def mount_name(mount: str) -> str:
+    return mount.strip('/')
+
+
+class PluginRegistry:
+
+    """
+    Knows every plugin by name but only imports and instantiates one (with
+    factory(plugin_class)) when it's first asked for, so startup doesn't
+    grow with the number of plugins configured.  Lookups are a dict get
+    once a plugin is loaded.
+
+    `by_type` finds a plugin by its challenge type, which is only known
+    once the plugin is loaded; a miss loads the rest.  `load_all` is for
+    the callers that need every plugin (provisioning, the file and memory
+    backends).
+    """
+
+    def __init__(self, specs: Iterable[PluginSpec], factory: Callable[[type], object]):
+        self.factory = factory
+        self.specs: Dict[str, PluginSpec] = {}
+        self.instances: Dict[str, object] = {}
+        self.types: Dict[str, object] = {}
+        self.lock = RLock()
+        for spec in specs:
+            if spec.name is None:
+                plugin_class = spec.load()
+                spec.name = mount_name(plugin_class.MOUNT)
+                if spec.name not in self.specs:
+                    self.specs[spec.name] = spec
+                    self.instantiate(spec.name, plugin_class)
+            else:
+                self.specs.setdefault(spec.name, spec)
+
+    @classmethod
+    def from_config(
+        cls,
+        plugins,
+        plugin_folder: str,
+        factory: Callable[[type], object],
+        entry_point_group: Optional[str] = None
+    ) -> 'PluginRegistry':
+        """
+        Config entries come first (and win on a name clash), then the
+        entry points in entry_point_group, if one is given.
+        """
+        specs = [
+            PluginSpec(
+                f'service.{plugin_folder}.{plugin.module}',
+                plugin.cls,
+                mount_name(plugin.mount) if plugin.mount else None
+            )
+            for plugin in plugins
+        ]
+        if entry_point_group:
+            specs.extend(entry_points(entry_point_group))
+        return cls(specs, factory)
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.specs)
+
+    def instantiate(self, name: str, plugin_class: type):
+        instance = self.factory(plugin_class)
+        self.instances[name] = instance
+        self.types.setdefault(instance.type, instance)
+        return instance
+
+    def get(self, name: str):
+        """
+        The plugin served under name, loading it if need be; None if there
+        isn't one.
+        """
+        instance = self.instances.get(name)
+        if instance is not None:
+            return instance
+        spec = self.specs.get(name)
+        if spec is None:
+            return None
+        with self.lock:
+            instance = self.instances.get(name)
+            if instance is None:
+                instance = self.instantiate(name, spec.load())
+        return instance
+
+    def by_type(self, challenge_type: str):
+        instance = self.types.get(challenge_type)
+        if instance is None and len(self.instances) < len(self.specs):
+            self.load_all()
+            instance = self.types.get(challenge_type)
+        return instance
+
+    def classes(self) -> List[type]:
+        """
+        Every plugin class, imported but not instantiated.
+        """
+        return [
+            type(self.instances[name]) if name in self.instances else spec.load()
+            for name, spec in self.specs.items()
+        ]
+
+    def load_all(self) -> list:
+        return [self.get(name) for name in self.specs]
+
+    @property
+    def loaded(self) -> list:
+        return list(self.instances.values())
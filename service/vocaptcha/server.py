@@ -1,19 +1,44 @@
 import os
 import time
-import importlib
+import asyncio
 import yaml
+from functools import partial, cached_property
 from typing import Optional, Union, List, Dict
 
 
 from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
 from google.cloud import firestore
 from google.cloud.firestore import CollectionReference
-from google.cloud import dialogflowcx_v3 as cx
 
-from service.vocaptcha.plugins import VoCaptchaPlugin, Webhooks
+from service.vocaptcha.plugins import (
+    VoCaptchaPlugin, read_batch, UNPROCESSABLE, UNPROCESSABLE_BATCH,
+    SOMETHING_WENT_WRONG_BODY, OVERLOADED_BATCH
+)
+from service.vocaptcha import encoding
+from service.vocaptcha.encoding import EncodedResponse
+from service.vocaptcha.logs import logger
+from service.vocaptcha.metrics import (
+    metrics, MetricsMiddleware, PROMETHEUS_CONTENT_TYPE
+)
 from service.vocaptcha.cache import ResponseCache
+from service.vocaptcha.backends import CacheBackend, FIRESTORE, make_backend
+from service.vocaptcha.shared import SharedBackend
+from service.vocaptcha.warm import WarmBackend
+from service.vocaptcha.registry import PluginRegistry, ENTRY_POINT_GROUP
+from service.vocaptcha.admission import Admission, WEBHOOK_TIMEOUT
+from service.vocaptcha.workers import WorkerPool, THREAD, CUTOFF
+from service.vocaptcha.ratelimit import RateLimiter, caller_key
+from service.vocaptcha.issued import IssuedChallenges, OFF, REPORT
+from service.vocaptcha.analytics import CallerAnalytics, JSONL, make_sink
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+
+# The name the top-level /verify-batch is admitted under (see Admission).
+MIXED_BATCH = 'verify-batch'
 
 
 class Plugin(BaseModel):
@@ -24,9 +49,77 @@ class Plugin(BaseModel):
 
     module: str
     cls: str
+    # The plugin's MOUNT.  Plugins that give it aren't imported until
+    # they're first used; the rest are imported at startup to read it.
+    mount: Optional[str]
     parameters: Optional[Dict[str, str]]
 
 
+class AdmissionConfig(BaseModel):
+
+    """
+    Admission control for the plugin routes (see vocaptcha.admission).
+    """
+
+    limit: int = 256
+    pluginLimit: int = 64
+    deadline: float = WEBHOOK_TIMEOUT
+    queue: int = 1024
+
+
+class WorkerPoolConfig(BaseModel):
+
+    """
+    Where plugins run CPU-bound work (see vocaptcha.workers).
+    """
+
+    kind: str = THREAD
+    workers: Optional[int] = None
+    cutoff: int = CUTOFF
+
+
+class RateLimitConfig(BaseModel):
+
+    """
+    Per-caller rate limiting for the plugin routes (see
+    vocaptcha.ratelimit).
+    """
+
+    rate: float = 0.5
+    burst: int = 10
+    shards: int = 16
+    maxCallers: int = 100_000
+
+
+class IssuedChallengesConfig(BaseModel):
+
+    """
+    Which challenge was issued to which session (see vocaptcha.issued).
+    mode is off, report or enforce.
+    """
+
+    mode: str = REPORT
+    ttl: float = 600
+    maxEntries: int = 500_000
+
+
+class AnalyticsConfig(BaseModel):
+
+    """
+    Per-caller verify analytics (see vocaptcha.analytics).  sink is jsonl
+    or sqlite (written to path) or firestore (added to collection).
+    """
+
+    sink: str = JSONL
+    path: Optional[str] = None
+    collection: Optional[str] = None
+    interval: float = 10.0
+    top: int = 100
+    width: int = 2048
+    depth: int = 4
+    maxBuffer: int = 100_000
+
+
 class VoCaptchaConfig(BaseModel):
 
     """
@@ -41,7 +134,18 @@ class VoCaptchaConfig(BaseModel):
     pluginFolder: str
     agentName: str
     flowName: str
-    
+    backend: str = FIRESTORE
+    readyTimeout: Optional[float] = 30
+    sharedSnapshot: Optional[str] = None
+    warmSnapshot: Optional[str] = None
+    pluginEntryPoints: bool = False
+    admission: AdmissionConfig = AdmissionConfig()
+    workerPool: WorkerPoolConfig = WorkerPoolConfig()
+    rateLimit: Optional[RateLimitConfig] = None
+    issuedChallenges: IssuedChallengesConfig = IssuedChallengesConfig()
+    analytics: Optional[AnalyticsConfig] = None
+
+
 class VoCaptchaManager:
 
     """
@@ -51,16 +155,34 @@ class VoCaptchaManager:
     In the next iteration, we'll implement a Pydantic validator to circumvent
     the need to replace the "collection" which comes in as a string but
     needs to be converted into a Firestore Reference object for use with
-    the firestore.*Reference.on_snapshot method.  
+    the firestore.*Reference.on_snapshot method.
+
+    The Firestore client is only created for the "firestore" backend; the
+    "file" and "memory" backends serve the local plugin documents instead.
+    The backend can be overridden with the backend argument or the
+    VOCAPTCHA_BACKEND environment variable, sharedSnapshot with
+    VOCAPTCHA_SHARED_SNAPSHOT and warmSnapshot with
+    VOCAPTCHA_WARM_SNAPSHOT.
     """
 
-    def __init__(self, path = "vocaptcha.yaml"):
+    def __init__(self, path = "vocaptcha.yaml", backend = None):
         print(f"Current working directory: {os.getcwd()}")
         with open(path) as src:
             config = yaml.load(src, Loader=yaml.Loader)
         self.config = VoCaptchaConfig(**config)
-        self.client = firestore.Client()
-        self.config.collection = self.client.collection(self.config.collection)
+        self.config.backend = (
+            backend or os.environ.get("VOCAPTCHA_BACKEND") or self.config.backend
+        )
+        self.config.sharedSnapshot = (
+            os.environ.get("VOCAPTCHA_SHARED_SNAPSHOT") or self.config.sharedSnapshot
+        )
+        self.config.warmSnapshot = (
+            os.environ.get("VOCAPTCHA_WARM_SNAPSHOT") or self.config.warmSnapshot
+        )
+        self.client = None
+        if self.config.backend == FIRESTORE:
+            self.client = firestore.Client()
+            self.config.collection = self.client.collection(self.config.collection)
         self.agent_name = self.config.agentName
         self.flow_name = self.config.flowName
 
@@ -79,18 +201,48 @@ class VoCaptchaServer:
     manager = VoCaptchaManager()
     config = manager.config
 
-    app = VoCaptchaServer(
-        plugins=config.plugins,
-        collection=config.collection,
-        plugin_folder=config.pluginFolder
-    )
+    app = VoCaptchaServer.from_config(config)
     `
 
-    """
+    backend is either the name of a CacheBackend ("firestore", "file",
+    "memory") or a CacheBackend instance.
+
+    With shared_snapshot (a file path), the worker processes on a host
+    share one instance of that backend through a SharedBackend: one of
+    them watches it and publishes snapshots to the file, and all of them
+    serve from a read-only mapping of it.
+
+    With warm_snapshot (a file path), the backend is wrapped in a
+    WarmBackend: the server starts serving from the snapshot saved there
+    while the backend catches up, and /ready reports whether it has.
+
+    Plugins are kept in a PluginRegistry and loaded on first use.  With
+    entry_points, installed packages' vocaptcha.plugins entry points are
+    served too.  Every /{plugin}/{action} request goes through one
+    dispatcher route that looks the plugin up by name (its mount, which
+    may have several segments).
 
-    webhooks_client = cx.WebhooksClient()
-    pages_client = cx.PagesClient()
-    flows_client = cx.FlowsClient()
+    The dispatcher admits plugin requests through admission (an
+    Admission; by default the server-wide and per-plugin limits from
+    AdmissionConfig), shedding those that would miss the webhook deadline
+    with the plugin's cheap fallback response.
+
+    Plugins run CPU-bound work such as verification scoring on workers, a
+    WorkerPool (by default a thread pool; small inputs stay inline).
+
+    With rate_limiter (a RateLimiter), each caller's generate and verify
+    requests are counted against a token bucket before anything else
+    happens to them.  A caller over its limit gets the plugin's throttled
+    response.
+
+    With issued (an IssuedChallenges), generate records the challenge it
+    sends to each session and verify checks the one it gets back against
+    it.
+
+    With analytics (a CallerAnalytics), verify outcomes are aggregated per
+    caller and plugin and flushed to its sink by a background task.
+
+    """
 
     def __init__(
         self, 
@@ -98,198 +250,385 @@ class VoCaptchaServer:
         collection = None,
         plugin_folder = None,
         agent_name = None,
-        flow_name = None
+        flow_name = None,
+        backend: Union[str, CacheBackend] = FIRESTORE,
+        ready_timeout: Optional[float] = 30,
+        shared_snapshot: Optional[str] = None,
+        warm_snapshot: Optional[str] = None,
+        entry_points: bool = False,
+        admission: Optional[Admission] = None,
+        workers: Optional[WorkerPool] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        issued: Optional[IssuedChallenges] = None,
+        analytics: Optional[CallerAnalytics] = None
     ):
         self.plugins = plugins
         self.collection = collection
         self.cache = ResponseCache()
-        self.cache.watch(collection)
         self.plugin_folder = plugin_folder
         self.agent_name = agent_name
         self.flow_name = self.agent_name + f'/flows/{flow_name}'
-        
-        self.plugin_instances = self.initialize_plugins()
-
-    def initialize_plugins(self):
-        plugin_instances = []
-        for plugin in self.plugins:
-            module_path = f'service.{self.plugin_folder}.{plugin.module}'
-            module = importlib.import_module(module_path)
-            plugin = getattr(module, plugin.cls)
-            instance = plugin(
-                cache=self.cache
+
+        self._admin = None
+        self.tasks = None
+        self.admission = admission or Admission()
+        self.workers = workers or WorkerPool()
+        self.rate_limiter = rate_limiter
+        self.issued = issued
+        self.analytics = analytics
+
+        self.registry = PluginRegistry.from_config(
+            plugins,
+            plugin_folder,
+            factory=self.load_plugin,
+            entry_point_group=ENTRY_POINT_GROUP if entry_points else None
+        )
+        if isinstance(backend, CacheBackend):
+            source = lambda: backend
+        else:
+            source = partial(
+                make_backend,
+                backend,
+                # Only the local backends need to know the plugins' documents.
+                plugins=() if backend == FIRESTORE else self.registry.classes(),
+                collection=collection
+            )
+        if warm_snapshot:
+            live = source
+            source = lambda: WarmBackend(warm_snapshot, live())
+        self.backend = SharedBackend(shared_snapshot, source) if shared_snapshot else source()
+        self.cache.watch(self.backend, timeout=ready_timeout)
+
+    @classmethod
+    def from_config(cls, config: VoCaptchaConfig, **overrides):
+        """
+        The server a VoCaptchaConfig describes, with every optional part
+        (rate limiter, issued challenges, analytics) it turns on.  Keyword
+        arguments override the constructor's arguments.
+        """
+        kwargs = dict(
+            plugins=config.plugins,
+            collection=config.collection,
+            plugin_folder=config.pluginFolder,
+            agent_name=config.agentName,
+            flow_name=config.flowName,
+            backend=config.backend,
+            ready_timeout=config.readyTimeout,
+            shared_snapshot=config.sharedSnapshot,
+            warm_snapshot=config.warmSnapshot,
+            entry_points=config.pluginEntryPoints,
+            admission=Admission(
+                limit=config.admission.limit,
+                plugin_limit=config.admission.pluginLimit,
+                deadline=config.admission.deadline,
+                queue=config.admission.queue
+            ),
+            workers=WorkerPool(
+                kind=config.workerPool.kind,
+                workers=config.workerPool.workers,
+                cutoff=config.workerPool.cutoff
+            ),
+            rate_limiter=config.rateLimit and RateLimiter(
+                rate=config.rateLimit.rate,
+                burst=config.rateLimit.burst,
+                shards=config.rateLimit.shards,
+                max_callers=config.rateLimit.maxCallers
+            ),
+            issued=None if config.issuedChallenges.mode == OFF else IssuedChallenges(
+                ttl=config.issuedChallenges.ttl,
+                max_entries=config.issuedChallenges.maxEntries,
+                mode=config.issuedChallenges.mode
+            ),
+            analytics=config.analytics and CallerAnalytics(
+                make_sink(
+                    config.analytics.sink,
+                    path=config.analytics.path,
+                    collection=config.analytics.collection
+                ),
+                interval=config.analytics.interval,
+                top=config.analytics.top,
+                width=config.analytics.width,
+                depth=config.analytics.depth,
+                maxsize=config.analytics.maxBuffer
             )
-            plugin_instances.append(instance)
-        return plugin_instances
+        )
+        kwargs.update(overrides)
+        return cls(**kwargs)
+
+    def load_plugin(self, plugin_class):
+        """
+        The registry's factory.  A plugin loaded once the app is running
+        starts its pool's refill task straight away.
+        """
+        instance = plugin_class(
+            cache=self.cache,
+            workers=self.workers,
+            issued=self.issued,
+            analytics=self.analytics
+        )
+        if self.tasks is not None and instance.pooled:
+            try:
+                self.tasks.append(asyncio.get_running_loop().create_task(instance.pool.run()))
+            except RuntimeError:
+                # Loaded off the event loop (e.g. by provisioning); it
+                # generates inline until the pool has a task.
+                pass
+        return instance
+
+    @property
+    def plugin_instances(self):
+        """
+        Every plugin, loading the ones that haven't been used yet.
+        """
+        return self.registry.load_all()
 
 
     def __call__(self):
         """
-        Creates an instance of the plugins, creates routes for those plugins,
-        mounts them to their path(s), and returns an instance of Starlette that
-        uvicorn will accept.  
+        Creates the routes - the server's own and the plugin dispatcher - and
+        returns an instance of Starlette that uvicorn will accept.  The
+        number of routes doesn't depend on the number of plugins.
         """
-        routes = []
-        for instance in self.plugin_instances:
-            plugin_routes = instance()
-            routes.append(plugin_routes)       
-        return Starlette(routes=routes)
+        routes = [
+            Route("/verify-batch", self.verify_batch, methods=["POST"], name="verify-batch"),
+            Route("/metrics", self.metrics_endpoint, methods=["GET"], name="metrics"),
+            Route("/ready", self.ready_endpoint, methods=["GET"], name="ready"),
+            # plugin is everything up to the last segment, so mounts can
+            # be nested (e.g. /v2/sentences).
+            Route("/{plugin:path}/{action}", self.dispatch, methods=["GET", "POST"], name="plugin")
+        ]
+        self.register_gauges()
+        return Starlette(
+            routes=routes,
+            middleware=[
+                Middleware(
+                    MetricsMiddleware,
+                    metrics=metrics,
+                    plugins=self.registry.names
+                )
+            ],
+            on_startup=[self.startup],
+            on_shutdown=[self.shutdown]
+        )
 
-    @property
-    def current_webhooks(self):
-        list_webhooks = self.webhooks_client.list_webhooks(parent=self.agent_name)
-        time.sleep(1)
-        return {
-            webhook.display_name: webhook
-            for webhook in list(list_webhooks)
-        }
+    def register_gauges(self):
+        """
+        Values read straight off the cache, pools, memos and logger when
+        /metrics is scraped; nothing extra is recorded on the request path.
+        """
+        cache = self.cache
+        registry = self.registry
+
+        def per_plugin(read):
+            return lambda: [
+                ((('plugin', instance.type),), read(instance))
+                for instance in registry.loaded
+                if read(instance) is not None
+            ]
+
+        metrics.gauge('cache_snapshot_version', lambda: [((), cache.version)],
+            "Version of the ResponseCache snapshot being served.")
+        metrics.gauge('cache_snapshot_age_seconds', lambda: [((), time.time() - cache.snapshot.created)],
+            "Seconds since the ResponseCache snapshot was published.")
+        metrics.gauge('cache_stale_seconds', lambda: [((), self.stale_seconds or 0.0)],
+            "How far behind the backend the served documents may be (0 once live).")
+        metrics.gauge('pool_size', per_plugin(lambda instance: len(instance.pool)),
+            "Ready-made challenges in each plugin's pool.")
+        metrics.gauge('pool_misses', per_plugin(lambda instance: instance.pool.misses),
+            "Challenges generated inline because the pool was empty.")
+        metrics.gauge('memo_hits', per_plugin(lambda instance: getattr(getattr(instance, 'memo', None), 'hits', None)),
+            "Verification scores served from the memo.")
+        metrics.gauge('memo_misses', per_plugin(lambda instance: getattr(getattr(instance, 'memo', None), 'misses', None)),
+            "Verification scores computed by the matcher.")
+        metrics.gauge('admission_inflight', lambda: [
+            ((('plugin', name),), count) for name, count in self.admission.plugin_inflight.items()
+        ], "Plugin requests being served.")
+        metrics.gauge('admission_queue_length', lambda: [((), len(self.admission.waiters))],
+            "Plugin requests waiting for admission.")
+        metrics.gauge('worker_pool_queue_length', lambda: [((('kind', self.workers.kind),), self.workers.queued)],
+            "Offloaded calls submitted to the worker pool and not finished yet.")
+        if self.rate_limiter is not None:
+            metrics.gauge('rate_limit_callers', lambda: [((), len(self.rate_limiter))],
+                "Callers with a rate limit bucket.")
+            metrics.gauge('rate_limit_evictions', lambda: [((), self.rate_limiter.evictions)],
+                "Buckets dropped before they were idle to stay under maxCallers.")
+        if self.issued is not None:
+            metrics.gauge('issued_challenges', lambda: [((), len(self.issued))],
+                "Sessions with an issued challenge on record.")
+            metrics.gauge('issued_evictions', lambda: [((), self.issued.evictions)],
+                "Issued challenges dropped before their ttl to stay under maxEntries.")
+        if self.analytics is not None:
+            metrics.gauge('analytics_buffer_length', lambda: [((), len(self.analytics.buffer))],
+                "Verify outcomes waiting for the next analytics flush.")
+            metrics.gauge('analytics_dropped', lambda: [((), self.analytics.dropped)],
+                "Verify outcomes dropped because the analytics buffer was full.")
+        metrics.gauge('log_dropped', lambda: [((), logger.dropped)],
+            "Log records dropped because the queue was full.")
+
+    async def dispatch(self, request: Request):
+        """
+        Serves /{plugin}/{action}: two dict lookups, loading the plugin if
+        this is its first request, then rate limiting and admission
+        control.  Batches aren't rate limited; they aren't one caller's.
+        """
+        admission = self.admission
+        arrived = admission.clock()
+        name = request.path_params["plugin"]
+        instance = self.registry.get(name)
+        action = instance.actions.get(request.path_params["action"]) if instance else None
+        if action is None:
+            return PlainTextResponse("Not Found", status_code=404)
+        endpoint, methods = action
+        if request.method not in methods:
+            return PlainTextResponse(
+                "Method Not Allowed", status_code=405, headers={"Allow": ", ".join(sorted(methods))}
+            )
+        action_name = request.path_params["action"]
+        if self.rate_limiter is not None and action_name != "verify-batch":
+            key = caller_key(await request.body())
+            if key is None and request.client:
+                key = request.client.host
+            if not self.rate_limiter.allow(key):
+                metrics.inc('rate_limited_total', (('plugin', name),))
+                return instance.throttled()
+        if not await admission.acquire(name, arrived, action_name):
+            return instance.shed(action_name)
+        started = admission.clock()
+        try:
+            return await endpoint(request)
+        finally:
+            admission.release(name, started, action_name)
+
+    async def metrics_endpoint(self, request: Request):
+        return Response(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
 
     @property
-    def plugin_webhooks(self):
-        plugin_webhooks = []
+    def stale_seconds(self) -> Optional[float]:
+        stale_since = self.backend.stale_since
+        return None if stale_since is None else time.time() - stale_since
+
+    async def ready_endpoint(self, request: Request):
+        """
+        503 until the cache has documents to serve.  After that it's 200,
+        with stale set while they come from a warm snapshot the backend
+        hasn't caught up with yet (staleSeconds is the snapshot's age).
+        """
+        ready = self.cache.ready.is_set()
+        stale = self.stale_seconds
+        return JSONResponse({
+            "ready": ready,
+            "stale": stale is not None,
+            "staleSeconds": stale,
+            "version": self.cache.version,
+        }, status_code=200 if ready else 503)
+
+    @cached_property
+    def batch_fields(self):
+        """
+        Every field any plugin reads (plus sessionInfo, which routing needs),
+        or None if some plugin wants the whole body validated.  The first
+        batch loads every plugin.
+        """
+        fields = {"sessionInfo"}
         for instance in self.plugin_instances:
-            plugin_webhooks.append(instance.webhooks)
-        return {
-            webhook.display_name: webhook
-            for _webhook in plugin_webhooks
-            for webhook in _webhook.yield_pair() 
-        }
+            if instance.FIELDS is None:
+                return None
+            fields.update(instance.FIELDS)
+        return tuple(sorted(fields))
 
-    def inject_webhooks(self):
-        print("Proposed webhooks:\n\t - - - - -")
-        for hook in self.plugin_webhooks:
-            print(hook)
-
-        for _display_name, webhook in self.plugin_webhooks.items():
-            if _display_name not in self.current_webhooks:
-                result = self.webhooks_client.create_webhook(
-                    webhook = webhook,
-                    parent = self.agent_name
-                )
-                assert result.display_name == _display_name
-                print(f"Created webhook: {_display_name}")
+    async def verify_batch(self, request: Request):
+        """
+        Verifies a mixed batch of webhooks.  Items are grouped by their
+        challenge-type session parameter, each group goes through its
+        plugin's verify_batch in one pass, and the responses come back in
+        the order they were sent.
+
+        It's admitted like the plugin routes, under the name verify-batch:
+        it counts towards the server-wide limit and sheds with a 503.
+        """
+        admission = self.admission
+        arrived = admission.clock()
+        if not await admission.acquire(MIXED_BATCH, arrived, MIXED_BATCH):
+            return JSONResponse(OVERLOADED_BATCH, status_code=503, headers={"Retry-After": "1"})
+        started = admission.clock()
+        try:
+            return await self.verify_mixed(request)
+        finally:
+            admission.release(MIXED_BATCH, started, MIXED_BATCH)
+
+    async def verify_mixed(self, request: Request):
+        webhooks = await read_batch(request, self.batch_fields)
+        if webhooks is None:
+            return JSONResponse(UNPROCESSABLE_BATCH, status_code=422)
+        results = [UNPROCESSABLE] * len(webhooks)
+        groups = {}
+        for n, webhook in enumerate(webhooks):
+            if webhook is None:
+                continue
+            parameters = (webhook.sessionInfo and webhook.sessionInfo.parameters) or {}
+            groups.setdefault(parameters.get('challenge-type'), []).append(n)
+        for challenge_type, positions in groups.items():
+            plugin = self.registry.by_type(challenge_type)
+            if plugin is None:
+                responses = [SOMETHING_WENT_WRONG_BODY] * len(positions)
             else:
-                current_webhook = self.current_webhooks[_display_name]
-                webhook.name = current_webhook.name
-                result = self.webhooks_client.update_webhook(
-                    webhook = webhook
-                )
-                assert result.display_name == _display_name
-                print(f"Updated webhook: {_display_name}")
-            time.sleep(1)     
+                try:
+                    responses = await plugin.verify_batch(
+                        [webhooks[n] for n in positions],
+                        templates=plugin.get_templates()
+                    )
+                except ValidationError:
+                    responses = [UNPROCESSABLE] * len(positions)
+            for n, response in zip(positions, responses):
+                results[n] = response
+        return EncodedResponse(encoding.join(results))
+
+    async def startup(self):
+        """
+        Starts the background refill task of every loaded plugin's
+        challenge pool (plugins loaded later start their own), and the
+        analytics flush task.
+        """
+        self.tasks = [
+            asyncio.create_task(instance.pool.run())
+            for instance in self.registry.loaded
+            if instance.pooled
+        ]
+        if self.analytics is not None:
+            self.tasks.append(asyncio.create_task(self.analytics.run()))
+
+    async def shutdown(self):
+        for task in self.tasks or []:
+            task.cancel()
+        self.tasks = None
+        self.workers.shutdown()
+        if self.analytics is not None:
+            try:
+                await asyncio.to_thread(self.analytics.flush)
+            finally:
+                self.analytics.sink.close()
+        logger.flush()
 
     @property
-    def current_pages(self):
-        list_pages = self.pages_client.list_pages(parent=self.flow_name)
-        time.sleep(1)
-        return {
-            page.display_name: page
-            for page in list(list_pages)
-        }
+    def admin(self):
+        """
+        The provisioning component (vocaptcha.admin.VoCaptchaAdmin).  It's
+        imported on first use so serving never loads the Dialogflow CX
+        client library or opens its gRPC channels.
+        """
+        if self._admin is None:
+            from service.vocaptcha.admin import VoCaptchaAdmin
+            self._admin = VoCaptchaAdmin(self)
+        return self._admin
 
-    @property
-    def plugin_pages(self):
-        plugin_pages = []
-        for instance in self.plugin_instances:
-            plugin_pages.append(instance.pages)
-        return {
-            page.display_name: page
-            for _page in plugin_pages
-            for page in _page.yield_pair() 
-        }
+    def inject_webhooks(self):
+        return self.admin.inject_webhooks()
 
     def inject_pages(self):
-        print("Proposed pages:\n\t - - - - -")
-        for page in self.plugin_pages:
-            print(page)
-
-        for _display_name, page in self.plugin_pages.items():
-            if _display_name not in self.current_pages:
-                result = self.pages_client.create_page(
-                    page = page,
-                    parent = self.flow_name
-                )
-                assert result.display_name == _display_name
-                print(f"Created page: {_display_name}")
-            else:
-                current_page = self.current_pages[_display_name]
-                page.name = current_page.name
-                result = self.pages_client.update_page(
-                    page = page
-                )
-                assert result.display_name == _display_name
-                print(f"Updated page: {_display_name}")
-            time.sleep(1)
-        
-        router_page = cx.Page()
-        router_page.display_name = "router"
-        if "router" not in self.current_pages:
-            result = self.pages_client.create_page(
-                page = router_page,
-                parent = self.flow_name
-            )
-            assert result.display_name == router_page.display_name   
-            time.sleep(1)        
+        return self.admin.inject_pages()
 
     def patch_router_page(self):
-        router_page = self.current_pages.get('router')
-        time.sleep(1)
-        print(router_page)
-        plugin_count = len(self.plugins)
-        router_ranges = [(
-            round(n /plugin_count, ndigits=2),
-            round((n+1) /plugin_count, ndigits=2)
-        ) for n in range(plugin_count)]        
-        conditions = [(
-            f"$session.params.which-challenge > {lower} "
-            f"AND $session.params.which-challenge <= {upper}"
-        ) for lower, upper in router_ranges]
-        generate_pages = [
-            page
-            for display_name, page in self.current_pages.items()
-            if display_name.startswith("generate")
-        ]
-        transition_routes = [
-            {
-                "condition": condition,
-                "target_page": page.name,
-                "trigger_fulfillment": {}  
-            } for condition, page in zip(conditions, generate_pages)
-        ]
-        router_page.transition_routes = transition_routes
-        result = self.pages_client.update_page(
-            page = router_page
-        )
-    
+        return self.admin.patch_router_page()
+
     def patch_start_flow(self):
-        start_flow = self.flows_client.get_flow(
-            name = self.flow_name
-        )
-        transition_route = start_flow.transition_routes[0]
-        trigger_fulfillment = transition_route.trigger_fulfillment
-        spas = trigger_fulfillment.set_parameter_actions
-        spa_which_challenge = {
-            "parameter": "which-challenge",
-            "value": {
-                "string_value":"$sys.func.RAND()"
-            }
-        }
-        if not spas:
-            spas.append(spa_which_challenge)
-        else:
-            spa_names = [
-                spa.parameter 
-                for spa in spas
-            ]
-            if "which-challenge" not in spa_names:
-                spas.append(spa_which_challenge)
-        
-        router_page = self.current_pages.get('router')
-        start_flow.transition_routes[0].target_page = router_page.name
-        result = self.flows_client.update_flow(
-            flow=start_flow
-        )
-        assert "which-challenge" in [
-            spa.parameter for 
-            spa in result.transition_routes[0].trigger_fulfillment.set_parameter_actions
-        ]
+        return self.admin.patch_start_flow()
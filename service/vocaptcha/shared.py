@@ -0,0 +1,326 @@
+import os
+import json
+import mmap
+import fcntl
+import struct
+import hashlib
+import time
+from threading import Thread, Event, Lock
+from typing import Callable, Dict, Optional
+
+from service.vocaptcha.backends import CacheBackend, document_hash
+from service.vocaptcha.cache import TEXT, shard_ids
+from service.vocaptcha.corpus import BufferShard
+from service.vocaptcha.logs import logger
+
+MAGIC = b'VOCSNAP2'
+# magic, snapshot version, length of the JSON index that follows, and a
+# checksum of everything after the header.
+HEADER = struct.Struct('<8sQQ16s')
+
+
+def align(position: int, to: int = 8) -> int:
+    return (position + to - 1) // to * to
+
+
+def checksum():
+    return hashlib.blake2b(digest_size=16)
+
+
+def write_snapshot(
+    path: str,
+    version: int,
+    documents: Dict[str, dict],
+    hashes: Dict[str, str] = None,
+    stale_since: Optional[float] = None
+):
+    """
+    Writes every document to path as one file: a header, a JSON index of
+    the documents and their hashes, then the text of each shard document
+    as a UTF-8 buffer followed by its 32-bit entry offsets (native byte
+    order - the snapshot is meant for the host or image that wrote it).
+    The file is written aside and renamed into place, so readers only
+    ever map a complete snapshot.
+
+    hashes caches document hashes between calls; entries for documents
+    that changed must be dropped by the caller.  stale_since is recorded
+    for readers when the documents themselves came from an older snapshot
+    (see vocaptcha.warm).
+    """
+    hashes = {} if hashes is None else hashes
+    shards = set()
+    for document in documents.values():
+        shards |= shard_ids(document)
+    index = {
+        "version": version,
+        "created": time.time(),
+        "stale_since": stale_since,
+        "documents": {},
+        "hashes": {},
+        "blobs": {},
+    }
+    blobs = []
+    position = 0
+    for doc_id, document in documents.items():
+        if doc_id not in hashes:
+            hashes[doc_id] = document_hash(document)
+        index["hashes"][doc_id] = hashes[doc_id]
+        text = document.get(TEXT) if doc_id in shards else None
+        if isinstance(text, str):
+            shard = BufferShard.encode(text)
+        elif isinstance(text, BufferShard):
+            # Already mapped from an earlier snapshot; copy it as it is.
+            shard = text
+        else:
+            index["documents"][doc_id] = document
+            continue
+        index["documents"][doc_id] = {key: value for key, value in document.items() if key != TEXT}
+        offsets = shard.offsets.tobytes()
+        offsets_at = align(position + len(shard.buffer), 4)
+        index["blobs"][doc_id] = [position, len(shard.buffer), offsets_at, len(shard.offsets)]
+        blobs.append((position, shard.buffer))
+        blobs.append((offsets_at, offsets))
+        position = align(offsets_at + len(offsets))
+    encoded = json.dumps(index, ensure_ascii=False, default=str).encode('utf-8')
+    region = align(HEADER.size + len(encoded))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    digest = checksum()
+    with open(temporary, 'wb') as dest:
+        def write(data):
+            dest.write(data)
+            digest.update(data)
+
+        dest.write(HEADER.pack(MAGIC, version, len(encoded), bytes(digest.digest_size)))
+        write(encoded)
+        for offset, data in blobs:
+            write(bytes(region + offset - dest.tell()))
+            write(data)
+        dest.seek(0)
+        dest.write(HEADER.pack(MAGIC, version, len(encoded), digest.digest()))
+        dest.flush()
+        os.fsync(dest.fileno())
+    os.replace(temporary, path)
+
+
+def identity(path: str):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class MappedSnapshot:
+
+    """
+    A snapshot file mapped read-only.  Shard documents come back with their
+    text as a BufferShard over the mapping, so every worker on the host
+    shares the same pages instead of holding its own copy of the corpora.
+    The mapping stays alive for as long as anything references one of its
+    shards.
+
+    With verify, the checksum is checked first (ValueError if it doesn't
+    match), for snapshots that may have been truncated or copied around.
+    """
+
+    def __init__(self, path: str, verify: bool = False):
+        with open(path, 'rb') as src:
+            self.identity = os.fstat(src.fileno())
+            self.map = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.map)
+        magic, self.version, length, expected = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f"{path} isn't a vocaptcha snapshot")
+        if verify:
+            digest = checksum()
+            digest.update(view[HEADER.size:])
+            if digest.digest() != expected:
+                raise ValueError(f"{path} is corrupt (checksum mismatch)")
+        index = json.loads(str(view[HEADER.size:HEADER.size + length], 'utf-8'))
+        region = align(HEADER.size + length)
+        self.created: float = index["created"]
+        self.stale_since: Optional[float] = index["stale_since"]
+        self.hashes: Dict[str, str] = index["hashes"]
+        self.documents: Dict[str, dict] = index["documents"]
+        self.mapped = set(index["blobs"])
+        for doc_id, (start, size, offsets_at, count) in index["blobs"].items():
+            start += region
+            offsets_at += region
+            text = BufferShard(
+                view[start:start + size],
+                view[offsets_at:offsets_at + 4 * count].cast('I')
+            )
+            self.documents[doc_id] = dict(self.documents[doc_id], **{TEXT: text})
+
+
+class SharedBackend(CacheBackend):
+
+    """
+    Shares one source backend between every worker process on a host.
+
+    Whichever worker takes the lock file (<path>.lock) first becomes the
+    publisher: it runs the real source backend (e.g. the Firestore
+    listener) and writes each change out as a new versioned snapshot file
+    at path.  Every worker, the publisher included, maps the file
+    read-only and polls it every `interval` seconds, delivering only the
+    documents whose hashes changed to its ResponseCache.  That's one
+    listener and one copy of the corpora per host instead of per worker.
+
+    The lock is released when the publisher exits, and the other workers
+    try to take it over every `takeover` seconds.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        source: Callable[[], CacheBackend],
+        interval: float = 0.5,
+        takeover: float = 5.0
+    ):
+        super().__init__()
+        self.path = path
+        self.source_factory = source
+        self.interval = interval
+        self.takeover = takeover
+        self.source: Optional[CacheBackend] = None
+        self.leader = False
+        self.lock_fd = None
+        self.documents: Dict[str, dict] = {}
+        self.digests: Dict[str, str] = {}
+        self.version = 0
+        self.hashes: Dict[str, str] = {}
+        self.snapshot: Optional[MappedSnapshot] = None
+        self.seen = None
+        self.delivered = False
+        self.write_lock = Lock()
+        self.read_lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+        self.elected = 0.0
+
+    def elect(self) -> bool:
+        """
+        Tries to become the publisher.  Returns whether this process is it.
+        """
+        if self.leader:
+            return True
+        self.elected = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self.lock_fd = fd
+        self.leader = True
+        if identity(self.path) is not None:
+            # Carry on from the previous publisher's version.
+            try:
+                self.version = MappedSnapshot(self.path).version
+            except (ValueError, struct.error) as e:
+                logger.log("snapshot_replaced", severity="WARNING", path=self.path, error=repr(e))
+        self.source = self.source_factory()
+        self.source.watch(self.publish_changes)
+        return True
+
+    def publish_changes(self, changes: Dict[str, Optional[dict]]):
+        """
+        The source backend's callback: folds the changes into the full
+        document set and writes the next snapshot.
+        """
+        with self.write_lock:
+            for doc_id, document in changes.items():
+                self.digests.pop(doc_id, None)
+                if document is None:
+                    self.documents.pop(doc_id, None)
+                else:
+                    self.documents[doc_id] = document
+            self.version += 1
+            try:
+                write_snapshot(
+                    self.path,
+                    self.version,
+                    self.documents,
+                    self.digests,
+                    stale_since=self.source.stale_since if self.source else None
+                )
+            except OSError as e:
+                # The workers keep serving the last snapshot; the next
+                # change writes a complete one again.
+                logger.log("snapshot_write_failed", severity="ERROR", path=self.path, error=repr(e))
+                return
+        self.refresh()
+
+    def refresh(self):
+        """
+        Maps the snapshot file if it changed and delivers what's different:
+        documents whose hash changed or that disappeared.  Unchanged shard
+        documents keep pointing at the mapping they were delivered from,
+        which stays alive as long as they do, so an unrelated edit doesn't
+        re-materialize every sharded plugin.
+        """
+        with self.read_lock:
+            current = identity(self.path)
+            if current is None or current == self.seen:
+                return
+            try:
+                snapshot = MappedSnapshot(self.path)
+            except (OSError, ValueError, struct.error) as e:
+                logger.log("snapshot_skipped", severity="WARNING", path=self.path, error=repr(e))
+                return
+            self.seen = current
+            changes = {
+                doc_id: snapshot.documents[doc_id]
+                for doc_id, digest in snapshot.hashes.items()
+                if self.hashes.get(doc_id) != digest
+            }
+            for doc_id in self.hashes:
+                if doc_id not in snapshot.hashes:
+                    changes[doc_id] = None
+            self.hashes = snapshot.hashes
+            self.snapshot = snapshot
+            first = not self.delivered
+            self.delivered = True
+        if first and self.callback:
+            self.callback(changes)
+        else:
+            self.publish(changes)
+
+    @property
+    def stale_since(self) -> Optional[float]:
+        # Followers only know what the publisher recorded in the snapshot.
+        if self.leader and self.source is not None:
+            return self.source.stale_since
+        return self.snapshot.stale_since if self.snapshot else None
+
+    def poll(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                if not self.leader and time.monotonic() - self.elected >= self.takeover:
+                    self.elect()
+                self.refresh()
+            except Exception as e:
+                logger.log("snapshot_poll_failed", severity="ERROR", path=self.path, error=repr(e))
+
+    def watch(self, callback):
+        self.callback = callback
+        self.elect()
+        self.refresh()
+        if self.interval:
+            self.thread = Thread(target=self.poll, name="shared-snapshot", daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.stopped.set()
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+        if self.lock_fd is not None:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+            os.close(self.lock_fd)
+            self.lock_fd = None
+        self.leader = False
+        super().close()
@@ -0,0 +1,147 @@
+from string import Formatter
+from types import MappingProxyType
+from typing import Dict, Iterable, Mapping, Optional
+from xml.etree import ElementTree
+
+
+SSML = 'ssml'
+SPEAK_OPEN = '<speak>'
+SPEAK_CLOSE = '</speak>'
+
+CONVERSIONS = {
+    'r': repr,
+    's': str,
+    'a': ascii
+}
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class Field:
+
+    """
+    A single {placeholder} within a Template.
+    """
+
+    __slots__ = ('name', 'conversion', 'spec')
+
+    def __init__(self, name, conversion=None, spec=''):
+        self.name = name
+        self.conversion = CONVERSIONS[conversion] if conversion else None
+        self.spec = spec
+
+    def __call__(self, values):
+        value = values[self.name]
+        if self.conversion:
+            value = self.conversion(value)
+        if self.spec:
+            return format(value, self.spec)
+        return value if value.__class__ is str else str(value)
+
+
+class Template:
+
+    """
+    A response template compiled once, when the cache delivers it.  The
+    source string is split into literal fragments and fields up-front so
+    rendering is a single join rather than a str.format parse per request.
+
+    `format` is kept as an alias of `render`, so plugins written against
+    the raw template strings keep working.
+    """
+
+    __slots__ = ('source', 'fields', 'parts')
+
+    def __init__(self, source: str):
+        parts = []
+        fields = []
+        try:
+            parsed = list(Formatter().parse(source))
+        except ValueError as e:
+            raise TemplateError(f"Can't parse template {source!r}: {e}")
+        for literal, name, spec, conversion in parsed:
+            if literal:
+                parts.append(literal)
+            if name is None:
+                continue
+            if not name.isidentifier():
+                raise TemplateError(
+                    f"Template {source!r} uses {{{name}}}; only named placeholders are supported."
+                )
+            if spec and '{' in spec:
+                raise TemplateError(
+                    f"Template {source!r} uses a nested format spec, which isn't supported."
+                )
+            if conversion and conversion not in CONVERSIONS:
+                raise TemplateError(f"Template {source!r} uses an unknown conversion !{conversion}.")
+            parts.append(Field(name, conversion, spec))
+            fields.append(name)
+        self.source = source
+        self.fields = frozenset(fields)
+        self.parts = tuple(parts)
+
+    def render(self, **values):
+        return ''.join([
+            part if part.__class__ is str else part(values)
+            for part in self.parts
+        ])
+
+    format = render
+
+    def __str__(self):
+        return self.source
+
+    def __repr__(self):
+        return f"Template({self.source!r})"
+
+
+def check_ssml(template: Template):
+    """
+    Renders the template with dummy values and makes sure the result is
+    well-formed once it's wrapped in <speak> tags.
+    """
+    sample = template.render(**{name: 'x' for name in template.fields})
+    if not sample.startswith(SPEAK_OPEN):
+        sample = SPEAK_OPEN + sample
+    if not sample.endswith(SPEAK_CLOSE):
+        sample += SPEAK_CLOSE
+    try:
+        ElementTree.fromstring(sample)
+    except ElementTree.ParseError as e:
+        raise TemplateError(f"SSML template {template.source!r} isn't well-formed: {e}")
+
+
+def compile_templates(
+    templates: Mapping[str, Mapping[str, str]],
+    placeholders: Optional[Dict[str, Iterable[str]]] = None
+):
+    """
+    Compiles a plugin document's templates section, e.g.
+    {"generate": {"text": ..., "ssml": ...}, "verify": {...}}, into the same
+    shape with Template values.
+
+    placeholders maps an action ("generate", "verify") to the names the
+    plugin passes in when rendering; a template that uses anything else is
+    reported here instead of raising a KeyError on a live call.
+    """
+    compiled = {}
+    for action, variants in templates.items():
+        allowed = None
+        if placeholders and action in placeholders:
+            allowed = frozenset(placeholders[action])
+        compiled_variants = {}
+        for variant, source in variants.items():
+            template = Template(source)
+            if allowed is not None and not template.fields <= allowed:
+                missing = ', '.join(sorted(template.fields - allowed))
+                raise TemplateError(
+                    f"The {action}.{variant} template uses placeholders that "
+                    f"aren't provided: {missing}.  Available: {', '.join(sorted(allowed))}."
+                )
+            if variant == SSML:
+                check_ssml(template)
+            compiled_variants[variant] = template
+        compiled[action] = MappingProxyType(compiled_variants)
+    return MappingProxyType(compiled)
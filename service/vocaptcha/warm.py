@@ -0,0 +1,145 @@
+import struct
+from threading import Event, Lock
+from typing import Dict, Optional
+
+from service.vocaptcha.backends import CacheBackend, document_hash
+from service.vocaptcha.logs import logger
+from service.vocaptcha.shared import MappedSnapshot, identity, write_snapshot
+
+
+class WarmBackend(CacheBackend):
+
+    """
+    Serves the last snapshot saved to disk while the live source catches
+    up (stale-while-revalidate).
+
+    On `watch`, the snapshot at path is checked against its checksum and
+    delivered straight away, so the ResponseCache is ready without waiting
+    on the source - on Cloud Run, a cold start no longer waits on a
+    Firestore round-trip.  The source is watched at the same time.  Its
+    first delivery (always the full document set) is compared with the
+    snapshot by document hash: only what differs is passed on, documents
+    the source no longer has are removed, and the backend stops being
+    stale.  From then on changes pass straight through, and the snapshot
+    is rewritten after each one.
+
+    The snapshot can be left on local disk by a previous run or baked
+    into the image with `python -m service.staging snapshot`.  A missing
+    or corrupt one is ignored and the source is waited on as usual.
+    """
+
+    def __init__(self, path: str, source: CacheBackend):
+        super().__init__()
+        self.path = path
+        self.source = source
+        self.documents: Dict[str, dict] = {}
+        self.hashes: Dict[str, str] = {}
+        self.version = 0
+        self.live = False
+        self.lock = Lock()
+
+    def load(self) -> Optional[MappedSnapshot]:
+        if identity(self.path) is None:
+            return None
+        try:
+            return MappedSnapshot(self.path, verify=True)
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            logger.log("warm_snapshot_ignored", severity="WARNING", path=self.path, error=repr(e))
+            return None
+
+    def watch(self, callback):
+        self.callback = callback
+        snapshot = self.load()
+        if snapshot is not None:
+            self.version = snapshot.version
+            self.hashes = dict(snapshot.hashes)
+            self.stale_since = snapshot.stale_since or snapshot.created
+            logger.log("warm_snapshot_served", severity="INFO", path=self.path, version=snapshot.version)
+            callback(dict(snapshot.documents))
+        self.source.watch(self.revalidate)
+
+    def revalidate(self, changes: Dict[str, Optional[dict]]):
+        """
+        The source's callback.
+        """
+        with self.lock:
+            if self.live:
+                for doc_id, document in changes.items():
+                    self.hashes.pop(doc_id, None)
+                    if document is None:
+                        self.documents.pop(doc_id, None)
+                    else:
+                        self.documents[doc_id] = document
+                self.publish(changes)
+            else:
+                changes = self.reconcile(changes)
+                self.live = True
+                self.stale_since = None
+                # Called even with nothing to change, so whoever is
+                # watching learns the documents are live.
+                if self.callback:
+                    self.callback(changes)
+            if changes or self.version == 0:
+                self.save()
+
+    def reconcile(self, documents: Dict[str, Optional[dict]]) -> Dict[str, Optional[dict]]:
+        """
+        The changes that turn the warm snapshot into the source's first
+        delivery.
+        """
+        self.documents = {
+            doc_id: document
+            for doc_id, document in documents.items()
+            if document is not None
+        }
+        warm, self.hashes = self.hashes, {
+            doc_id: document_hash(document)
+            for doc_id, document in self.documents.items()
+        }
+        changes = {
+            doc_id: document
+            for doc_id, document in self.documents.items()
+            if warm.get(doc_id) != self.hashes[doc_id]
+        }
+        for doc_id in warm:
+            if doc_id not in self.documents:
+                changes[doc_id] = None
+        return changes
+
+    def save(self):
+        try:
+            write_snapshot(self.path, self.version + 1, self.documents, self.hashes)
+        except OSError as e:
+            # A read-only image layer, say; keep serving regardless.
+            logger.log("warm_snapshot_save_failed", severity="WARNING", path=self.path, error=repr(e))
+            return
+        self.version += 1
+
+    def close(self):
+        self.source.close()
+        super().close()
+
+
+def capture(backend: CacheBackend, timeout: Optional[float] = None) -> Dict[str, dict]:
+    """
+    Watches backend for its first delivery and returns it.
+    """
+    delivered = Event()
+    documents = {}
+
+    def callback(changes):
+        if not delivered.is_set():
+            documents.update(
+                (doc_id, document)
+                for doc_id, document in changes.items()
+                if document is not None
+            )
+            delivered.set()
+
+    backend.watch(callback)
+    try:
+        if not delivered.wait(timeout):
+            raise TimeoutError(f"No documents were delivered within {timeout} seconds.")
+    finally:
+        backend.close()
+    return documents
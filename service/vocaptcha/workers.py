@@ -0,0 +1,71 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional
+
+from service.vocaptcha.metrics import metrics
+
+INLINE = 'inline'
+THREAD = 'thread'
+PROCESS = 'process'
+
+# Characters of input below which work runs inline: a typical
+# challenge/response pair scores in microseconds, less than a hand-off
+# to a pool costs.
+CUTOFF = 1024
+
+
+class WorkerPool:
+
+    """
+    Where plugins run CPU-bound work (e.g. verification scoring) so it
+    doesn't hold up the event loop, and every other request with it.
+
+    kind is INLINE (run everything on the loop, as before), THREAD or
+    PROCESS, with up to `workers` of them.  Threads are cheap but only
+    help where the work releases the GIL, as rapidfuzz's batch scorers
+    do.  Processes always help, but the function and its arguments are
+    pickled (see matchers.Matcher.__reduce__) and the workers are spawned,
+    not forked, since the Firestore listener's threads don't survive a
+    fork.  Either way, work whose `size` is under `cutoff` stays inline.
+
+    `queued` is how many offloaded calls have been submitted and haven't
+    finished yet.
+    """
+
+    def __init__(self, kind: str = THREAD, workers: Optional[int] = None, cutoff: int = CUTOFF):
+        self.kind = kind
+        self.workers = workers
+        self.cutoff = cutoff
+        self.queued = 0
+        self.executor: Optional[Executor] = None
+
+    def start(self) -> Optional[Executor]:
+        if self.executor is None:
+            if self.kind == THREAD:
+                self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="worker-pool")
+            elif self.kind == PROCESS:
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            elif self.kind != INLINE:
+                raise KeyError(f"Unknown worker pool kind: {self.kind}")
+        return self.executor
+
+    async def run(self, function: Callable, *args, size: int = 0):
+        if size < self.cutoff or self.kind == INLINE:
+            return function(*args)
+        executor = self.start()
+        self.queued += 1
+        metrics.inc('worker_pool_calls_total', (('kind', self.kind),))
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, partial(function, *args))
+        finally:
+            self.queued -= 1
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+INLINE_POOL = WorkerPool(INLINE)
@@ -0,0 +1,31 @@
+import pytest
+
+from service.vocaptcha.backends import MemoryBackend
+from service.vocaptcha.registry import PluginSpec
+from service.vocaptcha.server import VoCaptchaServer, VoCaptchaManager
+
+
+@pytest.fixture(scope="session")
+def config():
+    return VoCaptchaManager(path="service/vocaptcha.yaml", backend="memory").config
+
+
+@pytest.fixture
+def make_server(config):
+    """
+    Builds a VoCaptchaServer for the configured plugins over their local
+    documents; keyword arguments go to VoCaptchaServer.
+    """
+    classes = [PluginSpec(f"service.plugins.{plugin.module}", plugin.cls).load() for plugin in config.plugins]
+
+    def make(**kwargs):
+        kwargs.setdefault("plugins", config.plugins)
+        return VoCaptchaServer(
+            plugin_folder=config.pluginFolder,
+            agent_name=config.agentName,
+            flow_name=config.flowName,
+            backend=MemoryBackend.from_plugins(classes),
+            **kwargs
+        )
+
+    return make
@@ -0,0 +1,79 @@
+import asyncio
+
+from starlette.testclient import TestClient
+
+from service.vocaptcha.admission import Admission, FULL, LATE
+
+
+def test_waiters_get_freed_slots_in_order():
+    async def scenario():
+        admission = Admission(limit=2, plugin_limit=1)
+        assert await admission.acquire("a")
+        assert await admission.acquire("b")
+        second_a = asyncio.create_task(admission.acquire("a"))
+        await asyncio.sleep(0)
+        assert len(admission.waiters) == 1
+        admission.release("b", admission.clock())
+        await asyncio.sleep(0)
+        # A free global slot doesn't help a plugin at its own limit.
+        assert not second_a.done()
+        admission.release("a", admission.clock())
+        assert await second_a
+        assert admission.plugin_inflight["a"] == 1 and admission.inflight == 1
+
+    asyncio.run(scenario())
+
+
+def test_sheds_what_would_miss_the_deadline():
+    async def scenario():
+        admission = Admission(limit=1, deadline=0.05, queue=1)
+        assert await admission.acquire("a")
+        waiting = asyncio.create_task(admission.acquire("a"))
+        await asyncio.sleep(0)
+        # The queue is full.
+        assert not await admission.acquire("a")
+        assert not await waiting
+        assert not admission.waiters
+        # Arrived too long ago to be served in time.
+        assert not await admission.acquire("a", arrived=admission.clock() - 1)
+        assert admission.shed == {("a", FULL): 1, ("a", LATE): 2}
+
+    asyncio.run(scenario())
+
+
+def test_shed_requests_get_the_fallback(make_server):
+    server = make_server(admission=Admission(limit=0, deadline=0))
+    with TestClient(server()) as client:
+        response = client.post("/sentences/generate", json={})
+        assert response.status_code == 200
+        assert response.json()["sessionInfo"]["parameters"] == {"vocaptcha-overloaded": True}
+        response = client.post("/sentences/verify-batch", json=[])
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+
+
+def test_batches_dont_inflate_the_service_estimate():
+    now = [0.0]
+    admission = Admission(limit=1, deadline=1, clock=lambda: now[0])
+
+    async def scenario():
+        assert await admission.acquire("a", action="verify-batch")
+        now[0] += 5
+        admission.release("a", 0.0, "verify-batch")
+        assert await admission.acquire("a", action="verify")
+        # Waiting behind the verify above is still worth it.
+        waiting = asyncio.create_task(admission.acquire("a", action="verify"))
+        await asyncio.sleep(0)
+        admission.release("a", now[0], "verify")
+        assert await waiting
+
+    asyncio.run(scenario())
+    assert admission.service == {("a", "verify-batch"): 5, ("a", "verify"): 0}
+
+
+def test_mixed_batches_are_admitted(make_server):
+    server = make_server(admission=Admission(limit=0, deadline=0))
+    with TestClient(server()) as client:
+        response = client.post("/verify-batch", json=[])
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
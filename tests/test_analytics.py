@@ -0,0 +1,57 @@
+import json
+import sqlite3
+
+import pytest
+from starlette.testclient import TestClient
+
+from service.vocaptcha.analytics import CallerAnalytics, CountMinSketch, HeavyHitters, JSONLSink, SQLiteSink
+
+
+def test_sketches_never_undercount_and_keep_the_heaviest():
+    sketch = CountMinSketch(width=64, depth=4)
+    hitters = HeavyHitters(k=3, width=64, depth=4)
+    counts = {f"+1555{n:07}": n % 7 + 1 for n in range(500)}
+    counts["+15550000000"] = 1000
+    counts["+15559999999"] = 800
+    for key, count in counts.items():
+        sketch.add(key, count)
+        hitters.add(key, count)
+    assert all(sketch.estimate(key) >= count for key, count in counts.items())
+    top = [key for key, _ in hitters.most_common()]
+    assert top[:2] == ["+15550000000", "+15559999999"]
+
+
+def test_flush_writes_one_batch_per_window(tmp_path):
+    path = tmp_path / "analytics.jsonl"
+    analytics = CallerAnalytics(JSONLSink(str(path)), top=2, maxsize=4)
+    for passed in (True, False, False, False, False):
+        analytics.record("+15551234567", "sentences", passed, 100 if passed else 20)
+    assert analytics.dropped == 1
+    analytics.flush()
+    analytics.flush()
+    analytics.sink.close()
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record["kind"] for record in records] == ["plugin", "caller"]
+    assert records[0]["passed"] == 1 and records[0]["failed"] == 3
+    assert records[0]["scores"]["20"] == 3
+    assert records[1]["caller"] == "+15551234567"
+    assert records[1]["calls"] == 4 and records[1]["failures"] == 3
+
+
+def test_verify_outcomes_reach_the_sink(tmp_path, make_server):
+    path = str(tmp_path / "analytics.db")
+    server = make_server(analytics=CallerAnalytics(SQLiteSink(path), interval=3600))
+    with open("tests/cases/verify_sentences_loose.json") as src:
+        payload = json.load(src)
+    payload["payload"] = {"telephony": {"caller_id": "+15551234567"}}
+    with TestClient(server()) as client:
+        client.post("/sentences/verify", json=payload)
+        payload["sessionInfo"]["parameters"]["challenge-response"] = "pack my box"
+        client.post("/sentences/verify", json=payload)
+    # Shutting down flushed what was left and closed the sink.
+    rows = sqlite3.connect(path).execute(
+        "SELECT kind, plugin, caller FROM caller_analytics ORDER BY kind"
+    ).fetchall()
+    assert rows == [("caller", None, "+15551234567"), ("plugin", "sentence-repetition", None)]
+    with pytest.raises(sqlite3.ProgrammingError):
+        server.analytics.sink.connection.execute("SELECT 1")
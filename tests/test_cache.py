@@ -0,0 +1,161 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from service.vocaptcha.cache import ResponseCache
+from service.vocaptcha.backends import (
+    CacheBackend, FileBackend, FirestoreBackend, MemoryBackend
+)
+
+
+class SilentBackend(CacheBackend):
+
+    def watch(self, callback):
+        self.callback = callback
+
+
+def test_memory_backend_set_and_delete():
+    backend = MemoryBackend({"doc": {"challenges": [1]}})
+    cache = ResponseCache()
+    cache.watch(backend, timeout=1)
+    assert cache.get("doc") == {"challenges": (1,)}
+
+    backend.set("doc", {"challenges": [2]})
+    assert cache.get("doc") == {"challenges": (2,)}
+
+    backend.delete("doc")
+    with pytest.raises(KeyError):
+        cache.get("doc")
+
+
+def test_watch_times_out():
+    cache = ResponseCache()
+    with pytest.raises(TimeoutError):
+        cache.watch(SilentBackend(), timeout=0.01)
+
+
+def test_file_backend_picks_up_changes(tmp_path):
+    path = tmp_path / "doc.json"
+    path.write_text(json.dumps({"challenges": ["a"]}))
+    backend = FileBackend({"doc": str(path)}, interval=0.01)
+    cache = ResponseCache()
+    cache.watch(backend, timeout=1)
+    assert cache.get("doc") == {"challenges": ("a",)}
+
+    path.write_text(json.dumps({"challenges": ["a", "b"]}))
+    deadline = time.monotonic() + 2
+    while cache.get("doc") != {"challenges": ("a", "b")}:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    path.unlink()
+    deadline = time.monotonic() + 2
+    while "doc" in cache.cache:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    cache.close()
+
+
+def test_snapshots_are_versioned_and_immutable():
+    backend = MemoryBackend({"doc": {"challenges": ["a"]}})
+    cache = ResponseCache()
+    cache.watch(backend, timeout=1)
+    first = cache.snapshot
+
+    backend.set("doc", {"challenges": ["b"]})
+    assert cache.version == first.version + 1
+    assert first.documents["doc"]["challenges"] == ("a",)
+    with pytest.raises(TypeError):
+        cache.get("doc")["challenges"] = ()
+
+
+def test_register_materializes_once_per_change():
+    backend = MemoryBackend({"doc": {"challenges": ["a"]}, "other": {"x": 1}})
+    cache = ResponseCache()
+    cache.watch(backend, timeout=1)
+    calls = []
+
+    def hook(document):
+        calls.append(document)
+        return len(document["challenges"])
+
+    cache.register("doc", hook, key="doc-len")
+    assert cache.derived("doc-len") == 1
+
+    backend.set("other", {"x": 2})
+    backend.set("doc", {"challenges": ["a", "b"]})
+    assert cache.derived("doc-len") == 2
+    assert len(calls) == 2
+
+
+def test_failed_materialization_keeps_previous_document():
+    backend = MemoryBackend({"doc": {"challenges": ["a"]}})
+    cache = ResponseCache()
+    cache.register("doc", lambda document: document["challenges"][0], key="first")
+    cache.watch(backend, timeout=1)
+
+    backend.set("doc", {"challenges": []})
+    assert cache.get("doc") == {"challenges": ("a",)}
+    assert cache.derived("first") == "a"
+
+
+def change(kind, doc_id, data=None):
+    document = SimpleNamespace(id=doc_id, to_dict=lambda: data)
+    return SimpleNamespace(type=SimpleNamespace(name=kind), document=document)
+
+
+def test_firestore_backend_applies_only_changes():
+    backend = FirestoreBackend(query=None)
+    cache = ResponseCache()
+    backend.callback = cache.callback
+
+    backend.on_snapshot([], [
+        change("ADDED", "a", {"x": 1}),
+        change("ADDED", "b", {"x": 2}),
+    ], None)
+    assert cache.document_version("a") == cache.document_version("b") == 1
+    b = cache.get("b")
+
+    backend.on_snapshot([], [change("MODIFIED", "a", {"x": 3})], None)
+    assert cache.get("a") == {"x": 3}
+    assert cache.document_version("a") == 2
+    assert cache.document_version("b") == 1
+    assert cache.get("b") is b
+
+    backend.on_snapshot([], [change("REMOVED", "b")], None)
+    assert "b" not in cache.cache
+    assert cache.document_version("b") is None
+
+
+def test_sharded_documents_resolve_to_a_corpus():
+    backend = MemoryBackend({
+        "doc": {"shards": {"challenges": ["doc-a", "doc-b"]}},
+        "doc-a": {"text": "one\ntwo"},
+        "doc-b": {"text": "three"},
+    })
+    cache = ResponseCache()
+    seen = []
+    cache.register("doc", lambda document: seen.append(list(document["challenges"])) or len(seen), key="k")
+    cache.watch(backend, timeout=1)
+    assert seen == [["one", "two", "three"]]
+
+    version = cache.document_version("doc")
+    backend.set("doc-b", {"text": "four"})
+    assert seen[-1] == ["one", "two", "four"]
+    assert cache.document_version("doc") > version
+
+
+def test_sharded_document_waits_for_its_shards():
+    backend = MemoryBackend({"doc": {"shards": {"challenges": ["doc-a"]}}})
+    cache = ResponseCache()
+    seen = []
+    cache.register("doc", lambda document: seen.append(list(document["challenges"])), key="k")
+    cache.watch(backend, timeout=1)
+    assert seen == [] and "doc" in cache.pending
+
+    backend.set("doc-a", {"text": "late"})
+    assert seen == [["late"]]
+    assert not cache.pending
+    assert "doc" in cache.cache
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from service.vocaptcha.corpus import BufferShard, Corpus, dedupe, read_entries, shard, shard_id
+
+
+def test_corpus_random_access():
+    corpus = Corpus(["alpha\nbeta", "gamma", "", "delta\nepsilon\nzeta"])
+    entries = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta"]
+    assert len(corpus) == len(entries)
+    assert [corpus[n] for n in range(len(corpus))] == entries
+    assert list(corpus) == entries
+    assert corpus[-1] == "zeta"
+    assert corpus[1:3] == ["beta", "gamma"]
+    assert "gamma" in corpus
+    with pytest.raises(IndexError):
+        corpus[len(entries)]
+
+
+def test_from_strings_shards_by_size():
+    entries = [f"sentence number {n}" for n in range(100)]
+    texts = list(shard(entries, shard_bytes=200))
+    assert len(texts) > 1
+    assert all(len(text.encode("utf-8")) <= 200 for text in texts)
+    assert list(Corpus.from_strings(entries, shard_bytes=200)) == entries
+    with pytest.raises(ValueError):
+        list(shard(["two\nlines"]))
+
+
+def test_dedupe_cleans_and_ignores_case():
+    assert list(dedupe(["Hello  world", "hello world\n", "", "  ", "Other"])) == ["Hello world", "Other"]
+
+
+def test_shard_id_is_content_addressed():
+    assert shard_id("doc", "a\nb") == shard_id("doc", "a\nb")
+    assert shard_id("doc", "a\nb") != shard_id("doc", "a\nc")
+
+
+def test_read_entries(tmp_path):
+    csv_path = tmp_path / "corpus.csv"
+    csv_path.write_text('text,source\n"one, with a comma",x\ntwo,y\n')
+    assert list(read_entries(str(csv_path), column="text")) == ["one, with a comma", "two"]
+    jsonl_path = tmp_path / "corpus.jsonl"
+    jsonl_path.write_text("\n".join(json.dumps(record) for record in [{"text": "one"}, "two"]) + "\n")
+    assert list(read_entries(str(jsonl_path))) == ["one", "two"]
+
+
+def test_buffer_shards_match_text_shards():
+    texts = ["naïve café\nplain", "日本語\nlast"]
+    corpus = Corpus(BufferShard.encode(text) for text in texts)
+    assert list(corpus) == list(Corpus(texts)) == ["naïve café", "plain", "日本語", "last"]
+    assert corpus[2] == "日本語"
@@ -0,0 +1,56 @@
+import glob
+import json
+
+import pytest
+from starlette.testclient import TestClient
+
+from cxwebhooks import WebhookRequest
+
+from service.plugins.sentences import SentencesPlugin
+from service.vocaptcha import decoding
+
+CASES = sorted(glob.glob("tests/cases/*.json"))
+
+
+@pytest.mark.parametrize("path", CASES)
+def test_fast_path_matches_full_validation(path):
+    with open(path, "rb") as src:
+        raw = src.read()
+    full = WebhookRequest(**json.loads(raw))
+    fast = decoding.decode(raw, fields=("sessionInfo",))
+    assert fast.sessionInfo == full.sessionInfo
+    assert fast.detectIntentResponseId == full.detectIntentResponseId
+    # Undeclared fields are validated lazily.
+    assert fast.pageInfo == full.pageInfo
+    assert isinstance(decoding.decode(raw), WebhookRequest)
+
+
+@pytest.mark.parametrize("raw", [
+    b"not json",
+    b"[]",
+    b'{"languageCode": "en"}',
+    b'{"detectIntentResponseId": "x", "languageCode": "en", "sessionInfo": {"parameters": {}}}',
+    b'{"detectIntentResponseId": "x", "languageCode": "en", "sessionInfo": []}',
+])
+@pytest.mark.parametrize("fields", [None, ("sessionInfo",)])
+def test_malformed_bodies(raw, fields):
+    assert decoding.decode(raw, fields) is None
+
+
+def test_missing_optional_field_defaults():
+    webhook = decoding.decode(b'{"detectIntentResponseId": "x", "languageCode": "en"}', ("sessionInfo",))
+    assert webhook.sessionInfo is None
+
+
+def test_lazily_invalid_fields_get_a_422(monkeypatch, make_server):
+    # Sentences reads sessionInfo; with nothing declared it's only
+    # validated (and found wanting) once verify touches it.
+    monkeypatch.setattr(SentencesPlugin, "FIELDS", ())
+    with open("tests/cases/verify_sentences_loose.json") as src:
+        payload = json.load(src)
+    payload["sessionInfo"] = []
+    with TestClient(make_server()()) as client:
+        assert client.post("/sentences/verify", json=payload).status_code == 422
+        batch = client.post("/sentences/verify-batch", json=[payload])
+        assert batch.status_code == 200
+        assert batch.json()[0]["status_code"] == "422 UNPROCESSABLE ENTITY"
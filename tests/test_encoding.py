@@ -0,0 +1,42 @@
+import pytest
+from starlette.responses import JSONResponse
+
+from cxwebhooks import WebhookResponse
+
+from service.vocaptcha import encoding
+
+
+def reference(text=None, ssml=None, params=None):
+    response = WebhookResponse()
+    if text is not None:
+        response.add_text_response(text)
+    if ssml is not None:
+        response.add_audio_text_response(ssml)
+    if params is not None:
+        response.add_session_params(params)
+    return JSONResponse(response.dict(exclude_none=True)).body
+
+
+@pytest.mark.parametrize("text, ssml, params", [
+    ("What is the sum of 1 and 2?", "What is the sum of 1 and 2?", {"challenge": 3, "challenge-type": "add-two-numbers"}),
+    ('Say "café" \\ now\n', '<speak>Say <prosody rate="slow">café</prosody></speak>', {"a": None, "b": 0.5, "c": True}),
+    ("Something went wrong.  Please reach out!", None, None),
+    ("", "", {}),
+])
+def test_encode_is_byte_compatible(text, ssml, params):
+    assert encoding.encode(text, ssml, params) == reference(text, ssml, params)
+
+
+def test_join_matches_json_list():
+    response = WebhookResponse()
+    response.add_text_response("hi")
+    items = [encoding.encode("a", "b", {"x": 1}), response, {"message": "nope"}]
+    expected = JSONResponse([
+        {"fulfillmentResponse": {"messages": [
+            {"text": {"text": ["a"]}},
+            {"outputAudioText": {"ssml": "<speak>b</speak>"}}
+        ]}, "sessionInfo": {"parameters": {"x": 1}}},
+        response.dict(exclude_none=True),
+        {"message": "nope"}
+    ]).body
+    assert encoding.join(items) == expected
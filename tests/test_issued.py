@@ -0,0 +1,85 @@
+import json
+
+from starlette.testclient import TestClient
+
+from service.vocaptcha.issued import IssuedChallenges, ENFORCE, ISSUED, MISMATCH, REPLAYED, UNKNOWN
+
+
+def test_checks_and_expiry():
+    now = [0.0]
+    issued = IssuedChallenges(ttl=3, max_entries=10, clock=lambda: now[0])
+    issued.record("a", "the rain in spain")
+    assert issued.check("a", "the rain in spain") == ISSUED
+    assert issued.check("a", "pack my box") == MISMATCH
+    assert issued.check("b", "the rain in spain") == UNKNOWN
+    assert issued.check(None, "the rain in spain") == UNKNOWN
+    issued.consume("a")
+    assert issued.check("a", "the rain in spain") == REPLAYED
+    now[0] = 2
+    # Recording again restarts the session's ttl.
+    issued.record("a", "pack my box")
+    assert issued.check("a", "pack my box") == ISSUED
+    now[0] = 4
+    assert issued.check("a", "pack my box") == ISSUED
+    now[0] = 5
+    assert issued.check("a", "pack my box") == UNKNOWN
+    assert len(issued) == 0
+
+
+def test_oldest_entries_are_evicted_past_max_entries():
+    now = [0.0]
+    issued = IssuedChallenges(ttl=10, max_entries=3, clock=lambda: now[0])
+    for session in "abcd":
+        issued.record(session, session)
+        now[0] += 1
+    assert len(issued) == 3
+    assert issued.evictions == 1
+    assert issued.check("a", "a") == UNKNOWN
+    assert issued.check("d", "d") == ISSUED
+
+
+def test_sessions_recorded_again_outlive_eviction():
+    now = [0.0]
+    issued = IssuedChallenges(ttl=10, max_entries=3, clock=lambda: now[0])
+    for session in "abacd":
+        issued.record(session, session)
+        now[0] += 1
+    assert issued.check("a", "a") == ISSUED
+    assert issued.check("b", "b") == UNKNOWN
+    assert issued.check("d", "d") == ISSUED
+    assert len(issued) == 3
+
+
+def test_enforced_challenges_must_be_issued_and_fresh(make_server):
+    server = make_server(issued=IssuedChallenges(mode=ENFORCE))
+    with open("tests/cases/verify_sentences_loose.json") as src:
+        payload = json.load(src)
+    with TestClient(server()) as client:
+        generated = client.post("/sentences/generate", json=payload).json()
+        challenge = generated["sessionInfo"]["parameters"]["challenge"]
+        parameters = payload["sessionInfo"]["parameters"]
+        parameters["challenge"] = parameters["challenge-response"] = "not " + challenge
+
+        # A challenge this session was never sent fails, however well it's answered.
+        forged = client.post("/sentences/verify", json=payload).json()["sessionInfo"]["parameters"]
+        assert forged["challenge-status"] == MISMATCH and not forged["challenge-passed"]
+
+        parameters.update({"challenge": challenge, "challenge-response": challenge})
+        passed = client.post("/sentences/verify", json=payload).json()["sessionInfo"]["parameters"]
+        assert passed["challenge-status"] == ISSUED and passed["challenge-passed"]
+
+        replayed = client.post("/sentences/verify", json=payload).json()["sessionInfo"]["parameters"]
+        assert replayed["challenge-status"] == REPLAYED and not replayed["challenge-passed"]
+
+
+def test_batches_are_not_checked_in_enforce_mode(make_server):
+    server = make_server(issued=IssuedChallenges(mode=ENFORCE))
+    with open("tests/cases/verify_sentences_loose.json") as src:
+        payload = json.load(src)
+    parameters = payload["sessionInfo"]["parameters"]
+    parameters["challenge-response"] = parameters["challenge"]
+    with TestClient(server()) as client:
+        for _ in range(2):
+            for route in ("/sentences/verify-batch", "/verify-batch"):
+                result = client.post(route, json=[payload]).json()[0]["sessionInfo"]["parameters"]
+                assert result["challenge-passed"] and "challenge-status" not in result
@@ -0,0 +1,24 @@
+import asyncio
+
+from benchmarks.load import benchmark, build_app, load_cases, percentile, schedule
+
+
+def test_percentile():
+    ordered = [float(n) for n in range(1, 101)]
+    assert percentile(ordered, 50) == 50.0
+    assert percentile(ordered, 99) == 99.0
+    assert percentile([], 50) == 0.0
+
+
+def test_schedule_mix():
+    traffic = load_cases("tests/cases/*.json")
+    requests = schedule(traffic, {"/sentences/verify": 1}, 50, seed=0)
+    assert {route for route, _ in requests} == {"/sentences/verify"}
+
+
+def test_benchmark_replays_cases():
+    traffic = load_cases("tests/cases/*.json")
+    results = asyncio.run(benchmark(build_app(), traffic, requests=60, concurrency=4, warmup=10))
+    assert results["total"]["requests"] == 60
+    assert results["total"]["errors"] == 0
+    assert "/sentences/verify" in results["routes"]
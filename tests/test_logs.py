@@ -0,0 +1,35 @@
+import io
+import json
+
+from service.vocaptcha.logs import StructuredLogger
+
+
+def test_records_are_written_as_json_lines():
+    stream = io.StringIO()
+    logger = StructuredLogger(stream=stream, batch=2)
+    for n in range(5):
+        logger.log("verify", plugin="sentences", ratio=n)
+    logger.close()
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [record["ratio"] for record in records] == list(range(5))
+    assert records[0]["event"] == "verify"
+    assert records[0]["plugin"] == "sentences"
+    assert logger.written == 5
+
+
+def test_sampling_per_plugin():
+    logger = StructuredLogger(stream=io.StringIO(), sample_rates={"noisy": 0.0})
+    logger.log("verify", plugin="noisy")
+    logger.log("verify", plugin="quiet")
+    assert logger.sampled == 1
+    assert len(logger.queue) == 1
+    logger.close()
+
+
+def test_overflow_drops_with_counter():
+    logger = StructuredLogger(stream=io.StringIO(), maxsize=2, interval=60)
+    for _ in range(5):
+        logger.log("verify")
+    assert len(logger.queue) == 2
+    assert logger.dropped == 3
+    logger.close()
@@ -6,7 +6,9 @@ from service.vocaptcha.server import VoCaptchaServer, VoCaptchaManager
 
 manager = VoCaptchaManager(
     # Have to patch-in the config.
-    path="service/vocaptcha.yaml"
+    path="service/vocaptcha.yaml",
+    # Serve the local plugin documents - no Firestore round-trip.
+    backend="memory"
 )
 
 config = manager.config
@@ -16,7 +18,8 @@ factory = VoCaptchaServer(
     collection=config.collection,
     plugin_folder=config.pluginFolder,
     agent_name=config.agentName,
-    flow_name=config.flowName
+    flow_name=config.flowName,
+    backend=config.backend
 )
 
 app = factory()
@@ -78,4 +81,78 @@ def test_verify_sentences_loose():
         payload = json.load(src)
     response = service.post("/sentences/verify", json=payload)
     assert response.status_code == 200
-    print(response.json()['sessionInfo']['parameters'])
\ No newline at end of file
+    print(response.json()['sessionInfo']['parameters'])
+
+
+def test_verify_batch_sentences():
+    payloads = []
+    for case in ("verify_sentences_strict", "verify_sentences_loose"):
+        with open(f"tests/cases/{case}.json") as src:
+            payloads.append(json.load(src))
+    response = service.post("/sentences/verify-batch", json=payloads + [{}])
+    assert response.status_code == 200
+    results = response.json()
+    assert len(results) == 3
+    for payload, result in zip(payloads, results):
+        single = service.post("/sentences/verify", json=payload).json()
+        assert result == single
+    assert results[2]['status_code'] == "422 UNPROCESSABLE ENTITY"
+
+
+def test_verify_batch_mixed():
+    payloads = []
+    for case in ("verify_nato_passphrase_strict", "verify_sentences_loose", "verify_nato_passphrase_loose"):
+        with open(f"tests/cases/{case}.json") as src:
+            payloads.append(json.load(src))
+    response = service.post("/verify-batch", json=payloads)
+    assert response.status_code == 200
+    results = response.json()
+    assert [
+        result['sessionInfo']['parameters']['challenge-response']
+        for result in results
+    ] == [
+        payload['sessionInfo']['parameters']['challenge-response']
+        for payload in payloads
+    ]
+    assert service.post("/verify-batch", json={}).status_code == 422
+
+
+def test_verify_memoizes_repeated_transcripts():
+    plugin = next(
+        instance for instance in factory.plugin_instances
+        if instance.TYPE == "sentence-repetition"
+    )
+    with open("tests/cases/verify_sentences_loose.json") as src:
+        payload = json.load(src)
+    first = service.post("/sentences/verify", json=payload).json()
+    hits = plugin.memo.hits
+    second = service.post("/sentences/verify", json=payload).json()
+    assert first == second
+    assert plugin.memo.hits == hits + 1
+
+
+def test_malformed_body_is_unprocessable():
+    response = service.post("/sentences/verify", data=b'{"languageCode": "en"}')
+    assert response.status_code == 422
+    response = service.post("/add-two-numbers/generate", data=b'not json')
+    assert response.status_code == 422
+
+
+def test_metrics():
+    with open("tests/cases/verify_sentences_loose.json") as src:
+        payload = json.load(src)
+    response = service.post("/sentences/verify", json=payload)
+    assert response.headers["Server-Timing"].startswith("app;dur=")
+    service.post("/sentences/verify", data=b"not json")
+    body = service.get("/metrics").text
+    assert 'vocaptcha_requests_total{plugin="sentences",action="verify",status="200"}' in body
+    assert 'vocaptcha_unprocessable_total{plugin="sentences",action="verify"}' in body
+    assert 'vocaptcha_request_duration_seconds_bucket{plugin="sentences",action="verify",le="+Inf"}' in body
+    assert 'vocaptcha_verify_total{plugin="sentence-repetition",result="pass"}' in body
+    assert "vocaptcha_cache_snapshot_version " in body
+
+
+def test_ready():
+    response = service.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["ready"] and not response.json()["stale"]
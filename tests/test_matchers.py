@@ -0,0 +1,72 @@
+import random
+
+import pytest
+from fuzzywuzzy import fuzz
+
+from service.vocaptcha.matchers import MATCHERS, get_matcher, normalize, soundex
+
+
+def random_pairs(n=2000, alphabet="abc de"):
+    rng = random.Random(1)
+    return [
+        (
+            "".join(rng.choices(alphabet, k=rng.randint(0, 30))),
+            "".join(rng.choices(alphabet, k=rng.randint(0, 30)))
+        )
+        for _ in range(n)
+    ] + [("abc", None)]
+
+
+def test_normalize():
+    assert normalize("It's  time, to PAY-taxes!") == "its time to pay taxes"
+
+
+@pytest.mark.parametrize("word, code", [
+    ("robert", "r163"), ("rupert", "r163"), ("ashcraft", "a261"), ("tymczak", "t522"), ("a", "a000")
+])
+def test_soundex(word, code):
+    assert soundex(word) == code
+
+
+def test_ratio_matcher_matches_fuzz_ratio():
+    pairs = random_pairs()
+    matcher = get_matcher("ratio")
+    assert matcher.score_batch(pairs) == [fuzz.ratio(*pair) for pair in pairs]
+
+
+def test_levenshtein_matcher_matches_fuzz_ratio_on_normalized_text():
+    pairs = random_pairs()
+    matcher = get_matcher("levenshtein")
+    expected = [
+        fuzz.ratio(normalize(c), normalize(r)) if r is not None else 0
+        for c, r in pairs
+    ]
+    assert matcher.score_batch(pairs) == expected
+    assert [matcher.score(*pair) for pair in pairs] == expected
+
+
+@pytest.mark.parametrize("name", sorted(MATCHERS))
+def test_scores_are_comparable(name):
+    matcher = get_matcher(name)
+    challenge = "The rain in Spain stays mainly in the plain"
+    assert matcher.score(challenge, challenge) == 100
+    assert matcher.score(challenge, None) == 0
+    close = matcher.score(challenge, "the rain in spain stays mainly in the plane")
+    far = matcher.score(challenge, "pack my box with five dozen liquor jugs")
+    assert 0 <= far < close <= 100
+
+
+def test_phonetic_matches_homophones():
+    matcher = get_matcher("phonetic")
+    assert matcher.score("Their plain", "there plane") == 100
+
+
+def test_warm_caches_challenge_side():
+    matcher = get_matcher("levenshtein")
+    matcher.warm(["Coffee is best served hot"])
+    assert matcher.challenge("Coffee is best served hot") == "coffee is best served hot"
+
+
+def test_unknown_matcher():
+    with pytest.raises(KeyError):
+        get_matcher("nope")
@@ -0,0 +1,69 @@
+import json
+import time
+
+import pytest
+from starlette.testclient import TestClient
+
+from service.vocaptcha.matchers import get_matcher
+from service.vocaptcha.memo import VerificationMemo
+
+
+def test_hits_and_misses():
+    memo = VerificationMemo(maxsize=2)
+    assert memo.get("a") is None
+    memo.put("a", 90)
+    assert memo.get("a") == 90
+    assert (memo.hits, memo.misses) == (1, 1)
+
+
+def test_lru_eviction():
+    memo = VerificationMemo(maxsize=2)
+    memo.put("a", 1)
+    memo.put("b", 2)
+    memo.get("a")
+    memo.put("c", 3)
+    assert memo.get("b") is None
+    assert memo.get("a") == 1
+    assert memo.evictions == 1
+
+
+def test_ttl_expiry():
+    memo = VerificationMemo(ttl=0.01)
+    memo.put("a", 1)
+    time.sleep(0.02)
+    assert memo.get("a") is None
+    assert len(memo) == 0
+
+
+def test_sync_drops_entries_on_version_change():
+    memo = VerificationMemo()
+    memo.sync(1)
+    memo.put("a", 1)
+    memo.sync(1)
+    assert memo.get("a") == 1
+    memo.sync(2)
+    assert memo.get("a") is None
+
+
+def test_unhashable_challenges_are_scored(make_server):
+    with open("tests/cases/verify_sentences_loose.json") as src:
+        payload = json.load(src)
+    payload["sessionInfo"]["parameters"]["challenge"] = ["the rain", "in spain"]
+    with TestClient(make_server()()) as client:
+        for _ in range(2):
+            response = client.post("/sentences/verify", json=payload)
+            assert response.status_code == 200
+            assert response.json()["sessionInfo"]["parameters"]["challenge-passed"] is False
+
+
+@pytest.mark.parametrize("challenge_response", [["the rain", "in spain"], 42, {"the rain": "in spain"}])
+def test_non_string_responses_are_scored(make_server, challenge_response):
+    with open("tests/cases/verify_sentences_loose.json") as src:
+        payload = json.load(src)
+    payload["sessionInfo"]["parameters"]["challenge-response"] = challenge_response
+    server = make_server()
+    with TestClient(server()) as client:
+        server.registry.get("sentences").matcher = get_matcher("ratio")
+        for route, body in (("/sentences/verify", payload), ("/verify-batch", [payload])):
+            response = client.post(route, json=body)
+            assert response.status_code == 200
@@ -0,0 +1,19 @@
+from service.vocaptcha.metrics import Metrics
+
+
+def test_render_prometheus_text():
+    metrics = Metrics(prefix="test")
+    metrics.describe("requests_total", "counter", "Requests.")
+    metrics.inc("requests_total", (("plugin", "a"),))
+    metrics.inc("requests_total", (("plugin", "a"),))
+    metrics.observe("latency", (("plugin", "a"),), 0.003, buckets=(0.001, 0.01))
+    metrics.gauge("version", lambda: [((), 7)])
+    lines = metrics.render().splitlines()
+    assert "# HELP test_requests_total Requests." in lines
+    assert 'test_requests_total{plugin="a"} 2' in lines
+    assert 'test_latency_bucket{plugin="a",le="0.001"} 0' in lines
+    assert 'test_latency_bucket{plugin="a",le="0.01"} 1' in lines
+    assert 'test_latency_bucket{plugin="a",le="+Inf"} 1' in lines
+    assert 'test_latency_count{plugin="a"} 1' in lines
+    assert "# TYPE test_version gauge" in lines
+    assert "test_version 7" in lines
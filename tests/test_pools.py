@@ -0,0 +1,77 @@
+import io
+import json
+import asyncio
+
+from service.vocaptcha import pools
+from service.vocaptcha.logs import StructuredLogger
+from service.vocaptcha.pools import Challenge, ChallengePool
+
+
+def make_pool(size=4):
+    state = {"version": 1, "made": 0}
+
+    def factory():
+        state["made"] += 1
+        return Challenge(text=str(state["version"]), ssml="", params={})
+
+    pool = ChallengePool(factory, version=lambda: state["version"], size=size)
+    return pool, state
+
+
+def test_pop_from_filled_pool():
+    pool, state = make_pool()
+    pool.fill()
+    assert len(pool) == 4
+    assert pool.pop().text == "1"
+    assert (pool.hits, pool.misses) == (1, 0)
+
+
+def test_empty_pool_generates_inline():
+    pool, state = make_pool()
+    assert pool.pop().text == "1"
+    assert (pool.hits, pool.misses) == (0, 1)
+
+
+def test_version_change_flushes_pool():
+    pool, state = make_pool()
+    pool.fill()
+    state["version"] = 2
+    assert pool.pop().text == "2"
+    assert len(pool) == 0
+    assert pool.flushes == 1
+
+
+def test_background_refill():
+    async def scenario():
+        pool, state = make_pool(size=8)
+        task = asyncio.create_task(pool.run())
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert len(pool) == 8
+        for _ in range(7):
+            pool.pop()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert len(pool) == 8
+        task.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_refill_failures_are_logged(monkeypatch):
+    stream = io.StringIO()
+    monkeypatch.setattr("service.vocaptcha.pools.logger", StructuredLogger(stream=stream))
+
+    def factory():
+        raise KeyError("sentences")
+
+    async def scenario():
+        pool = ChallengePool(factory, version=lambda: 1, size=4)
+        task = asyncio.create_task(pool.run())
+        await asyncio.sleep(0)
+        task.cancel()
+
+    asyncio.run(scenario())
+    pools.logger.close()
+    record = json.loads(stream.getvalue().splitlines()[0])
+    assert record["event"] == "pool_refill_failed" and record["severity"] == "WARNING"
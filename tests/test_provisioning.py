@@ -0,0 +1,187 @@
+import copy
+from collections import Counter
+from types import SimpleNamespace
+
+from google.api_core.exceptions import ServiceUnavailable
+from google.cloud import dialogflowcx_v3 as cx
+
+from service.vocaptcha.admin import VoCaptchaAdmin, ROUTER
+from service.vocaptcha.provisioning import (
+    Provisioner, TokenBucket, diff, CREATE, UPDATE, NOOP, DELETE
+)
+from tests.test_main import factory
+
+AGENT = "projects/p/locations/global/agents/a"
+FLOW = AGENT + "/flows/00000000-0000-0000-0000-000000000000"
+
+
+class FakeCX:
+
+    """
+    Webhooks, Pages and Flows clients backed by dicts.  Counts calls, and
+    fails the first `flaky` mutations with ServiceUnavailable.
+    """
+
+    def __init__(self, flaky=0):
+        self.webhooks = {}
+        self.pages = {}
+        self.flow = cx.Flow(
+            name=FLOW,
+            display_name="Default Start Flow",
+            transition_routes=[cx.TransitionRoute(intent="welcome", trigger_fulfillment={})]
+        )
+        self.calls = Counter()
+        self.flaky = flaky
+        self.ids = 0
+
+    def mutate(self, method):
+        self.calls[method] += 1
+        if self.flaky:
+            self.flaky -= 1
+            raise ServiceUnavailable("try again")
+
+    def store(self, resources, parent, kind, resource):
+        self.ids += 1
+        resource = copy.deepcopy(resource)
+        resource.name = f"{parent}/{kind}/{self.ids}"
+        resources[resource.name] = resource
+        return copy.deepcopy(resource)
+
+    def list_webhooks(self, parent):
+        self.calls["list_webhooks"] += 1
+        return [copy.deepcopy(webhook) for webhook in self.webhooks.values()]
+
+    def create_webhook(self, parent, webhook):
+        self.mutate("create_webhook")
+        return self.store(self.webhooks, parent, "webhooks", webhook)
+
+    def update_webhook(self, webhook):
+        self.mutate("update_webhook")
+        self.webhooks[webhook.name] = copy.deepcopy(webhook)
+        return copy.deepcopy(webhook)
+
+    def delete_webhook(self, name):
+        self.mutate("delete_webhook")
+        del self.webhooks[name]
+
+    def list_pages(self, parent):
+        self.calls["list_pages"] += 1
+        return [copy.deepcopy(page) for page in self.pages.values()]
+
+    def create_page(self, parent, page):
+        self.mutate("create_page")
+        return self.store(self.pages, parent, "pages", page)
+
+    def update_page(self, page):
+        self.mutate("update_page")
+        self.pages[page.name] = copy.deepcopy(page)
+        return copy.deepcopy(page)
+
+    def delete_page(self, name):
+        self.mutate("delete_page")
+        del self.pages[name]
+
+    def get_flow(self, name):
+        self.calls["get_flow"] += 1
+        return copy.deepcopy(self.flow)
+
+    def update_flow(self, flow):
+        self.mutate("update_flow")
+        self.flow = copy.deepcopy(flow)
+        return copy.deepcopy(flow)
+
+
+def make_admin(fake, **options):
+    server = SimpleNamespace(
+        agent_name=AGENT,
+        flow_name=FLOW,
+        plugins=factory.plugins,
+        plugin_instances=factory.plugin_instances
+    )
+    options.setdefault("rate", 1000)
+    options.setdefault("burst", 1000)
+    options.setdefault("sleep", lambda seconds: None)
+    return VoCaptchaAdmin(server, webhooks_client=fake, pages_client=fake, flows_client=fake, **options)
+
+
+def test_diff_actions():
+    plan = diff(
+        "thing",
+        desired={"a": 1, "b": 2, "c": 3},
+        current={"b": 2, "c": 4, "generate-old": 5, "other": 6},
+        equal=lambda desired, current: desired == current,
+        prune=lambda name: name.startswith("generate-")
+    )
+    actions = {change.display_name: change.action for change in plan}
+    assert actions == {"a": CREATE, "b": NOOP, "c": UPDATE, "generate-old": DELETE}
+
+
+def test_token_bucket_waits_for_tokens():
+    now = [0.0]
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    bucket = TokenBucket(rate=2, burst=2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(4):
+        bucket.acquire()
+    assert slept == [0.5, 0.5]
+
+
+def test_provisioner_retries_transient_errors():
+    attempts = Counter()
+
+    def flaky(change):
+        attempts[change.display_name] += 1
+        if attempts[change.display_name] < 3:
+            raise ServiceUnavailable("busy")
+        return "done"
+
+    plan = diff("thing", {"a": 1, "b": 2}, {}, equal=lambda a, b: a == b)
+    provisioner = Provisioner({("thing", CREATE): flaky}, rate=1000, burst=1000, sleep=lambda s: None)
+    provisioner.apply(plan)
+    assert [change.result for change in plan] == ["done", "done"]
+    assert provisioner.retries == 4
+
+
+def test_dry_run_changes_nothing():
+    fake = FakeCX()
+    plan = make_admin(fake).provision(dry_run=True)
+    assert plan.counts()[CREATE] == 2 * len(factory.plugin_instances) * 2 + 2
+    assert not fake.webhooks and not fake.pages
+    assert set(fake.calls) == {"list_webhooks", "list_pages", "get_flow"}
+
+
+def test_provision_then_noop():
+    fake = FakeCX(flaky=3)
+    admin = make_admin(fake)
+    plan = admin.provision()
+    assert not plan.failed
+    count = len(factory.plugin_instances)
+    assert len(fake.webhooks) == 2 * count
+    assert len(fake.pages) == 2 * count + 1
+    # One listing each, however many resources.
+    assert fake.calls["list_webhooks"] == fake.calls["list_pages"] == fake.calls["get_flow"] == 1
+
+    router = next(page for page in fake.pages.values() if page.display_name == ROUTER)
+    targets = {route.target_page for route in router.transition_routes}
+    generate = {page.name for page in fake.pages.values() if page.display_name.startswith("generate-")}
+    assert targets == generate
+    route = fake.flow.transition_routes[0]
+    assert route.target_page == router.name
+    assert "which-challenge" in [spa.parameter for spa in route.trigger_fulfillment.set_parameter_actions]
+
+    again = make_admin(fake).provision()
+    assert again.counts()[NOOP] == len(again)
+
+
+def test_prune_deletes_only_managed():
+    fake = FakeCX()
+    fake.store(fake.webhooks, AGENT, "webhooks", cx.Webhook(display_name="verify-retired"))
+    fake.store(fake.webhooks, AGENT, "webhooks", cx.Webhook(display_name="someone-elses"))
+    make_admin(fake).provision(prune=True)
+    names = {webhook.display_name for webhook in fake.webhooks.values()}
+    assert "verify-retired" not in names
+    assert "someone-elses" in names
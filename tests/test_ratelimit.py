@@ -0,0 +1,50 @@
+import json
+
+from starlette.testclient import TestClient
+
+from service.vocaptcha.ratelimit import RateLimiter, caller_key
+from service.vocaptcha.server import VoCaptchaServer, RateLimitConfig
+
+
+def test_caller_key():
+    with open("tests/cases/verify_sentences_loose.json") as src:
+        body = src.read().encode()
+    assert caller_key(body) == b"dc866c-b2d-dcf-997-af2d90f8f"
+    telephony = json.dumps({"payload": {"telephony": {"caller_id": "+15551234567"}}, "sessionInfo": {}}).encode()
+    assert caller_key(telephony) == b"+15551234567"
+    assert caller_key(b"{}") is None
+
+
+def test_buckets_refill_and_idle_callers_are_evicted():
+    now = [0.0]
+    limiter = RateLimiter(rate=1, burst=2, shards=2, max_callers=4, clock=lambda: now[0])
+    assert [limiter.allow("a") for _ in range(3)] == [True, True, False]
+    now[0] += 1
+    assert limiter.allow("a") and not limiter.allow("a")
+    # Idle for burst / rate seconds: "a" is dropped when its shard is next touched.
+    now[0] += 2
+    for key in range(8):
+        limiter.allow(key)
+    assert "a" not in limiter.shards[hash("a") % 2]
+    assert len(limiter) <= 4
+    assert limiter.evictions == 4
+
+
+def test_over_limit_callers_are_throttled(make_server):
+    server = make_server(rate_limiter=RateLimiter(rate=0.001, burst=1))
+    with open("tests/cases/verify_sentences_loose.json") as src:
+        payload = json.load(src)
+    with TestClient(server()) as client:
+        first = client.post("/sentences/verify", json=payload).json()
+        assert "vocaptcha-rate-limited" not in first["sessionInfo"]["parameters"]
+        second = client.post("/sentences/verify", json=payload).json()
+        assert second["sessionInfo"]["parameters"] == {"vocaptcha-rate-limited": True}
+        assert "vocaptcha_rate_limited_total" in client.get("/metrics").text
+
+
+def test_rate_limit_is_off_unless_configured(config):
+    assert VoCaptchaServer.from_config(config).rate_limiter is None
+    limited = config.copy(update={"rateLimit": RateLimitConfig(rate=1, burst=2)})
+    server = VoCaptchaServer.from_config(limited)
+    assert server.rate_limiter.burst == 2
+    assert server.issued is not None
@@ -0,0 +1,59 @@
+import importlib.metadata
+from types import SimpleNamespace
+
+from starlette.testclient import TestClient
+
+from service.vocaptcha import registry
+from service.vocaptcha.registry import PluginRegistry
+from service.vocaptcha.server import Plugin
+
+
+def test_plugins_load_on_first_request(make_server):
+    server = make_server()
+    assert server.registry.names == ["nato-alphabet", "sentences", "add-two-numbers"]
+    assert not server.registry.loaded
+    with TestClient(server()) as client:
+        assert client.get("/sentences/generate").status_code == 200
+        assert list(server.registry.instances) == ["sentences"]
+        assert client.get("/sentences/verify-batch").status_code == 405
+        assert client.get("/sentences/nope").status_code == 404
+        assert client.get("/nope/generate").status_code == 404
+        assert list(server.registry.instances) == ["sentences"]
+
+
+def test_entry_points(monkeypatch):
+    found = [SimpleNamespace(name="nato-alphabet", value="service.plugins.nato_alpha:NATOAlphaPlugin")]
+    monkeypatch.setattr(
+        importlib.metadata,
+        "entry_points",
+        lambda: SimpleNamespace(select=lambda group: found if group == registry.ENTRY_POINT_GROUP else [])
+    )
+    loaded = []
+
+    def factory(plugin_class):
+        loaded.append(plugin_class)
+        return SimpleNamespace(type=plugin_class.TYPE)
+
+    plugins = PluginRegistry.from_config([], "plugins", factory=factory, entry_point_group=registry.ENTRY_POINT_GROUP)
+    assert plugins.names == ["nato-alphabet"]
+    assert not loaded
+    plugins.get("nato-alphabet")
+    assert [cls.__name__ for cls in loaded] == ["NATOAlphaPlugin"]
+
+
+def test_nested_mounts(make_server):
+    server = make_server(plugins=[Plugin(module="sentences", cls="SentencesPlugin", mount="/v2/sentences")])
+    assert server.registry.names == ["v2/sentences"]
+    with TestClient(server()) as client:
+        assert client.get("/v2/sentences/generate").status_code == 200
+        assert client.post("/v2/sentences/verify-batch", json=[]).status_code == 200
+        assert client.get("/sentences/generate").status_code == 404
+        assert client.get("/v2/generate").status_code == 404
+
+
+def test_nested_mounts_are_labelled_in_metrics(make_server):
+    server = make_server(plugins=[Plugin(module="sentences", cls="SentencesPlugin", mount="/v2/sentences")])
+    with TestClient(server()) as client:
+        client.get("/v2/sentences/generate")
+        text = client.get("/metrics").text
+    assert 'vocaptcha_requests_total{plugin="v2/sentences",action="generate",status="200"}' in text
@@ -0,0 +1,94 @@
+import io
+import json
+import time
+
+from service.vocaptcha import shared
+from service.vocaptcha.backends import MemoryBackend
+from service.vocaptcha.cache import ResponseCache
+from service.vocaptcha.corpus import BufferShard
+from service.vocaptcha.logs import StructuredLogger
+from service.vocaptcha.shared import MappedSnapshot, SharedBackend, write_snapshot
+
+DOCUMENTS = {
+    "sentences": {"shards": {"challenges": ["sentences-a"]}, "templates": {"generate": {"text": "{sentence}"}}},
+    "sentences-a": {"text": "naïve café\nsecond"},
+    "nato": {"challenges": {"a": ["alpha"]}},
+}
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot")
+    write_snapshot(path, 7, DOCUMENTS)
+    snapshot = MappedSnapshot(path)
+    assert snapshot.version == 7
+    assert snapshot.mapped == {"sentences-a"}
+    assert snapshot.documents["nato"] == DOCUMENTS["nato"]
+    text = snapshot.documents["sentences-a"]["text"]
+    assert isinstance(text, BufferShard)
+    assert list(text) == ["naïve café", "second"]
+    assert text[1] == "second"
+
+
+def test_one_publisher_many_readers(tmp_path):
+    path = str(tmp_path / "snapshot")
+    source = MemoryBackend(DOCUMENTS)
+    caches, backends = [], []
+    for _ in range(2):
+        cache = ResponseCache()
+        seen = []
+        cache.register("sentences", lambda document, seen=seen: seen.append(list(document["challenges"])), key="k")
+        backend = SharedBackend(path, source=lambda: source, interval=0.01, takeover=0.05)
+        cache.watch(backend, timeout=1)
+        caches.append((cache, seen))
+        backends.append(backend)
+    leader, reader = backends
+    assert leader.leader and not reader.leader
+    for cache, seen in caches:
+        assert seen[-1] == ["naïve café", "second"]
+
+    source.set("nato", {"challenges": {"b": ["bravo"]}})
+    for cache, seen in caches:
+        wait_for(lambda: "b" in cache.get("nato")["challenges"])
+
+    leader.close()
+    wait_for(lambda: reader.leader)
+    reader.close()
+
+
+def test_unrelated_edits_leave_sharded_documents_alone(tmp_path):
+    source = MemoryBackend(DOCUMENTS)
+    cache = ResponseCache()
+    cache.register("sentences", lambda document: list(document["challenges"]), key="k")
+    backend = SharedBackend(str(tmp_path / "snapshot"), source=lambda: source, interval=0.01)
+    cache.watch(backend, timeout=1)
+    materialized = cache.derived("k")
+    version = cache.document_version("sentences")
+
+    source.set("nato", {"challenges": {"b": ["bravo"]}})
+    wait_for(lambda: "b" in cache.get("nato")["challenges"])
+    assert cache.derived("k") is materialized
+    assert cache.document_version("sentences") == version
+
+    source.set("sentences-a", {"text": "third"})
+    wait_for(lambda: cache.derived("k") == ["third"])
+    backend.close()
+
+
+def test_unreadable_snapshots_are_logged(tmp_path, monkeypatch):
+    stream = io.StringIO()
+    monkeypatch.setattr("service.vocaptcha.shared.logger", StructuredLogger(stream=stream))
+    path = tmp_path / "snapshot"
+    path.write_bytes(b"not a snapshot" * 4)
+    backend = SharedBackend(str(path), source=lambda: MemoryBackend(DOCUMENTS), interval=0)
+    backend.watch(lambda changes: None)
+    backend.close()
+    shared.logger.close()
+    record = json.loads(stream.getvalue().splitlines()[0])
+    assert record["event"] == "snapshot_replaced" and record["path"] == str(path)
@@ -0,0 +1,173 @@
+import os
+import json
+import shutil
+from types import SimpleNamespace
+
+from service import staging
+from service.staging import (
+    VoCaptchaDataManager, document_hash, UNCHANGED, CHANGED, MISSING
+)
+from service.vocaptcha.backends import MemoryBackend, plugin_document_path
+from service.vocaptcha.cache import ResponseCache
+from service.vocaptcha.server import VoCaptchaManager
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.collections = {}
+        self.reads = 0
+        self.commits = 0
+
+    def collection(self, name):
+        return self.collections.setdefault(name, FakeCollection(self, name))
+
+    def get_all(self, refs, field_paths=None):
+        self.reads += 1
+        for ref in refs:
+            document = ref.parent.documents.get(ref.id)
+            yield SimpleNamespace(id=ref.id, exists=document is not None, to_dict=lambda document=document: document)
+
+    def batch(self):
+        client = self
+        writes = []
+
+        class Batch:
+            def set(self, ref, document):
+                writes.append((ref, document))
+
+            def delete(self, ref):
+                writes.append((ref, None))
+
+            def commit(self):
+                client.commits += 1
+                for ref, document in writes:
+                    if document is None:
+                        ref.parent.documents.pop(ref.id, None)
+                    else:
+                        ref.parent.documents[ref.id] = json.loads(json.dumps(document))
+
+        return Batch()
+
+
+class FakeCollection:
+
+    def __init__(self, client, name):
+        self._client = client
+        self._path = (name,)
+        self.id = name
+        self.documents = {}
+
+    def document(self, doc_id):
+        return SimpleNamespace(id=doc_id, parent=self)
+
+
+def make_manager():
+    config = VoCaptchaManager(path="service/vocaptcha.yaml", backend="memory").config
+    client = FakeClient()
+    config.collection = client.collection("plugins")
+    return VoCaptchaDataManager(config), client
+
+
+def test_document_hash_ignores_key_order():
+    assert document_hash({"a": 1, "b": [1, 2]}) == document_hash({"b": [1, 2], "a": 1})
+    assert document_hash({"a": 1}) != document_hash({"a": 2})
+    assert document_hash(None) is None
+
+
+def test_sync_writes_only_changes_and_backs_up():
+    data, client = make_manager()
+    coll = data.collection
+    assert {status.state for status in data.diff()} == {MISSING}
+
+    written = data.load_plugin_documents()
+    assert len(written) == len(data.plugin_classes)
+    assert client.commits == 1
+    assert not client.collection("plugins-backup").documents
+
+    assert data.load_plugin_documents() == []
+    assert client.commits == 1
+    assert {status.state for status in data.diff()} == {UNCHANGED}
+
+    doc_id = data.plugin_classes[0].DOC
+    old = dict(coll.documents[doc_id], edited=True)
+    coll.documents[doc_id] = old
+    states = {status.doc_id: status.state for status in data.diff()}
+    assert states[doc_id] == CHANGED
+
+    written = data.load_plugin_documents()
+    assert [status.doc_id for status in written] == [doc_id]
+    assert client.collections["plugins-backup"].documents[doc_id] == old
+    assert "edited" not in coll.documents[doc_id]
+
+
+def test_check_many_collections():
+    data, client = make_manager()
+    other = client.collection("plugins-staging")
+    data.load_plugin_documents()
+    report = data.check([data.collection, other])
+    assert {status.state for status in report["plugins"]} == {UNCHANGED}
+    assert {status.state for status in report["plugins-staging"]} == {MISSING}
+
+
+def local_plugins(monkeypatch, tmp_path):
+    """
+    Points staging at copies of the plugin documents so importing doesn't
+    touch service/plugins.
+    """
+    def document_path(plugin):
+        target = tmp_path / os.path.basename(plugin_document_path(plugin))
+        if not target.exists():
+            shutil.copy(plugin_document_path(plugin), target)
+        return str(target)
+
+    monkeypatch.setattr(staging, "plugin_document_path", document_path)
+    monkeypatch.setattr(staging, "plugin_shard_folder", lambda plugin: document_path(plugin)[:-5] + ".shards")
+    return document_path
+
+
+def test_import_corpus_and_load_shards(monkeypatch, tmp_path):
+    document_path = local_plugins(monkeypatch, tmp_path)
+    data, client = make_manager()
+    source = tmp_path / "corpus.csv"
+    source.write_text("\n".join(["text"] + [f"Sentence {n % 150}" for n in range(300)]) + "\n")
+
+    stats = data.import_corpus("sentences", [str(source)], column="text", append=True, shard_bytes=400)
+    assert stats["entries"] == 150 + 5
+    assert (stats["existing"], stats["read"], stats["added"]) == (5, 300, 150)
+    assert stats["shards"] > 1
+    plugin = data.plugin_class("sentences")
+    with open(document_path(plugin)) as src:
+        document = json.load(src)
+    assert "challenges" not in document
+    assert len(document["shards"]["challenges"]) == stats["shards"]
+
+    written = data.load_plugin_documents()
+    status = next(status for status in written if status.doc_id == "sentences")
+    assert len(status.missing_shards) == stats["shards"]
+    assert {status.state for status in data.diff()} == {UNCHANGED}
+
+    # The uploaded documents resolve back into the whole corpus.
+    cache = ResponseCache()
+    seen = []
+    cache.register("sentences", lambda document: seen.append(len(document["challenges"])), key="k")
+    cache.watch(MemoryBackend(data.collection.documents), timeout=1)
+    assert seen == [155]
+
+    # Re-sharding replaces every shard; prune deletes the old ones.
+    old_shards = set(document["shards"]["challenges"])
+    data.import_corpus("sentences", [str(source)], column="text", shard_bytes=10_000)
+    data.load_plugin_documents(prune=True)
+    remote = data.collection.documents
+    assert not old_shards & set(remote)
+    assert all(shard in remote for shard in remote["sentences"]["shards"]["challenges"])
+
+
+def test_import_corpus_append_counts_existing_entries_apart(monkeypatch, tmp_path):
+    local_plugins(monkeypatch, tmp_path)
+    data, client = make_manager()
+    source = tmp_path / "corpus.txt"
+    source.write_text("coffee is best served hot\nA new sentence\n\nA NEW SENTENCE\n")
+
+    stats = data.import_corpus("sentences", [str(source)], append=True)
+    assert stats == {"read": 4, "added": 1, "existing": 5, "entries": 6, "shards": 1}
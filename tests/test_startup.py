@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Generous defaults so a loaded CI machine doesn't flake; tighten locally
+# with VOCAPTCHA_IMPORT_BUDGET / VOCAPTCHA_STARTUP_BUDGET (seconds).
+IMPORT_BUDGET = float(os.environ.get("VOCAPTCHA_IMPORT_BUDGET", 3.0))
+STARTUP_BUDGET = float(os.environ.get("VOCAPTCHA_STARTUP_BUDGET", 1.0))
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.app()
+built = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "startup": built - imported,
+    "cx": any(name.startswith("google.cloud.dialogflowcx") for name in sys.modules),
+}))
+"""
+
+
+def probe():
+    """
+    Imports service/main.py the way the container does (cwd service/, a
+    fresh interpreter) with the memory backend, and builds the app.
+    """
+    env = dict(os.environ, VOCAPTCHA_BACKEND="memory", PYTHONPATH=ROOT)
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=os.path.join(ROOT, "service"),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_cold_start_budget():
+    timings = probe()
+    assert not timings["cx"], "serving imported the Dialogflow CX client library"
+    assert timings["import"] < IMPORT_BUDGET, timings
+    assert timings["startup"] < STARTUP_BUDGET, timings
@@ -0,0 +1,59 @@
+import pytest
+
+from service.vocaptcha.cache import ResponseCache
+from service.vocaptcha.backends import MemoryBackend
+from service.vocaptcha.templates import Template, TemplateError, compile_templates
+
+
+@pytest.mark.parametrize("source, values", [
+    ("Please repeat: {sentence}", {"sentence": "Coffee is best served hot"}),
+    ("{num1} + {num2} = ?", {"num1": 3, "num2": 4}),
+    ("{{literal}} {a!r} {b:>5}.", {"a": "x", "b": 7}),
+    ("", {}),
+])
+def test_render_matches_str_format(source, values):
+    assert Template(source).render(**values) == source.format(**values)
+
+
+def test_format_alias():
+    assert Template("{a}").format(a=1) == "1"
+
+
+def test_unknown_placeholder_is_reported_at_compile_time():
+    with pytest.raises(TemplateError):
+        compile_templates(
+            {"generate": {"text": "Repeat: {sentense}"}},
+            {"generate": ("sentence",)}
+        )
+
+
+@pytest.mark.parametrize("source", ["{}", "{0}", "{a.b}", "{a:{b}}", "{a"])
+def test_unsupported_templates(source):
+    with pytest.raises(TemplateError):
+        Template(source)
+
+
+def test_malformed_ssml_is_reported():
+    with pytest.raises(TemplateError):
+        compile_templates({"generate": {"ssml": "<prosody rate='slow'>{a}"}})
+    compile_templates({"generate": {"ssml": "<prosody rate='slow'>{a}</prosody>"}})
+
+
+def test_bad_template_edit_keeps_previous_version():
+    from service.plugins.sentences import SentencesPlugin
+
+    document = {
+        "challenges": ["a"],
+        "templates": {"generate": {"text": "{sentence}", "ssml": "{sentence}"}}
+    }
+    backend = MemoryBackend({"sentences": document})
+    cache = ResponseCache()
+    plugin = SentencesPlugin(cache=cache)
+    cache.watch(backend, timeout=1)
+    compiled = plugin.get_templates()
+
+    backend.set("sentences", {
+        "challenges": ["a"],
+        "templates": {"generate": {"text": "{phrase}", "ssml": "{sentence}"}}
+    })
+    assert plugin.get_templates() is compiled
@@ -0,0 +1,77 @@
+import io
+import json
+
+from service.vocaptcha import warm
+from service.vocaptcha.backends import CacheBackend, MemoryBackend
+from service.vocaptcha.cache import ResponseCache
+from service.vocaptcha.corpus import BufferShard
+from service.vocaptcha.logs import StructuredLogger
+from service.vocaptcha.shared import MappedSnapshot, write_snapshot
+from service.vocaptcha.warm import WarmBackend
+
+DOCUMENTS = {
+    "sentences": {"shards": {"challenges": ["sentences-a"]}},
+    "sentences-a": {"text": "first\nsecond"},
+    "nato": {"challenges": {"a": ["alpha"]}},
+    "retired": {"challenges": {}},
+}
+
+
+class SlowBackend(CacheBackend):
+
+    """
+    A source whose first delivery only arrives when the test sends it.
+    """
+
+    def watch(self, callback):
+        self.callback = callback
+
+
+def test_serves_warm_snapshot_then_revalidates(tmp_path):
+    path = str(tmp_path / "warm")
+    write_snapshot(path, 3, DOCUMENTS)
+    source = SlowBackend()
+    backend = WarmBackend(path, source)
+    cache = ResponseCache()
+    materialized = []
+    cache.register("sentences", lambda document: materialized.append(list(document["challenges"])), key="k")
+    cache.watch(backend, timeout=0)
+    assert cache.get("nato") == {"challenges": {"a": ("alpha",)}}
+    assert isinstance(cache.get("sentences-a")["text"], BufferShard)
+    assert backend.stale_since is not None
+    version = cache.version
+
+    live = dict(DOCUMENTS, nato={"challenges": {"b": ["bravo"]}})
+    del live["retired"]
+    source.callback(live)
+    assert backend.stale_since is None
+    # Only what differs from the snapshot is applied.
+    assert cache.version == version + 1
+    assert cache.get("nato") == {"challenges": {"b": ("bravo",)}}
+    assert "retired" not in cache.cache
+    assert materialized == [["first", "second"]]
+
+    saved = MappedSnapshot(path, verify=True)
+    assert saved.version == 4
+    assert set(saved.documents) == {"sentences", "sentences-a", "nato"}
+    assert list(saved.documents["sentences-a"]["text"]) == ["first", "second"]
+
+
+def test_corrupt_snapshot_waits_for_source(tmp_path, monkeypatch):
+    stream = io.StringIO()
+    monkeypatch.setattr("service.vocaptcha.warm.logger", StructuredLogger(stream=stream))
+    path = tmp_path / "warm"
+    write_snapshot(str(path), 1, DOCUMENTS)
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xff
+    path.write_bytes(bytes(data))
+
+    backend = WarmBackend(str(path), MemoryBackend({"nato": DOCUMENTS["nato"]}))
+    cache = ResponseCache()
+    cache.watch(backend, timeout=1)
+    assert set(cache.cache) == {"nato"}
+    assert backend.stale_since is None
+    assert set(MappedSnapshot(str(path), verify=True).documents) == {"nato"}
+    warm.logger.close()
+    record = json.loads(stream.getvalue().splitlines()[0])
+    assert record["event"] == "warm_snapshot_ignored" and record["severity"] == "WARNING"
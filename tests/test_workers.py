@@ -0,0 +1,37 @@
+import asyncio
+import threading
+
+from service.vocaptcha.matchers import get_matcher
+from service.vocaptcha.workers import WorkerPool, PROCESS, THREAD
+
+PAIRS = [("the rain in spain", "the rain in spain"), ("pack my box", "pick my fox"), ("abc", None)]
+
+
+def thread_name(*args):
+    return threading.current_thread().name
+
+
+def test_only_large_inputs_leave_the_loop():
+    async def scenario():
+        pool = WorkerPool(THREAD, workers=1, cutoff=100)
+        try:
+            assert await pool.run(thread_name, size=99) == threading.current_thread().name
+            assert (await pool.run(thread_name, size=100)).startswith("worker-pool")
+            assert pool.queued == 0
+        finally:
+            pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_process_pool_scores_like_the_matcher():
+    matcher = get_matcher("levenshtein")
+
+    async def scenario():
+        pool = WorkerPool(PROCESS, workers=1, cutoff=0)
+        try:
+            return await pool.run(matcher.score_batch, PAIRS, size=1)
+        finally:
+            pool.shutdown()
+
+    assert asyncio.run(scenario()) == matcher.score_batch(PAIRS)